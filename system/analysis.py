@@ -7,6 +7,7 @@ from pathlib import Path
 from dataclasses import dataclass
 from typing import List
 import pandas as pd
+import numpy as np
 from tqdm.auto import tqdm
 import re
 import os
@@ -15,6 +16,7 @@ import moviepy.tools
 import moviepy.config
 import json
 import bbox
+import frame_timestamps
 import cv2
 import logging
 events_log_filename = "events.csv"
@@ -60,6 +62,28 @@ def read_timeseries_csv(path: Path, time_col="time", tz="utc") -> pd.DataFrame:
     return df
 
 
+def read_timestamps_file(path: Path, tz="utc") -> pd.DataFrame:
+    """
+    Read a binary frame timestamps file (see frame_timestamps) into a pandas DataFrame with a DatetimeIndex of the
+    frame timestamps, and frame, arrival_time and dropped_before columns. The file is memory-mapped rather than
+    parsed.
+
+    - path: timestamps file path
+    - tz: The timezone of the timestamps (see DatetimeIndex.tz_localize)
+    """
+    records = frame_timestamps.read_timestamps(path)
+    df = pd.DataFrame(
+        {
+            "frame": records["frame"],
+            "arrival_time": records["arrival_time"],
+            "dropped_before": records["dropped_before"],
+        },
+        index=pd.to_datetime(records["timestamp"], unit="s").tz_localize(tz),
+    )
+    df.index.name = "timestamp"
+    return df
+
+
 def is_timestamp_contained(
     tdf: pd.DataFrame, timestamp: pd.Timestamp, time_col=None
 ) -> bool:
@@ -253,15 +277,20 @@ def read_database_table(conn, table: str, t0: pd.Timestamp, t1: pd.Timestamp):
 class VideoInfo:
     """
     Represents a single timestamped video file.
-    Expects a timestamps csv file in the same directory with the same name
-    as the video file but with a `.csv` suffix
+    Expects a timestamps file in the same directory with the same name
+    as the video file, either a binary file with a `.timestamps` suffix
+    (see frame_timestamps) or a csv file with a `.csv` suffix.
 
     Attributes:
         name: Video name (string)
         time: Video start time
         path: Video path
-        timestamp_path: Timestamps csv path
-        timestamps: The timestamps csv loaded using read_timeseries_csv()
+        timestamp_path: Timestamps file path
+        frames: The memory-mapped records of a binary timestamps file (see
+                frame_timestamps.read_timestamps()), or None
+        timestamps: The timestamps loaded using read_timestamps_file() or
+                    read_timeseries_csv(). Binary timestamps files are loaded
+                    on first access.
         frame_count: Number of frames in the video (based on the timestamps file)
         duration: The total duration of the video (based on the timestamps file)
         src_id: The video image source id (based on the name attribute).
@@ -271,6 +300,7 @@ class VideoInfo:
     time: pd.Timestamp
     path: Path
     timestamp_path: Path
+    frames: np.ndarray
     timestamps: pd.DataFrame
     metadata_path: Path
     metadata: dict
@@ -285,23 +315,36 @@ class VideoInfo:
         self.name, self.time = split_name_datetime(path.stem)
         self.time = self.time.tz_localize(name_locale).tz_convert("utc")
 
-        self.timestamp_path = path.parent / (path.stem + ".csv")
-        if not self.timestamp_path.exists():
-            self.timestamp_path = None
-            self.duration = None
-            self.timestamps = None
-            self.frame_count = None
-        else:
+        self.frames = None
+        self._timestamps = None
+        self.duration = None
+        self.frame_count = None
+
+        self.timestamp_path = frame_timestamps.timestamps_path(path)
+        if self.timestamp_path.exists():
             try:
-                self.timestamps = read_timeseries_csv(
-                    self.timestamp_path, time_col=["time", "timestamp"]
-                )
-                self.duration = self.timestamps.index[-1] - self.timestamps.index[0]
-                self.frame_count = self.timestamps.shape[0]
+                self.frames = frame_timestamps.read_timestamps(self.timestamp_path)
+                self.frame_count = len(self.frames)
+                if self.frame_count > 0:
+                    self.duration = pd.Timedelta(
+                        self.frames["timestamp"][-1] - self.frames["timestamp"][0],
+                        unit="s",
+                    )
             except Exception:
-                log.exception(f"Error reading timestamps csv {self.timestamp_path}:")
-                self.duration = None
-                self.frame_count = None
+                log.exception(f"Error reading timestamps file {self.timestamp_path}:")
+        else:
+            self.timestamp_path = path.parent / (path.stem + ".csv")
+            if not self.timestamp_path.exists():
+                self.timestamp_path = None
+            else:
+                try:
+                    self._timestamps = read_timeseries_csv(
+                        self.timestamp_path, time_col=["time", "timestamp"]
+                    )
+                    self.duration = self._timestamps.index[-1] - self._timestamps.index[0]
+                    self.frame_count = self._timestamps.shape[0]
+                except Exception:
+                    log.exception(f"Error reading timestamps csv {self.timestamp_path}:")
 
         self.metadata_path = path.parent / (path.stem + ".json")
         if not self.metadata_path.exists():
@@ -320,6 +363,13 @@ class VideoInfo:
                 -1
             ]  # NOTE: what happens when both src_id and name have underscores?
 
+    @property
+    def timestamps(self) -> pd.DataFrame:
+        if self._timestamps is None and self.frames is not None:
+            self._timestamps = read_timestamps_file(self.timestamp_path)
+
+        return self._timestamps
+
     def __repr__(self):
         return f"\nVideoInfo(name: {self.name},\n\ttime: {self.time},\n\tpath: {self.path},\n\ttimestamp_path: {self.timestamp_path},\n\tframe_count: {self.frame_count},\n\tduration: {self.duration})\n\tmetadata: {self.metadata}"
 
@@ -397,7 +447,7 @@ class SessionInfo:
         for p in tqdm(list(session_dir.glob("*.mp4")) + list(session_dir.glob("*.avi"))):
             self.videos.append(VideoInfo(p))
 
-        ts_paths = [v.timestamp_path for v in self.videos]
+        ts_paths = [v.path.parent / (v.path.stem + ".csv") for v in self.videos]
         self.csvs = []
         for csv_path in tqdm([p for p in session_dir.glob("*.csv") if p not in ts_paths]):
             if events_log_filename in csv_path.name:
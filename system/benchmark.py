@@ -0,0 +1,467 @@
+"""
+Video system benchmark.
+
+Boots the video system without the web server, arena or experiment modules, runs a list of benchmark scenarios
+using SyntheticImageSources (see image_sources/synthetic_source.py), and writes a JSON report with detailed
+results and a CSV report with one summary row per scenario.
+
+Run from the system directory: 'python benchmark.py -h' for help about command line arguments.
+
+Each scenario is a dict with any of the keys of `default_scenario` (missing keys use the default values):
+- sources: The number of image sources.
+- image_shape: The image shape of each source, e.g. [1080, 1440] or [1080, 1440, 3].
+- dtype: "uint8" or "uint16".
+- frame_rate: Source frame rate, or null to acquire as fast as possible.
+- writer: Whether to record a video from each source.
+- histogram: Whether to run a HistogramObserver on each source.
+- listeners: The number of main process listeners added to each histogram observer.
+- encoding_config: The video_record encoding config used by the video writers.
+- source_params: Additional SyntheticImageSource params.
+- observer_params: Additional HistogramObserver params (e.g. workers, batch_size).
+
+Scenarios are read from a JSON file containing a list of scenario dicts (--scenarios), otherwise
+`default_scenarios` are used.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing as mp
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+import psutil
+
+import configure
+import managed_state
+import rl_logging
+import video_system
+from json_convert import json_convert
+
+
+default_scenario = {
+    "sources": 1,
+    "image_shape": [1080, 1440],
+    "dtype": "uint8",
+    "frame_rate": 60,
+    "writer": True,
+    "histogram": True,
+    "listeners": 1,
+    "encoding_config": "cpu",
+    "source_params": {},
+    "observer_params": {},
+}
+
+default_scenarios = [
+    *[
+        {"sources": n, "dtype": dtype}
+        for n in (1, 2, 4)
+        for dtype in ("uint8", "uint16")
+    ],
+    {"sources": 1, "frame_rate": 200, "writer": False},
+    {"sources": 1, "frame_rate": 200, "writer": False, "listeners": 4},
+]
+
+
+def scenario_name(sc):
+    shape = "x".join(str(d) for d in reversed(sc["image_shape"][:2]))
+    if len(sc["image_shape"]) == 3:
+        shape += f"x{sc['image_shape'][2]}"
+
+    fps = "max" if not sc["frame_rate"] else str(sc["frame_rate"])
+    name = f"{sc['sources']}src-{shape}-{sc['dtype']}-{fps}fps"
+    if sc["writer"]:
+        name += "-write"
+    if sc["histogram"]:
+        name += f"-hist-{sc['listeners']}ls"
+    return name
+
+
+def make_video_config(sc):
+    """
+    Return a video config dict for the supplied scenario.
+    """
+    image_sources = {}
+    image_observers = {}
+
+    for i in range(sc["sources"]):
+        src_id = f"synth{i}"
+        image_sources[src_id] = {
+            "class": "image_sources.synthetic_source.SyntheticImageSource",
+            "image_shape": sc["image_shape"],
+            "buf_dtype": sc["dtype"],
+            "frame_rate": sc["frame_rate"],
+            "encoding_config": sc["encoding_config"],
+            "seed": i,
+            **sc["source_params"],
+        }
+
+        if sc["histogram"]:
+            image_observers[f"hist{i}"] = {
+                "class": "image_observers.histogram.HistogramObserver",
+                "src_id": src_id,
+                **sc["observer_params"],
+            }
+
+    return {"image_sources": image_sources, "image_observers": image_observers}
+
+
+class ProcessMonitor:
+    """
+    Measure the cpu usage and memory of a set of processes over a time window. Child processes (e.g. observer
+    workers) are included in their parent's measurements unless they're monitored on their own.
+    """
+
+    def __init__(self, pids: dict):
+        """
+        Args:
+        - pids: A dict of process names to pids.
+        """
+        self.procs = {name: psutil.Process(pid) for name, pid in pids.items()}
+
+    def _tree(self, proc):
+        # child processes that are monitored on their own are not included
+        pids = set(p.pid for p in self.procs.values())
+        return [proc] + [p for p in proc.children(recursive=True) if p.pid not in pids]
+
+    def _cpu_times(self):
+        times = {}
+        for name, proc in self.procs.items():
+            try:
+                total = 0
+                for p in self._tree(proc):
+                    t = p.cpu_times()
+                    total += t.user + t.system
+                times[name] = total
+            except psutil.NoSuchProcess:
+                times[name] = None
+        return times
+
+    def start(self):
+        self.start_time = time.time()
+        self.start_cpu = self._cpu_times()
+
+    def stop(self):
+        """
+        Return a dict of process names to dicts with the cpu usage (percent of a single core) since start() was
+        called, and the current resident memory in MB.
+        """
+        dt = time.time() - self.start_time
+        end_cpu = self._cpu_times()
+        results = {}
+        for name, proc in self.procs.items():
+            try:
+                rss = sum(p.memory_info().rss for p in self._tree(proc))
+            except psutil.NoSuchProcess:
+                rss = None
+
+            if self.start_cpu[name] is None or end_cpu[name] is None:
+                cpu = None
+            else:
+                cpu = (end_cpu[name] - self.start_cpu[name]) / dt * 100
+
+            results[name] = {
+                "cpu_percent": cpu,
+                "rss_mb": None if rss is None else rss / 2**20,
+            }
+        return results
+
+
+def wait_for_state(state, paths, value, timeout):
+    """
+    Wait until all state paths have the supplied value. Return False on timeout.
+    """
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        if all(state.get(path, None) == value for path in paths):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def stage_count(stats, stage):
+    return int(stats._count[stats.stage_names.index(stage)])
+
+
+def run_scenario(state, sc, duration, warmup, log):
+    video_system.update_video_config(make_video_config(sc), save=False)
+    sources = video_system.image_sources
+    observers = video_system.image_observers
+    writers = video_system.video_writers if sc["writer"] else {}
+
+    if not wait_for_state(
+        state, [("video", "image_sources", id, "acquiring") for id in sources], True, 30
+    ):
+        raise Exception("Timeout while waiting for image sources to start acquiring")
+
+    listener_calls = [0] * (len(observers) * sc["listeners"])
+
+    def make_listener(i):
+        def listener(output, timestamp):
+            listener_calls[i] += 1
+
+        return listener
+
+    remove_listeners = []
+    for obs_idx, obs in enumerate(observers.values()):
+        for i in range(sc["listeners"]):
+            listener_idx = obs_idx * sc["listeners"] + i
+            remove_listeners.append(obs.add_listener(make_listener(listener_idx)))
+
+    for obs in observers.values():
+        obs.start_observing()
+    for w in writers.values():
+        w.start_observing()
+
+    time.sleep(warmup)
+
+    monitor = ProcessMonitor(
+        {
+            "main": psutil.Process().pid,
+            **{f"source:{id}": src.pid for id, src in sources.items()},
+            **{f"observer:{id}": obs.pid for id, obs in observers.items()},
+            **{f"writer:{id}": w.pid for id, w in writers.items()},
+        }
+    )
+
+    def snapshot():
+        return {
+            "time": time.time(),
+            "sources": {id: src.frame_buf.last_seq() for id, src in sources.items()},
+            "observers": {
+                id: stage_count(obs.stats, "process") for id, obs in observers.items()
+            },
+            "writers": {id: stage_count(w.stats, "encode") for id, w in writers.items()},
+            "listener_calls": sum(listener_calls),
+        }
+
+    monitor.start()
+    start = snapshot()
+    time.sleep(duration)
+    end = snapshot()
+    processes = monitor.stop()
+
+    for remove_listener in remove_listeners:
+        remove_listener()
+    for obs in observers.values():
+        obs.stop_observing()
+    for w in writers.values():
+        w.stop_observing()
+
+    if not wait_for_state(
+        state,
+        [("video", "image_observers", id, "observing") for id in observers]
+        + [("video", "image_sources", id, "writing") for id in writers],
+        False,
+        60,
+    ):
+        log.warning("Timeout while waiting for observers to stop")
+
+    dt = end["time"] - start["time"]
+
+    def rate(kind, id):
+        return (end[kind][id] - start[kind][id]) / dt
+
+    latency = video_system.get_latency_stats()
+
+    results = {
+        "name": scenario_name(sc),
+        "scenario": sc,
+        "duration": dt,
+        "sources": {
+            id: {"fps": rate("sources", id), "latency": latency["image_sources"][id]}
+            for id in sources
+        },
+        "observers": {
+            id: {
+                "fps": rate("observers", id),
+                "latency": latency["image_observers"][id],
+            }
+            for id in observers
+        },
+        "writers": {
+            id: {"fps": rate("writers", id), "latency": latency["video_writers"][id]}
+            for id in writers
+        },
+        "listener_calls_per_sec": (end["listener_calls"] - start["listener_calls"])
+        / dt,
+        "processes": processes,
+    }
+    return results
+
+
+def summary_row(res):
+    """
+    Return a flat dict summarizing a scenario result for the CSV report.
+    """
+
+    def agg(items, fn, default=None):
+        items = [x for x in items if x is not None]
+        return fn(items) if len(items) > 0 else default
+
+    def p99(group, stage):
+        return agg(
+            [
+                r["latency"]["stages"][stage].get("p99_ms")
+                for r in res[group].values()
+            ],
+            max,
+        )
+
+    def counter(group, name):
+        return agg(
+            [r["latency"]["counters"][name] for r in res[group].values()], sum, 0
+        )
+
+    sc = res["scenario"]
+    return {
+        "name": res["name"],
+        "sources": sc["sources"],
+        "image_shape": "x".join(str(d) for d in sc["image_shape"]),
+        "dtype": sc["dtype"],
+        "target_fps": sc["frame_rate"],
+        "min_source_fps": agg([r["fps"] for r in res["sources"].values()], min),
+        "capture_to_write_p99_ms": p99("sources", "capture_to_write"),
+        "min_observer_fps": agg([r["fps"] for r in res["observers"].values()], min),
+        "observer_dropped_frames": counter("observers", "dropped_frames"),
+        "observer_frame_to_output_p99_ms": p99("observers", "frame_to_output"),
+        "listener_calls_per_sec": res["listener_calls_per_sec"],
+        "min_writer_fps": agg([r["fps"] for r in res["writers"].values()], min),
+        "writer_dropped_frames": counter("writers", "dropped_frames"),
+        "writer_dropped_writes": counter("writers", "dropped_writes"),
+        "writer_torn_writes": counter("writers", "torn_writes"),
+        "writer_max_queued_items": agg(
+            [
+                r["latency"]["counters"]["max_queued_items"]
+                for r in res["writers"].values()
+            ],
+            max,
+        ),
+        "writer_frame_to_encoded_p99_ms": p99("writers", "frame_to_encoded"),
+        "total_cpu_percent": agg(
+            [p["cpu_percent"] for p in res["processes"].values()], sum
+        ),
+        "total_rss_mb": agg([p["rss_mb"] for p in res["processes"].values()], sum),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="ReptiLearn video system benchmark")
+    arg_parser.add_argument(
+        "--config",
+        default="config",
+        help="The name of a config module residing in the ./config/ directory",
+    )
+    arg_parser.add_argument(
+        "--scenarios", help="A JSON file containing a list of scenario dicts"
+    )
+    arg_parser.add_argument(
+        "--duration", type=float, default=10, help="Measurement duration of each scenario in seconds"
+    )
+    arg_parser.add_argument(
+        "--warmup", type=float, default=2, help="Time to wait before measuring each scenario in seconds"
+    )
+    arg_parser.add_argument(
+        "--out-dir", default="benchmark_results", help="Directory for reports and recorded videos"
+    )
+    arg_parser.add_argument(
+        "--state-store-port",
+        type=int,
+        help="Run the state store on this port instead of the configured one (e.g. when the system is running)",
+    )
+    arg_parser.add_argument(
+        "--keep-videos", action="store_true", help="Don't delete the recorded videos"
+    )
+    args = arg_parser.parse_args()
+
+    config = configure.load_config(args.config)
+    if args.state_store_port is not None:
+        config.state_store_address = (config.state_store_address[0], args.state_store_port)
+
+    mp.set_start_method(config.process_start_method)
+
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setFormatter(rl_logging.formatter)
+    log = rl_logging.init(
+        log_handlers=(stderr_handler,),
+        extra_loggers=(),
+        extra_log_level=logging.WARNING,
+        default_level=logging.getLevelName(config.log_level),
+    )
+
+    state_store = managed_state.StateStore(
+        address=config.state_store_address, authkey=config.state_store_authkey
+    )
+    state = managed_state.Cursor((), manager=state_store.manager)
+    dispatcher = managed_state.StateDispatcher(state)
+    threading.Thread(target=dispatcher.listen).start()
+
+    if args.scenarios is not None:
+        with open(args.scenarios, "r") as f:
+            scenarios = json.load(f)
+    else:
+        scenarios = default_scenarios
+
+    scenarios = [{**default_scenario, **sc} for sc in scenarios]
+
+    out_dir = Path(args.out_dir)
+    videos_dir = out_dir / "videos"
+    videos_dir.mkdir(parents=True, exist_ok=True)
+    # video writers write to the session data dir
+    state["session"] = {"data_dir": videos_dir}
+
+    report_time = time.strftime("%Y%m%d-%H%M%S")
+    json_path = out_dir / f"benchmark_{report_time}.json"
+    csv_path = out_dir / f"benchmark_{report_time}.csv"
+
+    results = []
+    try:
+        video_system.init(state, {"image_sources": {}, "image_observers": {}})
+
+        for i, sc in enumerate(scenarios):
+            log.info(f"Running scenario {i + 1}/{len(scenarios)}: {scenario_name(sc)}")
+            try:
+                results.append(run_scenario(state, sc, args.duration, args.warmup, log))
+            except Exception:
+                log.exception(f"Exception while running scenario {scenario_name(sc)}:")
+
+            if not args.keep_videos:
+                shutil.rmtree(videos_dir, ignore_errors=True)
+                videos_dir.mkdir(parents=True, exist_ok=True)
+    finally:
+        video_system.shutdown()
+
+        with open(json_path, "w") as f:
+            json.dump(
+                {
+                    "time": report_time,
+                    "machine": {
+                        "cpu_count": psutil.cpu_count(),
+                        "memory_mb": psutil.virtual_memory().total / 2**20,
+                    },
+                    "duration": args.duration,
+                    "results": results,
+                },
+                f,
+                indent=4,
+                default=json_convert,
+            )
+
+        if len(results) > 0:
+            rows = [summary_row(res) for res in results]
+            with open(csv_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+
+        log.info(f"Wrote benchmark reports to {json_path} and {csv_path}")
+        dispatcher.stop()
+        rl_logging.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -62,10 +62,16 @@ archive_dirs = {
 # Image source streaming over HTTP settings
 http_streaming = {
     "frame_rate": 15,  # http streaming frame rate
+    # Either "pillow" or "opencv". The opencv encoder is considerably faster (see image_utils.CVImageEncoder)
+    "encoder": "pillow",
+    # pillow encoder settings
     # See https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.save
     # and https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html
     "encoding": "WebP",
     "encode_params": {"method": 2},
+    # opencv encoder settings: "jpeg", "webp" or "png" (see image_utils.CVImageEncoder for available params)
+    "opencv_encoding": "jpeg",
+    "opencv_encode_params": {"quality": 80, "optimize": True},
 }
 
 
@@ -73,7 +79,41 @@ video_record = {
     "video_frame_rate": 60,  # the default frame rate for recorded videos
     "file_ext": "mp4",
     "start_trigger_on_startup": False,
-    "max_write_queue_size": 0,  # 0 means infinite queue.
+    # The number of preallocated frames waiting to be encoded by each video writer, and what to do when they're all in
+    # use: "block" (wait for the encoder), "drop_newest" or "drop_oldest".
+    "write_pool_size": 32,
+    "write_pool_policy": "block",
+    # "ffmpeg_pipe" streams raw frames to ffmpeg directly, "imageio" uses imageio.get_writer, "raw" writes frames
+    # without conversion or encoding to memory-mapped raw chunk files (see raw_video.py), e.g. to record 16 bit images
+    # losslessly. Can be set for each image source with a "writer_backend" key in its config.
+    "writer_backend": "ffmpeg_pipe",
+    # "raw" backend: the max size of each chunk file in bytes, the number of bytes written to disk at once, and the
+    # format closed chunks are transcoded to in the background ("ffv1", "hdf5" or None to keep the raw chunks).
+    "raw_chunk_size": 1024**3,
+    "raw_sync_size": 64 * 1024**2,
+    "raw_transcode": None,
+    # Frame timestamps are written to a binary <video>.timestamps file (see frame_timestamps.py). Set to True to
+    # write a <video>.csv timestamps file as well.
+    "timestamps_csv": False,
+    # Seconds of recent frames each video writer keeps in memory while not recording, and writes at the beginning of
+    # the next recording (0 to disable), and the max memory used for these frames by each writer in bytes. Can be set
+    # for each image source with a "preroll" key in its config.
+    "preroll": 0,
+    "preroll_max_memory": 1024**3,
+    # Split recordings into consecutive video files without losing frames. A new file starts when the current one
+    # reaches any of these limits (None to disable): duration in seconds, number of frames, or file size in bytes.
+    "segment_duration": None,
+    "segment_frames": None,
+    "segment_size": None,
+    # Default parameters of gated recording (see video_system.start_gated_record() and recording_gate.py). The
+    # thresholds match the motion value of a MotionObserver (the fraction of changed pixels).
+    "gate": {
+        "on_threshold": 0.01,
+        "off_threshold": 0.005,
+        "start_delay": 0,
+        "post_roll": 2,
+        "min_clip_length": 2,
+    },
     "encoding_configs": {
         # Video encoding parameters:
         # These parameters are passed to imageio.get_writer function
@@ -102,6 +142,18 @@ video_record = {
     },
 }
 
+# Burst image capture (see image_capture.py)
+image_capture = {
+    # the number of threads encoding and writing image files. None to use half of the cpu cores, leaving the rest
+    # for image sources and the threads copying images from their frame buffers.
+    "workers": None,
+    # default file formats: "jpg", "png" or "tiff" for uint8 images, "png" or "tiff" for uint16 images
+    "uint8_format": "jpg",
+    "uint16_format": "png",
+    "jpeg_quality": 95,
+    "png_compression": 1,  # 0-9, lower is faster
+}
+
 # MQTT broker server address
 mqtt = {
     "host": "localhost",
@@ -0,0 +1,431 @@
+"""
+Video encoder benchmark.
+
+Feeds frames through the video writer encoder (see video_write.open_encoder()) for each encoding config in
+`video_record.encoding_configs`, at each of a list of image shapes and target frame rates, and writes a JSON report
+with detailed results and a CSV report with one row per run. This helps choosing encoder settings for a machine
+before recording long experiments. The system itself doesn't need to be running.
+
+Run from the system directory: 'python encoder_benchmark.py -h' for help about command line arguments.
+
+Frames are either synthetic (moving blobs with sensor-like noise, see make_frames()) or read from a sample video
+(--sample). When a target frame rate is set, frames are fed at that rate and the backlog of frames that were due
+but not yet accepted by the encoder is tracked. This backlog is what accumulates in the video writer frame pool,
+which drops or blocks once it's full (see video_record.write_pool_size). A target rate of "max" feeds frames as fast
+as the encoder accepts them.
+
+Each result includes:
+- fps: Encoded frames per second, including the time it took to finish the video file.
+- flush_sec: The time it took to finish the video file after the last frame was fed. Frames buffered in the pipe and
+  in the encoder (e.g. the libx264 lookahead) are not part of the backlog, so an encoder that can't keep up shows a
+  long flush time before the backlog grows.
+- backlog_max, backlog_growth: The max backlog in frames and its growth rate in frames per second.
+- pool_overflow: Whether the backlog exceeded the video writer frame pool size.
+- cpu_percent, ffmpeg_cpu_percent: CPU usage of the benchmark process and of the ffmpeg process (percent of a
+  single core). ffmpeg usage is only available on platforms that report the cpu times of child processes.
+- bytes_per_frame, mbit_per_sec: The average encoded frame size and the resulting bitrate at the target rate.
+
+Encodings whose codec is missing from the ffmpeg build, or that fail to encode a few test frames (e.g. nvenc codecs
+without a supported GPU), are skipped and reported as unavailable.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import imageio
+import imageio_ffmpeg
+import numpy as np
+import psutil
+
+import configure
+import rl_logging
+import video_write
+from json_convert import json_convert
+
+
+def parse_shape(s):
+    return [int(d) for d in s.lower().split("x")]
+
+
+def parse_frame_rate(s):
+    return None if s == "max" else float(s)
+
+
+def shape_name(shape):
+    name = "x".join(str(d) for d in reversed(shape[:2]))
+    if len(shape) == 3:
+        name += f"x{shape[2]}"
+    return name
+
+
+def run_name(encoding, shape, frame_rate):
+    fps = "max" if not frame_rate else f"{frame_rate:g}"
+    return f"{encoding}-{shape_name(shape)}-{fps}fps"
+
+
+def make_frames(shape, count, noise=3, seed=0):
+    """
+    Return an array of count synthetic uint8 frames: bright moving blobs on a dark background, with gaussian noise
+    so that the encoder has to work on every pixel, as with real camera images.
+
+    Args:
+    - shape: The frame shape, (height, width) or (height, width, 3).
+    - count: The number of frames.
+    - noise: The standard deviation of the noise in pixel values.
+    - seed: Random seed.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = shape[:2]
+    pos = rng.uniform((0, 0), (w, h), size=(3, 2))
+    angles = rng.uniform(0, 2 * np.pi, size=3)
+    vel = 4 * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    color = (230,) * (shape[2] if len(shape) == 3 else 1)
+
+    frames = np.empty((count, *shape), dtype=np.uint8)
+    for img in frames:
+        img[:] = 25
+        for x, y in pos:
+            cv2.circle(img, (int(x), int(y)), max(h // 25, 4), color, -1)
+
+        img[:] = np.clip(img + rng.normal(0, noise, shape), 0, 255)
+
+        pos += vel
+        for i, size in enumerate((w, h)):
+            out = (pos[:, i] < 0) | (pos[:, i] >= size)
+            vel[out, i] *= -1
+            pos[:, i] = np.clip(pos[:, i], 0, size - 1)
+
+    return frames
+
+
+def read_sample_frames(path, shape, count):
+    """
+    Read up to count frames from a video file, converted to grayscale or BGR and resized to the supplied shape.
+    """
+    frames = []
+    with imageio.get_reader(str(path)) as reader:
+        for img in reader:
+            if len(shape) == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+            else:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR if img.ndim == 2 else cv2.COLOR_RGB2BGR)
+
+            frames.append(cv2.resize(img, (shape[1], shape[0]), interpolation=cv2.INTER_AREA))
+            if len(frames) >= count:
+                break
+
+    if len(frames) == 0:
+        raise ValueError(f"Can't read frames from sample video: {path}")
+
+    return np.stack(frames)
+
+
+def available_encoders():
+    """
+    Return the names of the video encoders supported by the ffmpeg executable used by the video writers.
+    """
+    out = subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-encoders"],
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    names = set()
+    for line in out.splitlines():
+        parts = line.split()
+        # encoder lines start with capability flags, e.g. " V....D libx264  libx264 H.264 ..."
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith("V"):
+            names.add(parts[1])
+    return names
+
+
+def probe_encoding(params, shape, frames, backend, path, frame_count=10):
+    """
+    Try to encode a few frames. Return None on success, or a string describing the error.
+    """
+    writer = None
+    try:
+        writer = video_write.open_encoder(path, shape, 30, params, backend)
+        for img in frames[:frame_count]:
+            writer.append_data(video_write.prepare_encoder_frame(img, backend))
+        writer.close()
+        writer = None
+        if not path.exists() or path.stat().st_size == 0:
+            return "No video data was written"
+        return None
+    except Exception as e:
+        return str(e) or type(e).__name__
+    finally:
+        if writer is not None and hasattr(writer, "abort"):
+            writer.abort()
+        path.unlink(missing_ok=True)
+
+
+def run_encoding(params, shape, frame_rate, frames, duration, backend, path, pool_size):
+    """
+    Feed frames to an encoder for duration seconds and return a dict of measurements (see module docstring).
+    """
+    video_frame_rate = frame_rate or 30
+    # ffmpeg runs as a child process. its cpu times are added to the children times once it exits.
+    start_cpu = os.times()
+    start_time = time.time()
+    writer = video_write.open_encoder(path, shape, video_frame_rate, params, backend)
+
+    backlog = []  # (elapsed time, backlog) samples
+    frame_count = 0
+    next_sample = 0
+
+    while True:
+        now = time.time()
+        elapsed = now - start_time
+        if elapsed >= duration:
+            break
+
+        if frame_rate:
+            due = int(elapsed * frame_rate) + 1
+            if elapsed >= next_sample:
+                backlog.append((elapsed, due - frame_count))
+                next_sample += 0.25
+
+            if frame_count >= due:
+                time.sleep(start_time + frame_count / frame_rate - now)
+                continue
+
+        img = frames[frame_count % len(frames)]
+        writer.append_data(video_write.prepare_encoder_frame(img, backend))
+        frame_count += 1
+
+    feed_time = time.time() - start_time
+    writer.close()
+    total_time = time.time() - start_time
+    end_cpu = os.times()
+
+    results = {
+        "frames": frame_count,
+        "fps": frame_count / total_time,
+        "feed_fps": frame_count / feed_time,
+        "flush_sec": total_time - feed_time,
+        "cpu_percent": (end_cpu.user + end_cpu.system - start_cpu.user - start_cpu.system)
+        / total_time
+        * 100,
+        "ffmpeg_cpu_percent": (
+            end_cpu.children_user
+            + end_cpu.children_system
+            - start_cpu.children_user
+            - start_cpu.children_system
+        )
+        / total_time
+        * 100,
+        "bytes_per_frame": path.stat().st_size / max(frame_count, 1),
+    }
+
+    if frame_rate:
+        backlog = np.array(backlog)
+        # growth rate over the second half of the run, after the encoder pipeline filled up
+        tail = backlog[len(backlog) // 2 :]
+        growth = np.polyfit(tail[:, 0], tail[:, 1], 1)[0] if len(tail) > 1 else None
+        results.update(
+            {
+                "backlog_max": int(backlog[:, 1].max()),
+                "backlog_growth": growth,
+                "pool_overflow": bool(backlog[:, 1].max() > pool_size),
+                "mbit_per_sec": results["bytes_per_frame"] * 8 * frame_rate / 1e6,
+            }
+        )
+    else:
+        results.update(
+            {
+                "backlog_max": None,
+                "backlog_growth": None,
+                "pool_overflow": None,
+                "mbit_per_sec": None,
+            }
+        )
+
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="ReptiLearn video encoder benchmark")
+    arg_parser.add_argument(
+        "--config",
+        default="config",
+        help="The name of a config module residing in the ./config/ directory",
+    )
+    arg_parser.add_argument(
+        "--encodings",
+        nargs="+",
+        help="Names of encoding configs to benchmark (default: all video_record encoding configs)",
+    )
+    arg_parser.add_argument(
+        "--encodings-file",
+        help="A JSON file containing a dict of additional encoding configs (e.g. quality or preset variations)",
+    )
+    arg_parser.add_argument(
+        "--shapes",
+        nargs="+",
+        type=parse_shape,
+        default=[[1080, 1440]],
+        help="Image shapes formatted as HEIGHTxWIDTH or HEIGHTxWIDTHx3 (default: 1080x1440)",
+    )
+    arg_parser.add_argument(
+        "--frame-rates",
+        nargs="+",
+        type=parse_frame_rate,
+        default=[30, 60, None],
+        help="Target frame rates, or 'max' to encode as fast as possible (default: 30 60 max)",
+    )
+    arg_parser.add_argument(
+        "--backend",
+        choices=("ffmpeg_pipe", "imageio"),
+        help="The video writer backend (default: video_record.writer_backend)",
+    )
+    arg_parser.add_argument(
+        "--duration", type=float, default=10, help="Duration of each run in seconds"
+    )
+    arg_parser.add_argument(
+        "--sample", help="A video file to read frames from instead of using synthetic frames"
+    )
+    arg_parser.add_argument(
+        "--noise", type=float, default=3, help="Noise standard deviation of synthetic frames"
+    )
+    arg_parser.add_argument(
+        "--out-dir", default="benchmark_results", help="Directory for reports and encoded videos"
+    )
+    arg_parser.add_argument(
+        "--keep-videos", action="store_true", help="Don't delete the encoded videos"
+    )
+    args = arg_parser.parse_args()
+
+    config = configure.load_config(args.config)
+
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setFormatter(rl_logging.formatter)
+    log = rl_logging.init(
+        log_handlers=(stderr_handler,),
+        extra_loggers=(),
+        extra_log_level=logging.WARNING,
+        default_level=logging.getLevelName(config.log_level),
+    )
+
+    encodings = dict(config.video_record["encoding_configs"])
+    if args.encodings_file is not None:
+        with open(args.encodings_file, "r") as f:
+            encodings.update(json.load(f))
+
+    if args.encodings is not None:
+        for name in args.encodings:
+            if name not in encodings:
+                raise ValueError(f"Unknown encoding config: {name}")
+        encodings = {name: encodings[name] for name in args.encodings}
+
+    backend = args.backend or config.video_record["writer_backend"]
+    if backend not in ("ffmpeg_pipe", "imageio"):
+        raise ValueError(f"Can't benchmark the {backend} video writer backend")
+
+    file_ext = config.video_record["file_ext"]
+    pool_size = config.video_record["write_pool_size"]
+
+    out_dir = Path(args.out_dir)
+    videos_dir = out_dir / "videos"
+    videos_dir.mkdir(parents=True, exist_ok=True)
+
+    report_time = time.strftime("%Y%m%d-%H%M%S")
+    json_path = out_dir / f"encoder_benchmark_{report_time}.json"
+    csv_path = out_dir / f"encoder_benchmark_{report_time}.csv"
+
+    ffmpeg_encoders = available_encoders()
+    results = []
+    unavailable = {}
+
+    try:
+        for shape in args.shapes:
+            if args.sample is not None:
+                frames = read_sample_frames(args.sample, shape, 120)
+            else:
+                frames = make_frames(shape, 120, args.noise)
+
+            for enc_name, params in encodings.items():
+                codec = params.get("codec") or "libx264"
+                if codec not in ffmpeg_encoders:
+                    error = f"Codec {codec} is not supported by {imageio_ffmpeg.get_ffmpeg_exe()}"
+                else:
+                    probe_path = videos_dir / f"probe-{enc_name}.{file_ext}"
+                    error = probe_encoding(params, shape, frames, backend, probe_path)
+
+                if error is not None:
+                    log.warning(f"Skipping encoding {enc_name} ({shape_name(shape)}): {error}")
+                    unavailable[f"{enc_name}-{shape_name(shape)}"] = error
+                    continue
+
+                for frame_rate in args.frame_rates:
+                    name = run_name(enc_name, shape, frame_rate)
+                    log.info(f"Running {name}")
+                    path = videos_dir / f"{name}.{file_ext}"
+                    try:
+                        res = run_encoding(
+                            params, shape, frame_rate, frames, args.duration, backend, path, pool_size
+                        )
+                    except Exception:
+                        log.exception(f"Exception while running {name}:")
+                        continue
+                    finally:
+                        if not args.keep_videos:
+                            path.unlink(missing_ok=True)
+
+                    results.append(
+                        {
+                            "name": name,
+                            "encoding": enc_name,
+                            "image_shape": "x".join(str(d) for d in shape),
+                            "target_fps": frame_rate,
+                            **res,
+                        }
+                    )
+                    log.info(
+                        f"{name}: {res['fps']:.1f} fps, {res['bytes_per_frame'] / 1024:.1f} KiB/frame, "
+                        f"ffmpeg cpu {res['ffmpeg_cpu_percent']:.0f}%"
+                        + ("" if res["backlog_max"] is None else f", max backlog {res['backlog_max']}")
+                    )
+    finally:
+        with open(json_path, "w") as f:
+            json.dump(
+                {
+                    "time": report_time,
+                    "machine": {
+                        "cpu_count": psutil.cpu_count(),
+                        "memory_mb": psutil.virtual_memory().total / 2**20,
+                    },
+                    "backend": backend,
+                    "duration": args.duration,
+                    "sample": args.sample,
+                    "write_pool_size": pool_size,
+                    "encodings": encodings,
+                    "unavailable": unavailable,
+                    "results": results,
+                },
+                f,
+                indent=4,
+                default=json_convert,
+            )
+
+        if len(results) > 0:
+            with open(csv_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+                writer.writeheader()
+                writer.writerows(results)
+
+        log.info(f"Wrote encoder benchmark reports to {json_path} and {csv_path}")
+        rl_logging.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,37 @@
 import experiment as exp
 import video_system
-import schedule
 
 
 class AsyncRecordingExperiment(exp.Experiment):
+    """
+    Record groups of image sources independently. Recordings of the grouped sources are split into a new video file
+    every split_rec_every seconds by the video writers, without any gap between files. Other sources keep the global
+    segment settings.
+    """
+
     default_params = {
         "record_groups": {},
         "split_rec_every": 12 * 60 * 60,
-        "split_gap": 1,
     }
 
-    def setup(self):
-        self.cancel_start_scheds = {}
-        self.cancel_stop_scheds = {}
-
     def run(self):
         groups = exp.get_params()["record_groups"]
 
-        for group_name in groups.keys():
-            exp.session_state[f"recording_{group_name}"] = False
+        # only the recordings of this experiment's sources are split
+        self.src_ids = [src_id for group in groups.values() for src_id in group]
+        video_system.set_record_segments(
+            duration=exp.get_params()["split_rec_every"], src_ids=self.src_ids
+        )
 
-        self.update_actions()
+        try:
+            for group_name in groups.keys():
+                exp.session_state[f"recording_{group_name}"] = False
+
+            self.update_actions()
+        except Exception:
+            # end() is not called when run() fails
+            video_system.clear_record_segments(self.src_ids)
+            raise
 
     def end(self):
         groups = exp.get_params()["record_groups"]
@@ -28,15 +39,16 @@ class AsyncRecordingExperiment(exp.Experiment):
         self.actions = {}
         exp.refresh_actions()
 
-        for group_name in groups.keys():
-            exp.session_state.delete(f"recording_{group_name}")
-            self.stop_record_group(group_name)
-            self.cancel_group_scheds(group_name)
+        try:
+            for group_name in groups.keys():
+                exp.session_state.delete(f"recording_{group_name}")
+                self.stop_record_group(group_name)
+        finally:
+            video_system.clear_record_segments(self.src_ids)
 
     def toggle_rec_group(self, group_name):
         if self.is_recording(group_name):
             self.stop_record_group(group_name)
-            self.cancel_group_scheds(group_name)
         else:
             self.start_record_group(group_name)
 
@@ -44,20 +56,11 @@ class AsyncRecordingExperiment(exp.Experiment):
 
     def start_record_group(self, group_name):
         group = exp.get_params()["record_groups"][group_name]
-        split_every = exp.get_params()["split_rec_every"]
-        split_gap = exp.get_params()["split_gap"]
 
         exp.session_state[f"recording_{group_name}"] = True
         for src_id in group:
             video_system.video_writers[src_id].start_observing()
 
-        self.cancel_stop_scheds[group_name] = schedule.once(
-            lambda: self.stop_record_group(group_name), split_every
-        )
-        self.cancel_start_scheds[group_name] = schedule.once(
-            lambda: self.start_record_group(group_name), split_every + split_gap
-        )
-
     def stop_record_group(self, group_name):
         group = exp.get_params()["record_groups"][group_name]
 
@@ -68,14 +71,6 @@ class AsyncRecordingExperiment(exp.Experiment):
     def is_recording(self, group_name):
         return exp.session_state[f"recording_{group_name}"]
 
-    def cancel_group_scheds(self, group_name):
-        if group_name in self.cancel_start_scheds:
-            self.cancel_start_scheds[group_name]()
-            del self.cancel_start_scheds[group_name]
-        if group_name in self.cancel_stop_scheds:
-            self.cancel_stop_scheds[group_name]()
-            del self.cancel_stop_scheds[group_name]
-
     def update_actions(self):
         groups = exp.get_params()["record_groups"]
 
@@ -0,0 +1,161 @@
+"""
+Binary frame timestamp files.
+
+Video files written by video_write.VideoWriter are accompanied by a binary timestamps file (<video stem>.timestamps)
+with one fixed-size record per written frame (see `record_dtype`):
+- frame: The frame sequence number in the image source buffer. Gaps mean that frames were not written.
+- timestamp: The image acquisition timestamp (seconds since epoch).
+- arrival_time: The time the frame reached the video writer (seconds since epoch).
+- dropped_before: The number of frames that were acquired but not written since the previous record.
+
+The file starts with a 16 bytes header (`magic` followed by the record size as uint32 and 4 reserved bytes), and
+the records follow in little-endian layout, so that the file can be memory-mapped as a numpy structured
+array without parsing. Since records are appended in blocks, a file that was not closed properly is still readable
+up to the last written block.
+"""
+from pathlib import Path
+import numpy as np
+
+file_suffix = ".timestamps"
+magic = b"RLTSBIN1"
+header_size = 16
+
+record_dtype = np.dtype(
+    [
+        ("frame", "<i8"),
+        ("timestamp", "<f8"),
+        ("arrival_time", "<f8"),
+        ("dropped_before", "<i8"),
+    ]
+)
+
+csv_columns = ("timestamp", "frame", "arrival_time", "dropped_before")
+
+
+def timestamps_path(vid_path: Path) -> Path:
+    """
+    Return the path of the binary timestamps file of the video at vid_path.
+    """
+    vid_path = Path(vid_path)
+    return vid_path.parent / (vid_path.stem + file_suffix)
+
+
+def _write_csv_rows(f, records):
+    np.savetxt(
+        f,
+        np.column_stack([records[col] for col in csv_columns]),
+        fmt=("%.17g", "%d", "%.17g", "%d"),
+        delimiter=",",
+    )
+
+
+class TimestampsWriter:
+    """
+    Write frame records to a binary timestamps file. Records are collected in a preallocated block and written to the
+    file each time the block is full, and when the writer is flushed or closed.
+
+    When csv_path is not None, the records are also written to a csv file with a header row and the columns in
+    `csv_columns`. The timestamp column comes first, as in timestamp files written by earlier versions.
+    """
+
+    def __init__(self, path: Path, block_size=256, csv_path: Path = None):
+        """
+        Args:
+        - path: The binary file path.
+        - block_size: The number of records written to the file at once.
+        - csv_path: An optional csv file path.
+        """
+        self.path = Path(path)
+        self.block = np.zeros(block_size, dtype=record_dtype)
+        self.count = 0
+        self.frame_count = 0
+
+        self.file = open(str(self.path), "wb")
+        self.file.write(magic + np.array([record_dtype.itemsize, 0], "<u4").tobytes())
+
+        if csv_path is not None:
+            self.csv_file = open(str(csv_path), "w")
+            self.csv_file.write(",".join(csv_columns) + "\n")
+        else:
+            self.csv_file = None
+
+    def append(self, frame, timestamp, arrival_time, dropped_before=0):
+        """
+        Add a frame record.
+        """
+        self.block[self.count] = (frame, timestamp, arrival_time, dropped_before)
+        self.count += 1
+        self.frame_count += 1
+        if self.count == len(self.block):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the collected records to the file(s).
+        """
+        if self.count == 0:
+            return
+
+        records = self.block[: self.count]
+        self.file.write(memoryview(records).cast("B"))
+        self.file.flush()
+        if self.csv_file is not None:
+            _write_csv_rows(self.csv_file, records)
+            self.csv_file.flush()
+
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        if self.csv_file is not None:
+            self.csv_file.close()
+
+
+def read_timestamps(path: Path, mode="r") -> np.ndarray:
+    """
+    Memory-map a binary timestamps file and return a structured array of its records (see `record_dtype`).
+    An incomplete trailing record is ignored.
+
+    Args:
+    - path: The timestamps file path.
+    - mode: The np.memmap mode. The default "r" maps the file read-only.
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        header = f.read(header_size)
+
+    if len(header) < header_size or header[: len(magic)] != magic:
+        raise ValueError(f"Not a binary timestamps file: {path}")
+
+    itemsize = int(np.frombuffer(header, dtype="<u4", count=1, offset=len(magic))[0])
+    if itemsize != record_dtype.itemsize:
+        raise ValueError(f"Unsupported timestamps record size ({itemsize}): {path}")
+
+    count = (path.stat().st_size - header_size) // itemsize
+    if count == 0:
+        return np.zeros(0, dtype=record_dtype)
+
+    return np.memmap(
+        path, dtype=record_dtype, mode=mode, offset=header_size, shape=(count,)
+    )
+
+
+def export_csv(path: Path, csv_path: Path = None) -> Path:
+    """
+    Convert a binary timestamps file to a csv file with the columns in `csv_columns`, and return the csv path.
+
+    Args:
+    - path: The binary timestamps file path.
+    - csv_path: The csv file path. When None, the binary file path with a .csv suffix is used.
+    """
+    path = Path(path)
+    if csv_path is None:
+        csv_path = path.with_suffix(".csv")
+
+    records = read_timestamps(path)
+    with open(str(csv_path), "w") as f:
+        f.write(",".join(csv_columns) + "\n")
+        _write_csv_rows(f, records)
+
+    return csv_path
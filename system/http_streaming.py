@@ -0,0 +1,181 @@
+"""
+Sharing HTTP image streams between clients.
+
+Each StreamBroadcaster reads images from a single ImageSource at a fixed frame rate, renders (e.g. applies overlays
+and encodes) each image once, and hands the same bytes to any number of subscribers. Clients that can't keep up
+with the broadcaster skip to the latest frame instead of slowing it down or queueing frames.
+
+Broadcasters are shared by key (see stream()), and stop once their last subscriber is gone.
+"""
+import threading
+import time
+from image_utils import is_image_shape
+from rl_logging import get_main_logger
+
+_broadcasters = {}
+_lock = threading.Lock()
+# Serializes latency stats updates, since broadcasters of the same image source share its stats (see
+# video_stream.LatencyStats)
+_stats_lock = threading.Lock()
+
+
+class StreamBroadcaster:
+    # How often to check for new images when none are available, in seconds
+    poll_interval = 0.01
+
+    def __init__(self, img_src, frame_rate, render, timeout=5):
+        """
+        Args:
+        - img_src: The video_stream.ImageSource to stream from.
+        - frame_rate: The maximum number of frames per second. None for no limit.
+        - render: A function with signature (img, timestamp) that returns the bytes sent to each subscriber. timestamp
+                  is None when rendering a timeout image.
+        - timeout: Render a "NO IMAGE" image when there are no new images for this many seconds.
+        """
+        if not is_image_shape(img_src.image_shape):
+            raise ValueError(f"Images with shape {tuple(img_src.image_shape)} can't be streamed")
+
+        self.img_src = img_src
+        self.frame_rate = frame_rate
+        self.render = render
+        self.timeout = timeout
+        self.subscribers = 0
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._frame_id = 0
+        self._dropped = 0  # frames skipped by subscribers since the last published frame
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, wait=False):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def frames(self):
+        """
+        A generator of rendered frames. Each iteration returns the most recent frame, skipping any frames that were
+        rendered while the subscriber was busy. Ends when the broadcaster stops.
+        """
+        last_id = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopped or self._frame_id != last_id, timeout=1
+                )
+                if self._stopped:
+                    return
+                if self._frame_id == last_id:
+                    continue
+
+                if last_id != 0:
+                    # counted into the image source stats by the broadcaster thread
+                    self._dropped += self._frame_id - last_id - 1
+                last_id = self._frame_id
+                frame = self._frame
+
+            yield frame
+
+    def _publish(self, img, timestamp):
+        t0 = time.time()
+        frame = self.render(img, timestamp)
+        t1 = time.time()
+
+        with self._cond:
+            self._frame = frame
+            self._frame_id += 1
+            dropped, self._dropped = self._dropped, 0
+            self._cond.notify_all()
+
+        with _stats_lock:
+            if timestamp is not None:
+                self.img_src.stats.record("http_encode", t1 - t0)
+                self.img_src.stats.record("frame_to_http", t1 - timestamp)
+
+            if dropped > 0:
+                self.img_src.stats.add_count("http_dropped_frames", dropped)
+
+    def _run(self):
+        period = 0 if not self.frame_rate else 1 / self.frame_rate
+        frame_buf = self.img_src.frame_buf
+        last_seq = None
+        last_frame_time = time.time()
+
+        try:
+            while not self._stopped and not self.img_src.end_event.is_set():
+                seq = frame_buf.last_seq()
+                now = time.time()
+
+                if seq >= 0 and seq != last_seq:
+                    last_seq = seq
+                    last_frame_time = now
+                    img, timestamp = self.img_src.get_image(scale_to_8bit=True)
+                    self._publish(img, timestamp)
+                    next_time = now + period
+                elif now - last_frame_time > self.timeout:
+                    last_frame_time = now
+                    self._publish(
+                        self.img_src._make_timeout_img(self.img_src.image_shape), None
+                    )
+                    next_time = now + period
+                else:
+                    next_time = now + self.poll_interval
+
+                time.sleep(max(next_time - time.time(), 0))
+        except Exception:
+            get_main_logger().exception("Exception while broadcasting image stream:")
+        finally:
+            self.stop()
+
+
+def stream(key, make_broadcaster):
+    """
+    A generator of rendered frames from the broadcaster with the supplied key. When there is no such broadcaster,
+    make_broadcaster() is called to create a new StreamBroadcaster which is then shared with any following
+    subscribers using the same key. The broadcaster stops when its last subscriber closes the generator.
+
+    Args:
+    - key: A hashable that identifies the stream, for example (src_id, width, height, encoding)
+    - make_broadcaster: A function that returns a new StreamBroadcaster
+    """
+    with _lock:
+        broadcaster = _broadcasters.get(key)
+        if broadcaster is None or broadcaster.stopped:
+            broadcaster = make_broadcaster()
+            _broadcasters[key] = broadcaster
+            broadcaster.start()
+
+        broadcaster.subscribers += 1
+
+    try:
+        yield from broadcaster.frames()
+    finally:
+        with _lock:
+            broadcaster.subscribers -= 1
+            if broadcaster.subscribers == 0:
+                broadcaster.stop()
+                if _broadcasters.get(key) is broadcaster:
+                    del _broadcasters[key]
+
+
+def stop_all():
+    """
+    Stop all broadcasters, ending all of their streams. Blocks until the broadcaster threads terminate.
+    """
+    with _lock:
+        broadcasters = list(_broadcasters.values())
+        _broadcasters.clear()
+
+    for broadcaster in broadcasters:
+        broadcaster.stop(wait=True)
@@ -0,0 +1,296 @@
+"""
+Asynchronous burst image capture.
+
+A burst capture grabs a number of consecutive images from one or more ImageSources and saves each one to a separate
+file, without blocking the caller. Each source is read by its own thread, which copies every new image out of the
+source frame buffer as soon as it's acquired, so that bursts are captured at the full source frame rate even though
+the frame buffer only holds a few images. The copies are encoded and written to files by a shared thread pool (see
+the image_capture config), which releases the GIL while encoding.
+
+Image formats are chosen by pixel type: uint8 images can be saved as "jpg", "png" or "tiff" files, and uint16 images
+as "png" or "tiff" files, which keep their full bit depth. Color images are assumed to be BGR, as in the frame
+buffers.
+
+The files of a burst are named like files written by video_write.save_image() with an added image index, e.g.
+<prefix>_<src_id>_<date>-<time>_000.png, where the time is the timestamp of the first image. Saving a burst to a
+dedicated directory (write_dir) makes it ready for calibration workflows, e.g. undistort.get_distortion_matrix().
+
+capture() returns a concurrent.futures.Future that resolves to the burst results. The progress of each burst is also
+published to the state store under ("video", "captures", <capture id>).
+"""
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+
+from configure import get_config
+from rl_logging import get_main_logger
+from video_write import get_write_path
+
+# Supported file formats of each image dtype. The first format is used when none is specified.
+formats = {
+    "uint8": ("jpg", "png", "tiff"),
+    "uint16": ("png", "tiff"),
+}
+
+_executor = None
+_captures = {}
+_capture_ids = itertools.count()
+_lock = threading.Lock()
+
+
+class BurstCapture:
+    """
+    A single burst capture. See the module docstring.
+    """
+
+    # How often to check for new images, in seconds
+    poll_interval = 0.001
+
+    def __init__(
+        self,
+        capture_id,
+        img_srcs,
+        count,
+        write_dir,
+        filename_prefix="",
+        format=None,
+        every=1,
+        timeout=5,
+        state=None,
+    ):
+        """
+        Args:
+        - capture_id: A unique id of this capture.
+        - img_srcs: A list of video_stream.ImageSource objects.
+        - count: The number of images to capture from each source.
+        - write_dir: The directory where image files are written.
+        - filename_prefix: A prefix for the filenames of the created files.
+        - format: The image file format (see `formats`), or None to use the configured format of each source dtype.
+        - every: Capture every nth image, e.g. 2 to capture every other image.
+        - timeout: Fail if a source doesn't acquire any image for this many seconds.
+        - state: A managed_state.Cursor where the capture progress is published, or None.
+        """
+        if count < 1:
+            raise ValueError(f"Invalid image count: {count}")
+        if every < 1:
+            raise ValueError(f"Invalid capture interval: {every}")
+
+        self.id = capture_id
+        self.img_srcs = list(img_srcs)
+        self.count = count
+        self.write_dir = Path(write_dir)
+        self.filename_prefix = filename_prefix
+        self.every = every
+        self.timeout = timeout
+        self.state = state
+
+        self.formats = {}
+        for src in self.img_srcs:
+            dtype = src.buf_dtype
+            src_format = format or get_config().image_capture[f"{dtype}_format"]
+            if src_format not in formats[dtype]:
+                raise ValueError(f"Can't save {dtype} images from {src.id} as {src_format} files")
+            self.formats[src.id] = src_format
+
+        self.future = concurrent.futures.Future()
+        self.results = {
+            src.id: {"paths": [], "timestamps": [], "missed": 0} for src in self.img_srcs
+        }
+        self._writes = []
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self, wait=False):
+        """
+        Stop grabbing images. Images that were already grabbed are still saved.
+        """
+        self._cancel_event.set()
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+    def _publish(self, status, error=None):
+        if self.state is None:
+            return
+
+        try:
+            self.state[self.id] = {
+                "src_ids": [src.id for src in self.img_srcs],
+                "count": self.count,
+                "write_dir": self.write_dir,
+                "status": status,
+                "grabbed": {id: len(r["paths"]) for id, r in self.results.items()},
+                "missed": {id: r["missed"] for id, r in self.results.items()},
+                "error": error,
+            }
+        except Exception:
+            get_main_logger().exception("Exception while publishing capture state:")
+
+    def _run(self):
+        self._publish("grabbing")
+        errors = {}
+
+        def grab(src):
+            try:
+                self._grab(src)
+            except Exception as e:
+                errors[src.id] = e
+
+        threads = [threading.Thread(target=grab, args=(src,)) for src in self.img_srcs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self._publish("saving")
+        concurrent.futures.wait(self._writes)
+
+        for f in self._writes:
+            if f.exception() is not None:
+                errors.setdefault("write", f.exception())
+
+        if len(errors) > 0:
+            error = next(iter(errors.values()))
+            self._publish("failed", str(error))
+            self.future.set_exception(error)
+        else:
+            self._publish("cancelled" if self._cancel_event.is_set() else "done")
+            self.future.set_result(self.results)
+
+        with _lock:
+            _captures.pop(self.id, None)
+
+    def _grab(self, src):
+        """
+        Copy `count` images from the source frame buffer, starting with the next acquired image, and submit them for
+        writing.
+        """
+        buf = src.frame_buf
+        result = self.results[src.id]
+        ext = self.formats[src.id]
+        seq = buf.last_seq() + 1
+        base_path = None
+        last_image_time = time.time()
+
+        while len(result["paths"]) < self.count and not self._cancel_event.is_set():
+            if seq > buf.last_seq():
+                if src.end_event.is_set():
+                    raise Exception(f"ImageSource {src.id} stopped while capturing images")
+                if time.time() - last_image_time > self.timeout:
+                    raise TimeoutError(f"Timeout while capturing images from {src.id}")
+
+                time.sleep(self.poll_interval)
+                continue
+
+            last_image_time = time.time()
+            first_seq = buf.first_seq()
+            if seq < first_seq:
+                # overwritten before it could be copied
+                result["missed"] += first_seq - seq
+                seq = first_seq
+
+            img, timestamp = buf.read(seq, copy=True)
+            if img is None:
+                result["missed"] += 1
+                seq += 1
+                continue
+
+            if base_path is None:
+                dt = datetime.fromtimestamp(timestamp)
+                base_path = get_write_path(
+                    src.id, self.write_dir, ext, self.filename_prefix, dt
+                )
+
+            index = len(result["paths"])
+            path = base_path.with_name(f"{base_path.stem}_{index:03d}{base_path.suffix}")
+            result["paths"].append(path)
+            result["timestamps"].append(timestamp)
+            self._writes.append(_executor.submit(_write_image, path, img))
+            seq += self.every
+
+
+def _write_image(path, img):
+    conf = get_config().image_capture
+    if path.suffix == ".jpg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, conf["jpeg_quality"]]
+    elif path.suffix == ".png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, conf["png_compression"]]
+    else:
+        params = []
+
+    if not cv2.imwrite(str(path), img, params):
+        raise OSError(f"Failed to write image file {path}")
+
+
+def capture(img_srcs, count, write_dir, filename_prefix="", format=None, every=1, state=None):
+    """
+    Start a burst capture (see BurstCapture for argument details), and return a concurrent.futures.Future that
+    resolves to a dict of results for each source id, containing the image file paths (paths), their timestamps
+    (timestamps), and the number of images that were acquired during the burst but could not be copied in time
+    (missed). The capture id is available as the future's capture_id attribute.
+    """
+    global _executor
+
+    Path(write_dir).mkdir(parents=True, exist_ok=True)
+
+    with _lock:
+        if _executor is None:
+            workers = get_config().image_capture["workers"]
+            if workers is None:
+                workers = max((os.cpu_count() or 1) // 2, 1)
+
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="image_capture",
+            )
+
+        capture_id = str(next(_capture_ids))
+        burst = BurstCapture(
+            capture_id,
+            img_srcs,
+            count,
+            write_dir,
+            filename_prefix,
+            format,
+            every,
+            state=state,
+        )
+        _captures[capture_id] = burst
+
+    burst.future.capture_id = capture_id
+    burst.start()
+    return burst.future
+
+
+def stop_all(timeout=30):
+    """
+    Cancel all active captures and wait until their grabbed images are saved.
+    """
+    with _lock:
+        captures = list(_captures.values())
+
+    for burst in captures:
+        burst.cancel()
+
+    concurrent.futures.wait([burst.future for burst in captures], timeout=timeout)
+
+
+def shutdown():
+    """
+    Stop all captures and shut down the thread pool.
+    """
+    global _executor
+
+    stop_all()
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
@@ -1,6 +1,6 @@
 import numpy as np
 import cv2 as cv
-from ctypes import c_int, pointer
+from ctypes import c_int, c_float, pointer, POINTER
 import image_observers.YOLOv4.darknet as darknet
 import bbox
 
@@ -39,12 +39,21 @@ class YOLOv4Detector:
         self.nms_thres = nms_thres
         self.return_nearest_detection = return_nearest_detection
 
-    def load(self):
+    def load(self, batch_size=1):
+        """
+        Load the network.
+        :param batch_size: The number of images the network processes at once. Use detect_images() for inference
+                           when it's larger than 1.
+        """
         self.curr_img = None
         self.prev_bbox = None
+        self.batch_size = batch_size
 
         self.net = darknet.load_net_custom(
-            self.cfg_path.encode("ascii"), self.weights_path.encode("ascii"), 0, 1
+            self.cfg_path.encode("ascii"),
+            self.weights_path.encode("ascii"),
+            0,
+            batch_size,
         )
         self.meta = darknet.load_meta(self.meta_path.encode("ascii"))
         self.model_width = darknet.lib.network_width(self.net)
@@ -85,6 +94,64 @@ class YOLOv4Detector:
         )
 
         num = pnum[0]
+        res = self._parse_detections(dets, num)
+        darknet.free_detections(dets, num)
+
+        return self._select_detection(res)
+
+    def detect_images(self, imgs):
+        """
+        Bounding box inference on a batch of images. The network must be loaded with a batch size that is at
+        least the number of images.
+
+        :param imgs: numpy array of images with shape (N, height, width, channels)
+        :return: list of N detection results, each in the same format as the return value of detect_image().
+        """
+        n = imgs.shape[0]
+        if n > self.batch_size:
+            raise ValueError(f"Batch of {n} images is larger than the network batch size ({self.batch_size})")
+
+        input_height, input_width = imgs.shape[1:3]
+
+        batch = np.zeros((self.batch_size, self.model_height, self.model_width, 3), dtype=np.uint8)
+        for i in range(n):
+            image = cv.cvtColor(imgs[i], cv.COLOR_BGR2RGB)
+            batch[i] = cv.resize(
+                image, (self.model_width, self.model_height), interpolation=cv.INTER_LINEAR
+            )
+        self.curr_img = batch[n - 1]
+
+        # darknet expects planar float images with values in [0, 1]
+        arr = np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+        image = darknet.IMAGE(
+            self.model_width, self.model_height, 3, arr.ctypes.data_as(POINTER(c_float))
+        )
+
+        batch_dets = darknet.network_predict_batch(
+            self.net,
+            image,
+            self.batch_size,
+            input_width,
+            input_height,
+            self.conf_thres,
+            self.conf_thres,
+            None,
+            0,
+            0,
+        )
+
+        results = []
+        for i in range(n):
+            res = self._parse_detections(batch_dets[i].dets, batch_dets[i].num)
+            results.append(self._select_detection(res))
+
+        darknet.free_batch_detections(batch_dets, self.batch_size)
+        return results
+
+    def _parse_detections(self, dets, num):
+        """
+        Return an array of detections (x1, y1, x2, y2, confidence) from darknet DETECTION structs.
+        """
         if self.nms_thres:
             darknet.do_nms_sort(dets, num, self.meta.classes, self.nms_thres)
 
@@ -102,10 +169,9 @@ class YOLOv4Detector:
             ]
 
         nonzero = res[:, 4] > 0
-        res = res[nonzero]
-
-        darknet.free_detections(dets, num)
+        return res[nonzero]
 
+    def _select_detection(self, res):
         if res.shape[0] == 0:
             return None
 
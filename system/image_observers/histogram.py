@@ -13,11 +13,34 @@ class HistogramObserver(ImageObserver):
     }
 
     def _on_image_update(self, img, timestamp):
-        hist, _ = np.histogram(img, bins=self.config["bin_count"])
-        self._update_output(hist)
+        self._update_output(self._histograms(img[None])[0])
+
+    def _on_images_update(self, imgs, timestamps):
+        self._update_outputs(self._histograms(imgs), timestamps)
+
+    def _histograms(self, imgs):
+        """
+        Vectorized equivalent of np.histogram for each image: bins span the range of each image. Unlike np.histogram
+        it doesn't fail when the image is overwritten by the image source while it's being processed.
+        """
+        bin_count = self.get_config("bin_count")
+        n = imgs.shape[0]
+        flat = imgs.reshape(n, -1)
+
+        lo = flat.min(axis=1, keepdims=True).astype(np.float64)
+        hi = flat.max(axis=1, keepdims=True).astype(np.float64)
+        const = lo == hi
+        lo[const] -= 0.5
+        hi[const] += 0.5
+
+        idx = ((flat - lo) * (bin_count / (hi - lo))).astype(np.intp)
+        np.clip(idx, 0, bin_count - 1, out=idx)
+        idx += np.arange(n)[:, None] * bin_count
+
+        return np.bincount(idx.ravel(), minlength=n * bin_count).reshape(n, bin_count)
 
     def _get_buffer_opts(self):
-        bin_count = self.config["bin_count"]
+        bin_count = self.get_config("bin_count")
 
         if len(self.image_shape) == 3:
             size = bin_count * self.image_shape[-1]
@@ -0,0 +1,70 @@
+from video_stream import ImageObserver
+import numpy as np
+import cv2
+
+
+class MotionObserver(ImageObserver):
+    """
+    An observer that measures motion by comparing each image with the previous one. The output is an array
+    [motion, mean_diff], where motion is the fraction of pixels that changed by more than pixel_threshold, and mean_diff
+    is the mean absolute difference between the images. Both are relative to the max pixel value of the image dtype,
+    so that the same thresholds work for 8 and 16 bit sources.
+
+    The motion value can be used to start and stop recording (see recording_gate.py). Since each image is compared
+    with the previous one, this observer should not run in pooled mode (workers > 1).
+
+    Parameters (in addition to the ImageObserver params):
+    - scale: Images are resized by this factor before they're compared, which reduces processing time and noise.
+    - blur: The size of the gaussian blur kernel applied to each resized image (an odd number), or 0 for no blur.
+    - pixel_threshold: The min change of a pixel value counted as motion, as a fraction of the max pixel value.
+    """
+
+    default_params = {
+        **ImageObserver.default_params,
+        "scale": 0.25,
+        "blur": 5,
+        "pixel_threshold": 0.1,
+    }
+
+    def _setup(self):
+        self.scale = self.get_config("scale")
+        self.blur = self.get_config("blur")
+        self.pixel_threshold = self.get_config("pixel_threshold")
+
+    def _on_start(self):
+        self.prev_img = None
+
+    def _on_image_update(self, img, timestamp):
+        cur_img = self._prepare(img)
+
+        if not self._is_image_valid():
+            # the image was overwritten by the image source while it was being resized
+            return
+
+        if self.prev_img is None:
+            output = (0, 0)
+        else:
+            diff = cv2.absdiff(cur_img, self.prev_img)
+            output = (np.count_nonzero(diff > self.pixel_threshold) / diff.size, diff.mean())
+
+        self.prev_img = cur_img
+        self._update_output(output)
+
+    def _prepare(self, img):
+        """
+        Return a resized, blurred, grayscale float32 copy of img with values between 0 and 1.
+        """
+        max_value = np.iinfo(img.dtype).max
+        if self.scale != 1:
+            img = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        img = img.astype(np.float32) / max_value
+        if self.blur:
+            img = cv2.GaussianBlur(img, (self.blur, self.blur), 0)
+
+        return img
+
+    def _get_buffer_opts(self):
+        return "d", 2, 2, np.double
@@ -1,5 +1,6 @@
 from video_stream import ImageObserver
 import numpy as np
+from image_utils import Converter8bit
 import video_system
 import data_log
 import experiment as exp
@@ -19,19 +20,21 @@ class YOLOv4ImageObserver(ImageObserver):
         from image_observers.YOLOv4.detector import YOLOv4Detector
 
         super()._init()
-        yolo_config = dict(self.config)
-
-        del yolo_config["src_id"]
-        del yolo_config["class"]
+        yolo_config = {
+            k: self.get_config(k)
+            for k in ("cfg_path", "weights_path", "meta_path", "conf_thres", "nms_thres")
+        }
 
         self.detector = YOLOv4Detector(**yolo_config, return_nearest_detection=True)
 
     def _setup(self):
-        self.detector.load()
+        self.detector.load(self.batch_size)
         self.log.info(
             f"YOLOv4 detector loaded successfully ({self.detector.model_width}x{self.detector.model_height} cfg: {self.detector.cfg_path} weights: {self.detector.weights_path})."
         )
         self.nan_det = np.empty_like(self.output)
+        self.converter_8bit = Converter8bit(self._img_src_scaling_8bit)
+        self._buf_8bit = None
         self.nan_det[:] = np.nan
 
     def _on_start(self):
@@ -42,11 +45,40 @@ class YOLOv4ImageObserver(ImageObserver):
 
     def _on_image_update(self, img, _):
         if img.dtype == "uint16":
-            img = (img / 256.0).astype("uint8")
+            img = self._to_8bit(img)
 
         det = self.detector.detect_image(img)
+
+        if not self._is_image_valid():
+            # the image was overwritten by the image source while running detection
+            return
+
         self._update_output(det if det is not None else self.nan_det)
 
+    def _on_images_update(self, imgs, timestamps):
+        if imgs.dtype == "uint16":
+            imgs = self._to_8bit(imgs, batch=True)
+
+        dets = self.detector.detect_images(imgs)
+
+        if not self._is_image_valid():
+            # the batch was overwritten by the image source while running detection
+            return
+
+        self._update_outputs(
+            [det if det is not None else self.nan_det for det in dets], timestamps
+        )
+
+    def _to_8bit(self, img, batch=False):
+        """
+        Convert a uint16 image, or a batch of images when batch is True, to 8 bits according to the image source
+        8bit_scaling param, reusing the output buffer.
+        """
+        if self._buf_8bit is None or self._buf_8bit.shape != img.shape:
+            self._buf_8bit = np.empty(img.shape, "uint8")
+
+        return self.converter_8bit.convert(img, out=self._buf_8bit, batch=batch)
+
     def _release(self):
         pass
 
@@ -2,7 +2,6 @@ import vimba
 
 from video_stream import ImageSource
 import time
-import numpy as np
 
 FRAME_QUEUE_SIZE = 10
 
@@ -111,16 +110,7 @@ class AlliedVisionImageSource(ImageSource):
             img = frame.as_numpy_ndarray()
             self.image_result = img
 
-            with self.buf.get_lock():
-                self.timestamp.value = timestamp
-
-                self.buf_np = np.frombuffer(
-                    self.buf.get_obj(), dtype=self.buf_dtype
-                ).reshape(self.buf_shape)
-                np.copyto(self.buf_np, img)
-
-                for obs in self.observer_events:
-                    obs.set()
+            self._write_image(img, timestamp)
         except Exception:
             self.log.exception(
                 "Exception while getting image from alliedVision camera:"
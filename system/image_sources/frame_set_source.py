@@ -0,0 +1,214 @@
+from video_stream import ImageSource
+import video_system
+import numpy as np
+import multiprocessing as mp
+import time
+
+
+class FrameSetImageSource(ImageSource):
+    """
+    FrameSetImageSource - an image source that groups the images of several other image sources (e.g. cameras
+    triggered by the same TTL signal) into synchronized frame sets, so that multi-view observers can process all views
+    of each moment together.
+
+    Each image of this source is a frame set containing one image from each source in src_ids, either tiled
+    horizontally, with shape (height, len(src_ids) * width, ...), which can be streamed and recorded like any other
+    image, or stacked along a new first axis, with shape (len(src_ids), *image_shape). Stacked frame sets can only be
+    processed by observers: they can't be streamed, and are only recorded by the raw writer backend. The image
+    timestamp is the earliest timestamp in the set, and the timestamps of all images in the set are stored as the
+    frame metadata (see video_stream.FrameBuffer.read_meta()).
+
+    Images are matched using one of two methods (the `match` param):
+    - "timestamp": Images are grouped when their timestamps are within `tolerance` seconds of each other. An image
+                   that is older than the newest image of another source by more than the tolerance is discarded.
+    - "index": The first set is matched by timestamp. After that images are matched by their index relative to the
+               first set, assuming every trigger produces exactly one image in each source.
+
+    Discarded images are counted in the unmatched_frames counter, and images that were overwritten in a source buffer
+    before they could be matched are counted in missed_frames. Per-source counts are published under the
+    "frame_sets" state key.
+
+    Parameters (in addition to the ImageSource params):
+    - src_ids: A list of image source ids. The sources must have the same image_shape and buf_dtype, and should be
+               loaded before this source (i.e. come before it in the video config).
+    - match: "timestamp" or "index" (see above).
+    - tolerance: The max difference between the timestamps of images in a set, in seconds.
+    - layout: "horizontal" or "stack" (see above).
+    """
+
+    latency_counters = ImageSource.latency_counters + (
+        "unmatched_frames",
+        "missed_frames",
+    )
+
+    default_params = {
+        **ImageSource.default_params,
+        "src_ids": [],
+        "match": "timestamp",
+        "tolerance": 0.005,
+        "layout": "horizontal",
+    }
+
+    def _init(self):
+        self.src_ids = list(self.get_config("src_ids"))
+        self.match = self.get_config("match")
+        self.tolerance = self.get_config("tolerance")
+        self.layout = self.get_config("layout")
+
+        if self.match not in ("timestamp", "index"):
+            raise ValueError(f"Invalid match method: {self.match}")
+        if self.layout not in ("stack", "horizontal"):
+            raise ValueError(f"Invalid frame set layout: {self.layout}")
+        if len(self.src_ids) == 0:
+            raise ValueError("No image sources were specified (src_ids)")
+
+        srcs = []
+        for src_id in self.src_ids:
+            if src_id not in video_system.image_sources:
+                raise ValueError(f"ImageSource {src_id} is not loaded")
+            srcs.append(video_system.image_sources[src_id])
+
+        shape = tuple(srcs[0].image_shape)
+        dtype = srcs[0].buf_dtype
+        for src in srcs[1:]:
+            if tuple(src.image_shape) != shape or src.buf_dtype != dtype:
+                raise ValueError(
+                    "All image sources of a frame set must have the same image_shape and buf_dtype"
+                )
+
+        count = len(srcs)
+        if self.layout == "stack":
+            self.config["image_shape"] = (count, *shape)
+        else:
+            self.config["image_shape"] = (shape[0], count * shape[1], *shape[2:])
+
+        self.config["buf_dtype"] = dtype
+        self.buf_dtype = dtype
+
+        if not self.config.get("video_frame_rate"):
+            src = srcs[0]
+            self.config["video_frame_rate"] = src.get_config("video_frame_rate") or src.config.get(
+                "frame_rate"
+            )
+
+        self.frame_meta_shape = (count,)
+        self.src_frame_bufs = [src.frame_buf for src in srcs]
+
+        self.update_event = mp.Event()
+        for src in srcs:
+            src.add_observer_event(self.update_event)
+
+        super()._init()
+
+    def _on_start(self):
+        self.next_seqs = np.array(
+            [buf.last_seq() + 1 for buf in self.src_frame_bufs], dtype=np.int64
+        )
+        self.offsets = None  # sequence number of each source in the first set ("index" matching)
+        self.unmatched = np.zeros(len(self.src_ids), dtype=np.int64)
+        self.missed = np.zeros(len(self.src_ids), dtype=np.int64)
+
+        self.img = np.empty(self.image_shape, dtype=self.buf_dtype)
+        self.frame_meta = np.zeros(len(self.src_ids))
+        self.unmatched_frames = 0
+        self.missed_frames = 0
+        return True
+
+    def _acquire_image(self):
+        while not self.stop_event.is_set():
+            self.update_event.clear()
+            if self._match_frame_set():
+                return self.img, self.frame_meta.min()
+
+            self.update_event.wait(0.1)
+
+        return None, time.time()
+
+    def _head_timestamps(self):
+        """
+        Return the timestamps of the next image of each source, or None if any of them wasn't acquired yet. Skips
+        images that were already overwritten in the source buffers.
+        """
+        timestamps = np.empty(len(self.src_frame_bufs))
+        for i, buf in enumerate(self.src_frame_bufs):
+            while True:
+                first_seq = buf.first_seq()
+                if self.next_seqs[i] < first_seq:
+                    self.missed[i] += first_seq - self.next_seqs[i]
+                    self.next_seqs[i] = first_seq
+
+                seq = self.next_seqs[i]
+                if seq > buf.last_seq():
+                    return None
+
+                timestamps[i] = buf._timestamps[seq % buf.length]
+                if buf.is_available(seq):
+                    break
+
+        return timestamps
+
+    def _match_frame_set(self):
+        """
+        Advance the next image of each source until they form a frame set, and copy the set into self.img. Return
+        False when there are not enough images for a complete set.
+        """
+        while True:
+            if self.offsets is not None:
+                # "index" matching: skip images whose counterparts in other sources were missed
+                rel = self.next_seqs - self.offsets
+                behind = rel < rel.max()
+                self.unmatched[behind] += rel.max() - rel[behind]
+                self.next_seqs[behind] = rel.max() + self.offsets[behind]
+
+            timestamps = self._head_timestamps()
+            if timestamps is None:
+                return False
+
+            if self.offsets is None:
+                late = timestamps < timestamps.max() - self.tolerance
+                if late.any():
+                    self.unmatched[late] += 1
+                    self.next_seqs[late] += 1
+                    continue
+
+            if self._copy_frame_set():
+                if self.match == "index" and self.offsets is None:
+                    self.offsets = self.next_seqs.copy()
+
+                self.frame_meta[:] = timestamps
+                self.next_seqs += 1
+                return True
+
+    def _copy_frame_set(self):
+        """
+        Copy the next image of each source into self.img. Return False if any image was overwritten while copying.
+        """
+        w = self.src_frame_bufs[0].image_shape[1]
+        for i, buf in enumerate(self.src_frame_bufs):
+            seq = self.next_seqs[i]
+            img, _ = buf.read(seq)
+            if img is not None:
+                if self.layout == "stack":
+                    np.copyto(self.img[i], img)
+                else:
+                    np.copyto(self.img[:, i * w : (i + 1) * w], img)
+
+            if img is None or not buf.is_available(seq):
+                self.missed[i] += 1
+                self.next_seqs[i] += 1
+                return False
+
+        return True
+
+    def _publish_stats(self):
+        self.unmatched_frames = int(self.unmatched.sum())
+        self.missed_frames = int(self.missed.sum())
+        super()._publish_stats()
+
+        try:
+            self.state["frame_sets"] = {
+                "unmatched_frames": dict(zip(self.src_ids, self.unmatched.tolist())),
+                "missed_frames": dict(zip(self.src_ids, self.missed.tolist())),
+            }
+        except Exception:
+            self.log.exception("Exception while publishing frame set stats:")
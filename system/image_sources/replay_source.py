@@ -0,0 +1,179 @@
+from video_stream import ImageSource, AcquireException
+import numpy as np
+import frame_timestamps
+import cv2
+import json
+import time
+from pathlib import Path
+
+
+class ReplayImageSource(ImageSource):
+    """
+    ReplayImageSource - an image source that replays a video recorded by video_write.VideoWriter, emitting each frame
+    with its original timestamp from the timestamps file written alongside the video (<video stem>.timestamps, see
+    frame_timestamps, or <video stem>.csv).
+
+    Frames are either replayed in real time, following the intervals between the recorded timestamps, or as fast as
+    possible for offline processing of recordings by the same observers that run on live sources. Real-time replay
+    follows an absolute schedule starting at the first replayed frame, so it doesn't drift when reading a frame takes
+    a variable amount of time, and catches up after stalls.
+
+    When wait_for_observers is enabled the source doesn't write a frame before every running observer is done with
+    the frame it would overwrite in the image buffer (see video_stream.FrameBuffer.can_write()), so observers don't
+    drop frames however slow they are. Once the replay is done the "replay_done" state key is set to True and the
+    source stays idle until it's stopped.
+
+    Parameters (in addition to the ImageSource params):
+    - video_path: The path of the video file.
+    - timestamps_path: The path of a binary (.timestamps) or csv timestamps file. When None, <video stem>.timestamps
+                       in the video directory is used, or <video stem>.csv if it doesn't exist.
+    - realtime: When True, frames are replayed at the recorded intervals. Otherwise they're replayed as fast as
+                possible.
+    - speed: Playback speed multiplier in real-time mode, e.g. 2 replays the session twice as fast.
+    - start_frame: The index of the first frame to replay.
+    - end_frame: The index after the last frame to replay, or None to replay until the end of the video.
+    - is_color: Whether to replay 3-channel BGR images. When None, it's determined from the image_shape stored in
+                the video metadata file (<video stem>.json), if it exists.
+    - shift_timestamps: When True, timestamps are shifted to the replay time (keeping the recorded intervals) instead of
+                        the original acquisition times. This keeps latency stats meaningful in real-time mode.
+    - wait_for_observers: Whether to wait for running observers before overwriting frames they still need (see above).
+                          When None, it's enabled only when realtime is False.
+    """
+
+    default_params = {
+        **ImageSource.default_params,
+        "video_path": None,
+        "timestamps_path": None,
+        "realtime": True,
+        "speed": 1.0,
+        "start_frame": 0,
+        "end_frame": None,
+        "is_color": None,
+        "shift_timestamps": False,
+        "wait_for_observers": None,
+    }
+
+    def _init(self):
+        self.video_path = Path(self.get_config("video_path"))
+        self.realtime = self.get_config("realtime")
+        self.speed = self.get_config("speed")
+        self.shift_timestamps = self.get_config("shift_timestamps")
+
+        self.wait_for_observers = self.get_config("wait_for_observers")
+        if self.wait_for_observers is None:
+            self.wait_for_observers = not self.realtime
+
+        if self.speed <= 0:
+            raise ValueError(f"Invalid replay speed: {self.speed}")
+
+        timestamps_path = self.get_config("timestamps_path")
+        if timestamps_path is None:
+            timestamps_path = frame_timestamps.timestamps_path(self.video_path)
+            if not timestamps_path.exists():
+                timestamps_path = self.video_path.with_suffix(".csv")
+
+        if Path(timestamps_path).suffix == frame_timestamps.file_suffix:
+            records = frame_timestamps.read_timestamps(timestamps_path)
+            self.timestamps = np.array(records["timestamp"])
+        else:
+            self.timestamps = np.loadtxt(
+                timestamps_path, delimiter=",", skiprows=1, usecols=0, ndmin=1
+            )
+
+        if not self.config.get("video_frame_rate") and len(self.timestamps) > 1:
+            # record replayed frames at the original frame rate
+            self.config["video_frame_rate"] = round(
+                1 / np.median(np.diff(self.timestamps))
+            )
+
+        self.is_color = self.get_config("is_color")
+        if self.is_color is None:
+            metadata_path = self.video_path.with_suffix(".json")
+            if metadata_path.exists():
+                with open(metadata_path, "r") as f:
+                    src_config = json.load(f).get("image_source_config") or {}
+                self.is_color = len(src_config.get("image_shape") or ()) == 3
+            else:
+                self.is_color = False
+
+        vcap = cv2.VideoCapture(str(self.video_path))
+        self.frame_count = int(vcap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.config.get("image_shape") is None:
+            h = int(vcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            w = int(vcap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.config["image_shape"] = (h, w, 3) if self.is_color else (h, w)
+        vcap.release()
+
+        self.start_frame = self.get_config("start_frame")
+        self.end_frame = self.get_config("end_frame")
+        if self.end_frame is None or self.end_frame > len(self.timestamps):
+            self.end_frame = len(self.timestamps)
+
+        super()._init()
+
+    def _on_start(self):
+        if not self.video_path.exists():
+            raise Exception(f"File not found: {self.video_path}")
+
+        if self.frame_count != len(self.timestamps):
+            self.log.warning(
+                f"Video has {self.frame_count} frames but {len(self.timestamps)} timestamps. "
+                "Replaying only frames that have timestamps."
+            )
+
+        self.vcap = cv2.VideoCapture(str(self.video_path))
+        if self.start_frame != 0:
+            self.vcap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+
+        self.frame_num = self.start_frame
+        self.start_time = None
+        self.replay_done = False
+        self.state["replay_done"] = False
+        return True
+
+    def _acquire_image(self):
+        if self.frame_num >= self.end_frame:
+            return self._replay_done()
+
+        ret, img = self.vcap.read()
+        if not ret:
+            raise AcquireException(f"Error reading frame {self.frame_num}")
+
+        if not self.is_color:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        # Time since the first replayed frame, in recorded time
+        offset = self.timestamps[self.frame_num] - self.timestamps[self.start_frame]
+        if self.start_time is None:
+            self.start_time = time.time()
+
+        if self.realtime:
+            time.sleep(max(self.start_time + offset / self.speed - time.time(), 0))
+
+        if self.wait_for_observers:
+            while not self.frame_buf.can_write():
+                if self.stop_event.is_set():
+                    return None, time.time()
+                time.sleep(0.001)
+
+        if self.shift_timestamps:
+            timestamp = self.start_time + offset / self.speed
+        else:
+            timestamp = self.timestamps[self.frame_num]
+
+        self.frame_num += 1
+        return img, timestamp
+
+    def _replay_done(self):
+        if not self.replay_done:
+            self.replay_done = True
+            self.log.info(
+                f"Replayed {self.frame_num - self.start_frame} frames from {self.video_path}"
+            )
+            self.state["replay_done"] = True
+
+        self.stop_event.wait(1)
+        return None, time.time()
+
+    def _on_stop(self):
+        self.vcap.release()
@@ -0,0 +1,134 @@
+from video_stream import ImageSource
+import numpy as np
+import cv2
+import time
+
+
+class SyntheticImageSource(ImageSource):
+    """
+    SyntheticImageSource - an image source that generates a test pattern of moving blobs, for testing and
+    benchmarking the video system without cameras.
+
+    The image size, number of channels and pixel type are set by the image_shape and buf_dtype params. Each image
+    embeds its frame number in the pixels of the first row (see read_frame_number()), which makes it possible to
+    verify that no frames were dropped or reordered downstream.
+
+    Parameters (in addition to the ImageSource params):
+    - frame_rate: The number of frames per second, or None to generate frames as fast as possible.
+    - blob_count: The number of moving blobs.
+    - blob_radius: The radius of each blob in pixels.
+    - blob_speed: The distance each blob moves between frames in pixels.
+    - background: The background intensity as a fraction of the max pixel value (0-1).
+    - max_frames: Stop acquiring after this many frames, or None to continue until shutdown.
+    - seed: Random seed for the initial blob positions and directions.
+    """
+
+    default_params = {
+        **ImageSource.default_params,
+        "frame_rate": 60,
+        "blob_count": 3,
+        "blob_radius": 20,
+        "blob_speed": 4,
+        "background": 0.1,
+        "max_frames": None,
+        "seed": 0,
+    }
+
+    # Number of pixels used to store the frame number
+    frame_number_pixels = 8
+
+    def _init(self):
+        super()._init()
+
+        self.frame_rate = self.get_config("frame_rate")
+        self.max_frames = self.get_config("max_frames")
+        self.blob_radius = self.get_config("blob_radius")
+
+        max_value = np.iinfo(self.buf_dtype).max
+        self.background = int(self.get_config("background") * max_value)
+        self.blob_value = int(0.9 * max_value)
+
+    def _on_start(self):
+        rng = np.random.default_rng(self.get_config("seed"))
+        blob_count = self.get_config("blob_count")
+        h, w = self.image_shape[:2]
+
+        self.blob_pos = rng.uniform((0, 0), (w, h), size=(blob_count, 2))
+        angles = rng.uniform(0, 2 * np.pi, size=blob_count)
+        self.blob_vel = self.get_config("blob_speed") * np.stack(
+            [np.cos(angles), np.sin(angles)], axis=1
+        )
+
+        self.img = np.empty(self.image_shape, dtype=self.buf_dtype)
+        self.frame_num = 0
+        self.start_time = None
+        self.done = False
+        return True
+
+    def _acquire_image(self):
+        if self.max_frames is not None and self.frame_num >= self.max_frames:
+            if not self.done:
+                self.log.info(f"Generated {self.frame_num} frames.")
+                self.done = True
+            # stay idle until stopped
+            self.stop_event.wait(1)
+            return None, time.time()
+
+        if self.frame_rate:
+            # absolute schedule to avoid accumulating drift
+            if self.start_time is None:
+                self.start_time = time.time()
+            next_time = self.start_time + self.frame_num / self.frame_rate
+            time.sleep(max(next_time - time.time(), 0))
+
+        self._draw_frame()
+        self.frame_num += 1
+        return self.img, time.time()
+
+    def _draw_frame(self):
+        img = self.img
+        h, w = img.shape[:2]
+        color = (self.blob_value,) * (img.shape[2] if img.ndim == 3 else 1)
+
+        img[:] = self.background
+        for x, y in self.blob_pos:
+            cv2.circle(img, (int(x), int(y)), self.blob_radius, color, -1)
+
+        # move the blobs, bouncing off the image edges
+        self.blob_pos += self.blob_vel
+        for i, size in enumerate((w, h)):
+            out = (self.blob_pos[:, i] < 0) | (self.blob_pos[:, i] >= size)
+            self.blob_vel[out, i] *= -1
+            self.blob_pos[:, i] = np.clip(self.blob_pos[:, i], 0, size - 1)
+
+        self.write_frame_number(img, self.frame_num)
+
+    @classmethod
+    def write_frame_number(cls, img, frame_num):
+        """
+        Store frame_num in the first frame_number_pixels pixels of the first row of img, one byte per pixel (little
+        endian). The bytes are written to every channel and, in uint16 images, to both bytes of each pixel so that
+        they survive "full_range" conversion to 8 bits. Lossy encoding (e.g. video files) doesn't preserve them.
+        """
+        digits = np.frombuffer(np.uint64(frame_num).tobytes(), dtype=np.uint8)
+        if img.dtype == np.uint16:
+            digits = digits.astype(np.uint16) * 257
+
+        if img.ndim == 3:
+            digits = digits[:, None]
+
+        img[0, : cls.frame_number_pixels] = digits
+
+    @classmethod
+    def read_frame_number(cls, img):
+        """
+        Return the frame number stored in img by a SyntheticImageSource. Works with images that were converted from
+        uint16 to uint8 using "full_range" scaling.
+        """
+        digits = img[0, : cls.frame_number_pixels]
+        if img.ndim == 3:
+            digits = digits[:, 0]
+        if img.dtype == np.uint16:
+            digits = digits >> 8
+
+        return int(np.frombuffer(digits.astype(np.uint8).tobytes(), dtype=np.uint64)[0])
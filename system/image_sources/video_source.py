@@ -1,12 +1,29 @@
 from video_stream import ImageSource, AcquireException
 import cv2
 import time
+import queue
+import threading
 from pathlib import Path
 
 
 class VideoImageSource(ImageSource):
     """
     VideoImageSource - an image source that reads images from a video file or a camera using openCV.
+
+    Video files are decoded ahead of time by a separate thread into a queue of up to prefetch_size images, so that
+    decoding time variations and seeking when repeating don't delay frames. Frames are emitted on an absolute
+    schedule of frame_rate frames per second that doesn't drift. When the source falls behind the schedule by more
+    than a frame, the schedule restarts from the current frame instead of emitting frames in a burst.
+
+    Parameters (in addition to the ImageSource params):
+    - video_path: A video file path, or a camera index.
+    - frame_rate: The number of frames per second. When None, the frame rate of the video file is used.
+    - start_frame: The index of the first frame to read from a video file.
+    - end_frame: The index after the last frame to read from a video file, or None to read until the end of the file.
+    - repeat: False to stop at the end of the video, True to repeat indefinitely, or the number of times the video
+              should be played.
+    - is_color: Whether to emit 3-channel BGR images instead of grayscale images.
+    - prefetch_size: The max number of decoded images waiting in the prefetch queue.
     """
 
     default_params = {
@@ -17,6 +34,7 @@ class VideoImageSource(ImageSource):
         "end_frame": None,
         "repeat": False,
         "is_color": False,
+        "prefetch_size": 16,
     }
 
     def _init(self):
@@ -26,6 +44,7 @@ class VideoImageSource(ImageSource):
         self.end_frame = self.get_config("end_frame")
         self.repeat = self.get_config("repeat")
         self.is_color = self.get_config("is_color")
+        self.prefetch_size = self.get_config("prefetch_size")
 
         if self.start_frame is None:
             self.start_frame = 0
@@ -51,6 +70,9 @@ class VideoImageSource(ImageSource):
                         int(vcap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
                         int(vcap.get(cv2.CAP_PROP_FRAME_WIDTH)),
                     )
+            if not self.frame_rate:
+                self.frame_rate = vcap.get(cv2.CAP_PROP_FPS)
+                self.config["frame_rate"] = self.frame_rate
             vcap.release()
 
         super()._init()
@@ -66,7 +88,7 @@ class VideoImageSource(ImageSource):
             self.vcap = cv2.VideoCapture(self.video_path)
 
         if self.end_frame is None:
-            self.end_frame = self.vcap.get(cv2.CAP_PROP_FRAME_COUNT) - 1
+            self.end_frame = self.vcap.get(cv2.CAP_PROP_FRAME_COUNT)
         if self.start_frame != 0:
             self.vcap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
 
@@ -77,15 +99,21 @@ class VideoImageSource(ImageSource):
             self.vcap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.image_shape[0])
             # print(self.vcap.get(cv2.CAP_PROP_FPS), self.vcap.get(cv2.CAP_PROP_FOURCC), self.vcap.get(cv2.CAP_PROP_FRAME_WIDTH), self.vcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-        self.frame_num = self.start_frame
-        self.repeat_count = 0
-        self.last_acquire_time = None
+        self.frame_count = 0
+        self.start_time = None
+
+        if self.is_video_src:
+            self.prefetch_q = queue.Queue(self.prefetch_size)
+            self.stop_decoding = threading.Event()
+            self.decode_thread = threading.Thread(target=self._decode, daemon=True)
+            self.decode_thread.start()
+
         return True
 
-    def _acquire_image(self):
-        if self.last_acquire_time is not None:
-            time.sleep(max(1 / self.frame_rate - self.last_acquire_time, 0))
-        t = time.time()
+    def _read_frame(self):
+        """
+        Read the next frame from the video capture and return it converted according to is_color.
+        """
         ret, img = self.vcap.read()
         if not ret:
             raise AcquireException("Error reading frame")
@@ -93,21 +121,87 @@ class VideoImageSource(ImageSource):
         if not self.is_color:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-        if self.is_video_src and self.frame_num >= self.end_frame:
-            if self.repeat is False:
-                return None, t
-            elif self.repeat is True or type(self.repeat) is int:
-                self.repeat_count += 1
-                if type(self.repeat) is int and self.repeat_count >= self.repeat:
-                    self.log.info(f"Done repeating {self.repeat} times.")
-                    return None, t
-                else:
+        return img
+
+    def _decode(self):
+        """
+        Decode frames from the video file into the prefetch queue. Runs on the decode thread. Puts None in the queue
+        when there are no more frames, or the AcquireException that stopped decoding.
+        """
+        frame_num = self.start_frame
+        repeat_count = 0
+
+        try:
+            while not self.stop_decoding.is_set():
+                if frame_num >= self.end_frame:
+                    repeat_count += 1
+                    if self.repeat is False or (
+                        type(self.repeat) is int and repeat_count >= self.repeat
+                    ):
+                        item = None
+                        break
+
                     self.vcap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
-                    self.frame_num = self.start_frame
+                    frame_num = self.start_frame
+
+                item = self._read_frame()
+                frame_num += 1
+                self._put_decoded(item)
+        except AcquireException as e:
+            item = e
+        except Exception as e:
+            item = AcquireException(f"Error decoding video: {e}")
+
+        self._put_decoded(item)
+
+    def _put_decoded(self, item):
+        # wait for room in the queue without missing a stop request
+        while not self.stop_decoding.is_set():
+            try:
+                self.prefetch_q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _wait_for_schedule(self):
+        """
+        Sleep until the time the next frame is due according to frame_rate.
+        """
+        if not self.frame_rate:
+            return
+
+        now = time.time()
+        if self.start_time is None:
+            self.start_time = now
+
+        next_time = self.start_time + self.frame_count / self.frame_rate
+        if now - next_time > 1 / self.frame_rate:
+            # fell behind by more than a frame; restart the schedule
+            self.start_time = now
+            self.frame_count = 0
+        else:
+            time.sleep(max(next_time - now, 0))
+
+    def _acquire_image(self):
+        if self.is_video_src:
+            img = self.prefetch_q.get()
+            if img is None:
+                if self.repeat is not False:
+                    self.log.info(f"Done repeating {self.repeat} times.")
+                self.stop_event.set()
+                return None, time.time()
+            if isinstance(img, AcquireException):
+                raise img
+        else:
+            img = self._read_frame()
 
-        self.frame_num += 1
-        self.last_acquire_time = time.time() - t
-        return img, t
+        self._wait_for_schedule()
+        self.frame_count += 1
+        return img, time.time()
 
     def _on_stop(self):
+        if self.is_video_src:
+            self.stop_decoding.set()
+            self.decode_thread.join()
+
         self.vcap.release()
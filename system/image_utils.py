@@ -6,41 +6,66 @@ Author: Tal Eisenberg, 2021
 import io
 from PIL import Image
 import numpy as np
+import cv2
 import collections
+import functools
 
 
-def resize_image(img: Image, size=(None, None)):
+def get_resize_size(orig_size, size=(None, None)):
     """
-    Resize an image to the desired size.
-
-    :param img: The image as a PIL Image object.
-    :param size: A (width, height) tuple.
+    Return the (width, height) an image of size `orig_size` should be resized to, or None if it should not be resized.
 
-    When both width and height are None, a copy of the original image is returned.
-    When one of the size parameters is None, the returned image will retain the aspect
-    ratio of the original image.
+    :param orig_size: The original (width, height) of the image.
+    :param size: A (width, height) tuple. When one of the size parameters is None, the returned size will retain the
+                 aspect ratio of the original image.
     """
     if (size[0] is None and size[1] is None) or (
-        size[0] == img.size[0] and size[1] == img.size[1]
+        size[0] == orig_size[0] and size[1] == orig_size[1]
     ):
-        return img.copy()
+        return None
 
     elif size[0] is None or size[1] is None:
-        ratio = img.size[0] / img.size[1]
+        ratio = orig_size[0] / orig_size[1]
 
         if size[0] is None:
-            if size[1] == img.size[1]:
-                return img.copy()
+            if size[1] == orig_size[1]:
+                return None
             else:
                 size = (int(size[1] * ratio), size[1])
 
         elif size[1] is None:
-            if size[0] == img.size[0]:
-                return img.copy()
+            if size[0] == orig_size[0]:
+                return None
             else:
                 size = (size[0], int(size[0] / ratio))
 
-    return img.resize((int(size[0]), int(size[1])), resample=Image.BOX)
+    return int(size[0]), int(size[1])
+
+
+def resize_image(img: Image, size=(None, None)):
+    """
+    Resize an image to the desired size.
+
+    :param img: The image as a PIL Image object.
+    :param size: A (width, height) tuple.
+
+    When both width and height are None, a copy of the original image is returned.
+    When one of the size parameters is None, the returned image will retain the aspect
+    ratio of the original image.
+    """
+    size = get_resize_size(img.size, size)
+    if size is None:
+        return img.copy()
+
+    return img.resize(size, resample=Image.BOX)
+
+
+def is_image_shape(shape):
+    """
+    Return True if `shape` is the shape of a single grayscale (height, width) image, or a (height, width, channels)
+    image with 1, 3 or 4 channels, i.e. an image that can be encoded by encode_image() or CVImageEncoder.
+    """
+    return len(shape) == 2 or (len(shape) == 3 and shape[2] in (1, 3, 4))
 
 
 def encode_image(img, encoding="WebP", encode_params={}, shape=(None, None)):
@@ -61,32 +86,200 @@ def encode_image(img, encoding="WebP", encode_params={}, shape=(None, None)):
         return output.getvalue()
 
 
-def convert_to_8bit(img, scaling_param):
+class CVImageEncoder:
     """
-    Convert an image numpy array to a uint8 numpy array, scaling each pixel channel intensity according to `scaling_param`.
+    Encode images using OpenCV, possibly resizing them first (using cv2.INTER_AREA interpolation). This is
+    considerably faster than encode_image(), and is used for streaming images over HTTP.
 
-    Args:
-    - img: The original image (numpy array).
-    - scaling_param: Any of the following:
-        - "auto" (str): Scale pixel intensities linearly so that the image minimum becomes 0 and the maximum becomes 255.
-        - "full_range" (str): Linear scaling which maps 0 to 0 and 65535 to 255.
-        - [a, b] (any two-element sequence): Linear scaling which maps a to 0 and b to 255.
+    The image is resized directly from the supplied numpy array into a buffer that is reused between calls, so an
+    encoder should not be shared between threads. As in OpenCV, 3-channel images are assumed to be BGR.
+    """
+
+    # encoding -> (file extension, {encode param name: cv2 flag})
+    encodings = {
+        "jpeg": (
+            ".jpg",
+            {
+                "quality": cv2.IMWRITE_JPEG_QUALITY,
+                "optimize": cv2.IMWRITE_JPEG_OPTIMIZE,
+                "progressive": cv2.IMWRITE_JPEG_PROGRESSIVE,
+            },
+        ),
+        "webp": (".webp", {"quality": cv2.IMWRITE_WEBP_QUALITY}),
+        "png": (".png", {"compression": cv2.IMWRITE_PNG_COMPRESSION}),
+    }
+
+    def __init__(self, encoding="jpeg", encode_params={}):
+        """
+        :param encoding: One of "jpeg", "webp" or "png".
+        :param encode_params: A dict of encoding parameters. jpeg: quality (0-100), optimize (bool),
+                              progressive (bool); webp: quality (1-100); png: compression (0-9).
+        """
+        encoding = encoding.lower()
+        if encoding not in self.encodings:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+        self.ext, param_flags = self.encodings[encoding]
+        self.flags = []
+        for k, v in encode_params.items():
+            if k not in param_flags:
+                raise ValueError(f"Unknown {encoding} encoding parameter: {k}")
+            self.flags += [param_flags[k], int(v)]
+
+        self._resize_buf = None
 
+    def encode(self, img, shape=(None, None)):
+        """
+        Encode the supplied image, possibly resizing it first.
+
+        :param img: A numpy array containing image data.
+        :param shape: The desired (width, height) (see get_resize_size)
+
+        Return the encoded image as a byte string.
+        """
+        size = get_resize_size((img.shape[1], img.shape[0]), shape)
+        if size is not None:
+            buf_shape = (size[1], size[0], *img.shape[2:])
+            if (
+                self._resize_buf is None
+                or self._resize_buf.shape != buf_shape
+                or self._resize_buf.dtype != img.dtype
+            ):
+                self._resize_buf = np.empty(buf_shape, img.dtype)
+
+            img = cv2.resize(
+                img, size, dst=self._resize_buf, interpolation=cv2.INTER_AREA
+            )
+
+        success, enc_img = cv2.imencode(self.ext, img, self.flags)
+        if not success:
+            raise ValueError(f"Could not encode image as {self.ext}")
+
+        return enc_img.tobytes()
+
+
+def _scaling_range(img, scaling_param):
+    """
+    Return the (min, max) pixel values that are mapped to 0 and 255 according to `scaling_param` (see
+    convert_to_8bit), or None for "truncate".
     """
     if isinstance(scaling_param, str):
         if scaling_param == "truncate":
-            return img.astype("uint8")
+            return None
         if scaling_param == "auto":
-            smin, smax = img.min(), img.max()
+            return img.min(), img.max()
         elif scaling_param == "full_range":
-            smin, smax = 0, (2**16) - 1
+            return 0, (2**16) - 1
         else:
             raise ValueError(f"Invalid scaling_8bit parameter value: {scaling_param}")
     elif isinstance(scaling_param, collections.abc.Sequence):
         smin, smax = scaling_param
+        return smin, smax
     else:
         raise ValueError(f"Invalid scaling_8bit parameter value: {scaling_param}")
 
+
+@functools.lru_cache(maxsize=64)
+def get_8bit_lut(smin, smax):
+    """
+    Return a 65536-entry uint8 lookup table mapping each uint16 value to 8 bits using linear scaling which maps smin to
+    0 and smax to 255 (or truncation to the low byte when smin and smax are None). When smin equals smax, values above
+    smin are mapped to 255 and the rest to 0, so e.g. a constant image is converted to zeros. Tables are cached and must
+    not be modified.
+    """
+    values = np.arange(2**16, dtype="int32")
+    if smin is None:
+        lut = values.astype("uint8")
+    elif smax == smin:
+        lut = np.where(values > smin, 255, 0).astype("uint8")
+    else:
+        lut = np.clip(255.0 * (values - smin) / (smax - smin), 0, 255).astype("uint8")
+
+    lut.flags.writeable = False
+    return lut
+
+
+class Converter8bit:
+    """
+    Convert uint16 images to uint8 using lookup tables (see get_8bit_lut()), which takes a single pass over the image
+    and can write into a reusable output buffer.
+
+    In "auto" mode the scaling range is the min and max of a subsample of the image (every auto_subsample pixels in
+    each axis), and is only updated every auto_interval images.
+    """
+
+    def __init__(self, scaling_param, auto_interval=30, auto_subsample=8):
+        """
+        Args:
+        - scaling_param: The scaling parameter (see convert_to_8bit).
+        - auto_interval: How often the scaling range is updated in "auto" mode, in number of converted images.
+        - auto_subsample: The pixel step in each axis used for finding the scaling range in "auto" mode.
+        """
+        self.scaling_param = scaling_param
+        self.auto = scaling_param == "auto"
+        self.auto_interval = auto_interval
+        self.auto_subsample = auto_subsample
+
+        self._lut = None
+        self._count = 0
+        if not self.auto:
+            self._lut = get_8bit_lut(*self._range(None))
+
+    def _range(self, img):
+        if self.auto:
+            s = self.auto_subsample
+            sample = img[::s, ::s]
+            return int(sample.min()), int(sample.max())
+
+        scaling_range = _scaling_range(img, self.scaling_param)
+        if scaling_range is None:
+            return None, None
+        return tuple(scaling_range)
+
+    def convert(self, img, out=None, batch=False):
+        """
+        Return the image converted to uint8. When `out` is supplied it's used as the output array, and must be a uint8
+        array with the same shape as img.
+
+        Args:
+        - img: A uint16 image array, or a batch of images with shape (N, height, width, ...).
+        - out: An optional output array.
+        - batch: Whether img is a batch of images. In "auto" mode the first image of a batch determines the scaling
+                 range.
+        """
+        if self.auto:
+            if self._count % self.auto_interval == 0:
+                self._lut = get_8bit_lut(*self._range(img[0] if batch else img))
+            self._count += 1
+
+        # uint16 values are always valid indices into the 65536 entry table. with the default mode="raise" numpy
+        # would write into a temporary array and copy it into out.
+        return np.take(self._lut, img, out=out, mode="clip")
+
+
+def convert_to_8bit(img, scaling_param):
+    """
+    Convert an image numpy array to a uint8 numpy array, scaling each pixel channel intensity according to `scaling_param`.
+
+    Args:
+    - img: The original image (numpy array).
+    - scaling_param: Any of the following:
+        - "auto" (str): Scale pixel intensities linearly so that the image minimum becomes 0 and the maximum becomes 255.
+        - "full_range" (str): Linear scaling which maps 0 to 0 and 65535 to 255.
+        - [a, b] (any two-element sequence): Linear scaling which maps a to 0 and b to 255.
+        - "truncate" (str): Keep the low byte of each pixel.
+
+    uint16 images are converted using a cached lookup table (see get_8bit_lut()). Use Converter8bit to convert
+    a stream of images.
+    """
+    scaling_range = _scaling_range(img, scaling_param)
+    if scaling_range is None:
+        return img.astype("uint8")
+
+    smin, smax = scaling_range
+    if img.dtype == np.uint16:
+        return np.take(get_8bit_lut(smin, smax), img, mode="clip")
+
     if smax == smin:
         return img
     else:
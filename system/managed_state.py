@@ -2,13 +2,13 @@
 Multi-process, shared, state store implementation based on multiprocessing.Manager
 Author: Tal Eisenberg, 2021
 
-The state store maintains a shared dictionary. Access to the dictionary is synchronized between processes and threads
-by creating a deep copy of the full dictionary on each read, and replacing the full dictionary when updating any of its
-values (i.e. the dictionary is immutable). This makes dictionary access quite slow compared to a local dict, however
-the difference in performance should be negligble for small dictionaries (up to a few thousand elements).
+The state store maintains a shared dictionary held by the state store server. Reading or writing a value is a
+single call to the server, which runs the operation at the requested path while holding a lock, so that reads only
+transfer the requested value, and writes only transfer the new value. Values read from the store are always copies,
+so changing them has no effect on the store. Reading the whole dictionary (e.g. the root Cursor's get_self()) is still
+as slow as copying it, so it's better to read specific paths when possible.
 
-Since the whole dictionary is copied on every read, and changing any value requires replacing the whole
-dictionary, reading and writing state values should be done using Cursor objects.
+Reading and writing state values should be done using Cursor objects.
 
 In addition to sharing data between processes and threads, the state store can be used for synchronization
 by changing a value from one process and listening for changes of this value from another process. This is possible
@@ -21,9 +21,10 @@ Module classes:
 - StateDispatcher: Makes it possible to register callback functions that will run whenever specific state
                    values are updated.
 """
-from copy import copy, deepcopy
+from copy import copy
 import multiprocessing as mp
-from multiprocessing.managers import DictProxy, SyncManager
+from multiprocessing.managers import BaseProxy, DictProxy, SyncManager
+import pickle
 import threading
 import dicttools as dt
 
@@ -32,6 +33,86 @@ class _StateManager(SyncManager):
     pass
 
 
+class _StateServer:
+    """
+    The state dictionary. Lives on the state store server, and is accessed by Cursors through a _StateProxy.
+
+    Each method runs one dicttools path function on the server while holding a lock. Values are returned pickled,
+    since pickling them after the lock is released could race with a concurrent write.
+    """
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, default=None, has_default=False):
+        with self._lock:
+            v = dt.getitem(self._state, path, default if has_default else dt.path_not_found)
+            return pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def set(self, path, v):
+        with self._lock:
+            if len(path) == 0:
+                self._state = v
+            else:
+                dt.setitem(self._state, path, v)
+
+    def update(self, path, kvs):
+        with self._lock:
+            dt.update(self._state, path, kvs)
+
+    def delete(self, path):
+        with self._lock:
+            dt.delete(self._state, path)
+
+    def remove(self, path, v):
+        with self._lock:
+            dt.remove(self._state, path, v)
+
+    def append(self, path, v):
+        with self._lock:
+            dt.append(self._state, path, v)
+
+    def contains(self, path, v):
+        with self._lock:
+            return dt.contains(self._state, path, v)
+
+    def exists(self, path):
+        with self._lock:
+            return dt.exists(self._state, path)
+
+
+class _StateProxy(BaseProxy):
+    _exposed_ = ("get", "set", "update", "delete", "remove", "append", "contains", "exists")
+
+    def get(self, path, default=dt.path_not_found):
+        # path_not_found can't be sent to the server as is, since it's compared by identity
+        has_default = default is not dt.path_not_found
+        v = self._callmethod("get", (path, default if has_default else None, has_default))
+        return pickle.loads(v)
+
+    def set(self, path, v):
+        return self._callmethod("set", (path, v))
+
+    def update(self, path, kvs):
+        return self._callmethod("update", (path, kvs))
+
+    def delete(self, path):
+        return self._callmethod("delete", (path,))
+
+    def remove(self, path, v):
+        return self._callmethod("remove", (path, v))
+
+    def append(self, path, v):
+        return self._callmethod("append", (path, v))
+
+    def contains(self, path, v):
+        return self._callmethod("contains", (path, v))
+
+    def exists(self, path):
+        return self._callmethod("exists", (path,))
+
+
 class CursorException(Exception):
     pass
 
@@ -66,9 +147,6 @@ class Cursor:
 
     A Cursor can create a new SyncManager for connecting to the state store server, but it can also share
     an existing manager that was created by another cursor as long as they both run on the same process.
-
-    The Cursor can also be used to get, add or remove shared multiprocessing.Event objects. This provides a
-    way to synchronize multiple processes with a very low overhead.
     """
     def __init__(
         self,
@@ -101,6 +179,7 @@ class Cursor:
 
         if self._mgr is None:
             _StateManager.register("get")
+            _StateManager.register("state", proxytype=_StateProxy)
             self._mgr = _StateManager(
                 address=self._address, authkey=self._authkey.encode("ASCII")
             )
@@ -108,6 +187,7 @@ class Cursor:
             mp.current_process().authkey = authkey.encode("ASCII")
 
         self._store = self._mgr.get()
+        self._state = self._mgr.state()
 
     def _notify(self):
         for e in self._store["did_update_events"]:
@@ -117,15 +197,10 @@ class Cursor:
         return self._store["lock"]
 
     def _get_state(self):
-        return deepcopy(self._store["state"])
-
-    def _set_state(self, new_state):
-        self._store["state"] = new_state
+        return self._state.get(())
 
     def _setitem(self, path, v):
-        with self._get_lock():
-            self._set_state(dt.setitem(self._get_state(), path, v))
-
+        self._state.set(path, v)
         self._notify()
 
     def get(self, path, default=dt.path_not_found):
@@ -137,7 +212,7 @@ class Cursor:
         - default: A default value in case the path does not exist. Using dicttools.path_not_found will result
                    in raising a KeyError exception if the path does not exist.
         """
-        return dt.getitem(self._get_state(), self.absolute_path(path), default)
+        return self._state.get(self.absolute_path(path), default)
 
     def get_self(self, default=dt.path_not_found):
         """
@@ -153,13 +228,7 @@ class Cursor:
         """
         Set the value at the Cursor path to `v`.
         """
-        if self.path == ():
-            with self._get_lock():
-                self._set_state(v)
-
-            self._notify()
-        else:
-            self._setitem(self.absolute_path(()), v)
+        self._setitem(self.path, v)
 
     def update(self, path, kvs):
         """
@@ -170,9 +239,7 @@ class Cursor:
                 at this path must be a dict.
         - kvs: A dict. Keys and values from this dict will be added to the state dict.
         """
-        with self._get_lock():
-            self._set_state(dt.update(self._get_state(), self.absolute_path(path), kvs))
-
+        self._state.update(self.absolute_path(path), kvs)
         self._notify()
 
     def delete(self, path):
@@ -183,9 +250,7 @@ class Cursor:
         - path: tuple, string or int. A path relative to the base path of the Cursor. The value
                 at this path must belong to a collection with a pop() function (e.g. list or dict).
         """
-        with self._get_lock():
-            self._set_state(dt.delete(self._get_state(), self.absolute_path(path)))
-
+        self._state.delete(self.absolute_path(path))
         self._notify()
 
     def remove(self, path, v):
@@ -197,9 +262,7 @@ class Cursor:
                 at this path must be a list.
         - v: The value that will be removed.
         """
-        with self._get_lock():
-            self._set_state(dt.remove(self._get_state(), self.absolute_path(path), v))
-
+        self._state.remove(self.absolute_path(path), v)
         self._notify()
 
     def append(self, path, v):
@@ -211,9 +274,7 @@ class Cursor:
                 at this path must be a list.
         - v: The value that will be appended.
         """
-        with self._get_lock():
-            self._set_state(dt.append(self._get_state(), self.absolute_path(path), v))
-
+        self._state.append(self.absolute_path(path), v)
         self._notify()
 
     def contains(self, path, v):
@@ -225,7 +286,7 @@ class Cursor:
         - v: The value that will be appended.
 
         """
-        return dt.contains(self._get_state(), self.absolute_path(path), v)
+        return self._state.contains(self.absolute_path(path), v)
 
     def exists(self, path):
         """
@@ -234,7 +295,7 @@ class Cursor:
         Args:
         - path: tuple, string or int. A path relative to the base path of the Cursor.
         """
-        return dt.exists(self._get_state(), self.absolute_path(path))
+        return self._state.exists(self.absolute_path(path))
 
     def __getitem__(self, path):
         return self.get(path)
@@ -381,72 +442,6 @@ class Cursor:
 
         return self._state_dispatcher.remove_callback(self.absolute_path(path))
 
-    def get_event(self, owner, name):
-        """
-        Return an event from the event store corresponding to the supplied owner and name.
-        """
-        events = copy(self._store["events"])
-        if owner not in events:
-            events[owner] = {}
-
-        if name not in events[owner]:
-            e = self._mgr.Event()
-            with self._get_lock():
-                owner_store = events[owner]
-                owner_store[name] = e
-                events[owner] = owner_store
-                self._store["events"] = events
-            self._notify_events_changed(owner)
-            return e
-        else:
-            return events[owner][name]
-
-    def _notify_events_changed(self, owner):
-        if owner in self._store["event_change_events"]:
-            event = self._store["event_change_events"][owner]
-            if event:
-                event.set()
-
-    def remove_event(self, owner, name):
-        """
-        Remove an event from the event store corresponding to the supplied owner and name.
-        """
-        if owner in self._store["events"] and name in self._store["events"][owner]:
-            with self._get_lock():
-                events = copy(self._store["events"])
-                owner_store = events[owner]
-                del owner_store[name]
-                events[owner] = owner_store
-                self._store["events"] = events
-
-            self._notify_events_changed(owner)
-        else:
-            raise KeyError(f"Event {owner}.{name} doesn't exist")
-
-    def add_events_changed_event(self, owner):
-        """
-        Return a multiprocessing.Event object that will be set whenever the event list for a specific owner changes.
-
-        - owner: string. The owner whose event list should be observed
-        """
-        event = self._mgr.Event()
-        with self._get_lock():
-            events = copy(self._store["event_change_events"])
-            events[owner] = event
-            self._store["event_change_events"] = events
-        return event
-
-    def get_events(self, owner):
-        """
-        Return all events that are registered for a specific owner, or an empty dict if there are none.
-
-        - owner: string. The owner of the event list.
-        """
-        if owner not in self._store["events"]:
-            return {}
-        else:
-            return self._store["events"][owner]
-
 
 class StateStore:
     """
@@ -475,13 +470,12 @@ class StateStore:
     def _start_manager(self):
         store = {
             "lock": None,
-            "state": {},
             "did_update_events": [],
-            "events": {},
-            "event_change_events": {},
         }
+        state = _StateServer()
 
         _StateManager.register("get", lambda: store, DictProxy)
+        _StateManager.register("state", lambda: state, _StateProxy)
         self.manager = _StateManager(address=self.address, authkey=self.authkey.encode("ASCII"))
         server = self.manager.get_server()
         self.server_ready.set()
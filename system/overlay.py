@@ -53,8 +53,14 @@ class ObserverOverlay(ConfigurableOverlay):
 
 
 def apply_overlays(img, timestamp, src_id):
+    """
+    Return a copy of img with all overlays of the image source src_id applied, or img itself if the source has no
+    overlays.
+    """
+    if len(overlays.get(src_id, [])) == 0:
+        return img
+
     img = img.copy()
-    if src_id in overlays:
-        for overlay in overlays[src_id]:
-            img = overlay.apply(img, timestamp)
+    for overlay in overlays[src_id]:
+        img = overlay.apply(img, timestamp)
     return img
@@ -0,0 +1,333 @@
+"""
+Raw video chunk files.
+
+A raw chunk file stores frames exactly as they were acquired (any dtype, e.g. 16 bit thermal images), so that
+recording costs little more than a memory copy. Each chunk file has room for a fixed number of frames and contains:
+- A header of `header_size` bytes: `magic` followed by a JSON object with the chunk layout (dtype, shape, capacity,
+  index_offset, frames_offset) and the number of frames written (count), padded with spaces.
+- A timestamp index: one float64 timestamp per frame, starting at index_offset.
+- The frames, stored contiguously starting at frames_offset (a multiple of the page size).
+
+Chunks are written by RawChunkWriter (see video_write.VideoWriter with the "raw" backend) and can be read with
+read_raw_chunk(). Closed chunks can be converted to compressed lossless video (FFV1 in a Matroska container) or to
+HDF5 files using transcode(), either from python or from the command line:
+
+    python raw_video.py <chunk files or directories> [--format ffv1|hdf5] [--delete] [--config <config module>]
+
+Run 'python raw_video.py -h' for help about command line arguments.
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import subprocess
+import sys
+from pathlib import Path
+import imageio_ffmpeg
+import numpy as np
+import configure
+import rl_logging
+
+file_ext = "raw"
+magic = b"RLRAWCHK"
+header_size = 4096
+
+# ffmpeg input pixel formats of frames that can be transcoded to ffv1, by (dtype, channels)
+_ffv1_pix_fmts = {
+    ("uint8", 1): "gray",
+    ("uint16", 1): "gray16le",
+    ("uint8", 3): "bgr24",
+}
+
+
+def _page_align(n):
+    return -(-n // mmap.PAGESIZE) * mmap.PAGESIZE
+
+
+def _read_header(f):
+    header = f.read(header_size)
+    if header[: len(magic)] != magic:
+        raise ValueError("Not a raw chunk file")
+
+    return json.loads(header[len(magic) :].decode("ascii"))
+
+
+class RawChunkWriter:
+    """
+    Append frames to a preallocated, memory-mapped raw chunk file (see module docstring). Frames are copied into the
+    mapping, and written to disk in blocks of sync_frames frames (and when the writer is closed), at which point the
+    frame count in the header is updated as well, so that a chunk that was not closed properly is readable up to the
+    last synced block. Closing the writer truncates the file to the frames that were written.
+    """
+
+    def __init__(self, path, shape, dtype, capacity, sync_frames=64):
+        """
+        Args:
+        - path: The chunk file path.
+        - shape: The shape of each frame.
+        - dtype: The dtype of each frame.
+        - capacity: The max number of frames in the chunk.
+        - sync_frames: The number of frames written to disk at once.
+        """
+        self.path = Path(path)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.capacity = int(capacity)
+        self.sync_frames = max(int(sync_frames), 1)
+        self.frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self.layout = {
+            "dtype": self.dtype.str,
+            "shape": list(self.shape),
+            "capacity": self.capacity,
+            "index_offset": header_size,
+            "frames_offset": _page_align(header_size + 8 * self.capacity),
+        }
+        file_size = self.layout["frames_offset"] + self.capacity * self.frame_size
+
+        self.fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.posix_fallocate(self.fd, 0, file_size)
+        except (AttributeError, OSError):
+            os.ftruncate(self.fd, file_size)
+
+        self.mm = mmap.mmap(self.fd, file_size)
+        self.index = np.ndarray(
+            (self.capacity,), "<f8", self.mm, self.layout["index_offset"]
+        )
+        self.index[:] = np.nan
+        self.frames = np.ndarray(
+            (self.capacity, *self.shape),
+            self.dtype,
+            self.mm,
+            self.layout["frames_offset"],
+        )
+
+        self.count = 0
+        self.synced_count = 0
+        self._write_header()
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def append_data(self, img, timestamp=float("nan")):
+        """
+        Copy a frame and its timestamp into the chunk. Raises OSError when the chunk is full.
+        """
+        if self.count >= self.capacity:
+            raise OSError(f"Raw chunk is full: {self.path}")
+
+        np.copyto(self.frames[self.count], img)
+        self.index[self.count] = timestamp
+        self.count += 1
+
+        if self.count - self.synced_count >= self.sync_frames:
+            self.sync()
+
+    def _write_header(self):
+        header = magic + json.dumps({**self.layout, "count": self.count}).encode("ascii")
+        self.mm[:header_size] = header.ljust(header_size, b" ")
+
+    def sync(self):
+        """
+        Write the frames that were appended since the last sync, the timestamp index, and the header to disk.
+        """
+        if self.count == self.synced_count:
+            return
+
+        frames_offset = self.layout["frames_offset"]
+        start = frames_offset + self.synced_count * self.frame_size
+        start -= start % mmap.PAGESIZE
+        end = frames_offset + self.count * self.frame_size
+        self.mm.flush(start, end - start)
+
+        self._write_header()
+        self.mm.flush(0, frames_offset)
+        self.synced_count = self.count
+
+    def close(self):
+        self.sync()
+        del self.index
+        del self.frames
+        self.mm.close()
+
+        os.ftruncate(self.fd, self.layout["frames_offset"] + self.count * self.frame_size)
+        os.fsync(self.fd)
+        os.close(self.fd)
+
+
+def read_raw_chunk(path):
+    """
+    Memory-map a raw chunk file and return (frames, timestamps), where frames is an array with shape
+    (count, *shape), and timestamps is an array of count timestamps (NaN for frames written without one).
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        layout = _read_header(f)
+
+    shape = tuple(layout["shape"])
+    dtype = np.dtype(layout["dtype"])
+    frame_size = int(np.prod(shape)) * dtype.itemsize
+
+    # the count in the header might lag behind the file size if the chunk was not closed properly
+    file_count = (path.stat().st_size - layout["frames_offset"]) // frame_size
+    count = max(min(layout["count"], file_count), 0)
+
+    timestamps = np.memmap(
+        path, "<f8", "r", offset=layout["index_offset"], shape=(layout["capacity"],)
+    )[:count]
+
+    if count == 0:
+        return np.zeros((0, *shape), dtype), timestamps
+
+    frames = np.memmap(
+        path, dtype, "r", offset=layout["frames_offset"], shape=(count, *shape)
+    )
+    return frames, timestamps
+
+
+def _frame_rate(timestamps, default=30):
+    intervals = np.diff(timestamps)
+    intervals = intervals[np.isfinite(intervals) & (intervals > 0)]
+    if len(intervals) == 0:
+        return default
+
+    return 1 / np.median(intervals)
+
+
+def transcode(path, format="ffv1", out_path=None, delete=False, frame_rate=None):
+    """
+    Convert a raw chunk file to a lossless compressed file, and return the output path.
+
+    Args:
+    - path: The chunk file path.
+    - format: "ffv1" to write an FFV1 video in a Matroska (.mkv) file, or "hdf5" to write an HDF5 (.h5) file with a
+              gzip compressed "frames" dataset and a "timestamps" dataset (requires the h5py package). FFV1 supports
+              uint8 or uint16 grayscale, and uint8 BGR frames.
+    - out_path: The output file path. When None, the chunk path with the format suffix is used.
+    - delete: Whether to delete the chunk file once it was transcoded successfully.
+    - frame_rate: The video frame rate (ffv1 only). When None, it's estimated from the chunk timestamps.
+    """
+    path = Path(path)
+    frames, timestamps = read_raw_chunk(path)
+
+    if format == "ffv1":
+        out_path = path.with_suffix(".mkv") if out_path is None else Path(out_path)
+        channels = frames.shape[3] if frames.ndim == 4 else 1
+        pix_fmt = _ffv1_pix_fmts.get((frames.dtype.name, channels))
+        if pix_fmt is None:
+            raise ValueError(
+                f"Can't transcode frames with dtype {frames.dtype} and shape {frames.shape[1:]} to ffv1"
+            )
+
+        if frame_rate is None:
+            frame_rate = _frame_rate(timestamps)
+
+        h, w = frames.shape[1:3]
+        cmd = [
+            imageio_ffmpeg.get_ffmpeg_exe(),
+            "-y",
+            "-f", "rawvideo",
+            "-vcodec", "rawvideo",
+            "-s", f"{w}x{h}",
+            "-pix_fmt", pix_fmt,
+            "-r", f"{frame_rate:.02f}",
+            "-i", "-",
+            "-an",
+            "-vcodec", "ffv1",
+            "-level", "3",
+            "-g", "1",
+            "-v", "warning",
+            str(out_path),
+        ]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        block = 64
+        try:
+            for i in range(0, len(frames), block):
+                proc.stdin.write(np.ascontiguousarray(frames[i : i + block]).data)
+        finally:
+            proc.stdin.close()
+
+        if proc.wait() != 0:
+            raise OSError(f"ffmpeg exited with code {proc.returncode} while transcoding {path}")
+
+    elif format == "hdf5":
+        import h5py
+
+        out_path = path.with_suffix(".h5") if out_path is None else Path(out_path)
+        with h5py.File(out_path, "w") as f:
+            dset = f.create_dataset(
+                "frames",
+                shape=frames.shape,
+                dtype=frames.dtype,
+                chunks=(1, *frames.shape[1:]),
+                compression="gzip",
+                shuffle=True,
+            )
+            block = 64
+            for i in range(0, len(frames), block):
+                dset[i : i + block] = frames[i : i + block]
+
+            f.create_dataset("timestamps", data=timestamps)
+    else:
+        raise ValueError(f"Unknown transcode format: {format}")
+
+    if delete:
+        del frames, timestamps
+        path.unlink()
+
+    return out_path
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Transcode raw video chunk files to lossless compressed files"
+    )
+    arg_parser.add_argument(
+        "paths", nargs="+", help="Chunk files, or directories containing chunk files"
+    )
+    arg_parser.add_argument(
+        "--format", default="ffv1", choices=("ffv1", "hdf5"), help="The output format"
+    )
+    arg_parser.add_argument(
+        "--delete", action="store_true", help="Delete each chunk file once it was transcoded"
+    )
+    arg_parser.add_argument(
+        "--config",
+        default="config",
+        help="The name of a config module residing in the ./config/ directory",
+    )
+    args = arg_parser.parse_args()
+
+    config = configure.load_config(args.config)
+
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setFormatter(rl_logging.formatter)
+    log = rl_logging.init(
+        log_handlers=(stderr_handler,),
+        extra_loggers=(),
+        extra_log_level=logging.WARNING,
+        default_level=logging.getLevelName(config.log_level),
+    )
+
+    paths = []
+    for p in map(Path, args.paths):
+        if p.is_dir():
+            paths += sorted(p.glob(f"*.{file_ext}"))
+        else:
+            paths.append(p)
+
+    try:
+        for p in paths:
+            try:
+                out_path = transcode(p, args.format, delete=args.delete)
+                log.info(f"{p} -> {out_path}")
+            except Exception:
+                log.exception(f"Error while transcoding {p}:")
+    finally:
+        rl_logging.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Recording gated by an image observer signal.
+
+A RecordingGate listens to an ImageObserver and records video from a set of image sources only while the observer
+output indicates activity, e.g. motion (see image_observers/motion.py) or detection confidence, instead of recording
+continuously.
+
+Each observer output is converted to a number by the signal function. A clip starts when the signal reaches
+on_threshold and stays there for start_delay seconds. It continues while the signal stays at or above off_threshold
+(which can be lower than on_threshold to avoid flickering clips), and for post_roll seconds after the signal drops
+below it. Clips are at least min_clip_length seconds long. When the video writers keep pre-roll frames (see the
+video_record preroll config and video_write.VideoWriter), each clip begins preroll seconds before its trigger_time.
+
+Each clip is a separate recording of each image source. Clips are listed in a csv clip index file, one row per clip,
+with the columns in `index_columns` followed by a video_<src_id> column with the video path of each source. Times
+are in seconds since epoch, and can be read using analysis.read_timeseries_csv(path, time_col="trigger_time"):
+- clip: The clip number, starting from 0.
+- trigger_time: The timestamp of the first image whose signal reached on_threshold.
+- release_time: The timestamp of the first image whose signal dropped below off_threshold for the last time.
+- stop_time: The time recording stopped.
+- peak_signal: The max signal value during the clip.
+
+The gate status is published to the state store under ("video", "record", "gate").
+"""
+import csv
+import math
+import threading
+import time
+
+import numpy as np
+
+from rl_logging import get_main_logger
+
+index_columns = ("clip", "trigger_time", "release_time", "stop_time", "peak_signal")
+
+
+def default_signal(output):
+    """
+    Return the first element of an observer output, e.g. the motion value of a MotionObserver.
+    """
+    return np.ravel(output)[0]
+
+
+class RecordingGate:
+    """
+    Start and stop recording according to an image observer signal (see module docstring).
+    """
+
+    # How often to check whether the post roll of a clip is over when there are no new observer outputs, in seconds
+    check_interval = 0.1
+
+    def __init__(
+        self,
+        observer,
+        writers: dict,
+        index_path,
+        signal=None,
+        on_threshold=0.5,
+        off_threshold=None,
+        start_delay=0,
+        post_roll=2,
+        min_clip_length=2,
+        state=None,
+    ):
+        """
+        Args:
+        - observer: The video_stream.ImageObserver providing the signal. It should be observing while the gate is
+                    running.
+        - writers: A dict of image source ids to the video_write.VideoWriter of each source.
+        - index_path: The clip index csv file path.
+        - signal: A function that receives an observer output and returns a number. Outputs with a NaN signal (e.g.
+                  no detection) are considered inactive. When None, default_signal() is used.
+        - on_threshold: The min signal value that starts a clip.
+        - off_threshold: The min signal value that keeps a clip going. When None, on_threshold is used.
+        - start_delay: The time in seconds the signal must stay at or above on_threshold before a clip starts.
+        - post_roll: The time in seconds recording continues after the signal drops below off_threshold.
+        - min_clip_length: The min duration of each clip in seconds.
+        - state: A managed_state.Cursor to the root of the state store, used for publishing the gate status and
+                 reading video paths, or None.
+        """
+        if off_threshold is None:
+            off_threshold = on_threshold
+        if off_threshold > on_threshold:
+            raise ValueError("off_threshold can't be larger than on_threshold")
+
+        self.observer = observer
+        self.writers = writers
+        self.index_path = index_path
+        self.signal = signal or default_signal
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.start_delay = start_delay
+        self.post_roll = post_roll
+        self.min_clip_length = min_clip_length
+        self.state = state
+        self.log = get_main_logger()
+
+        self.recording = False
+        self.clip_count = 0
+        self.above_since = None  # first timestamp of the current run of outputs at or above on_threshold
+        self.trigger_time = None
+        self.release_time = None
+        self.peak_signal = None
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._finished_clips = []  # index rows waiting to be written by the gate thread
+        self._rows_pending = False
+        self._publish_pending = False
+        self._prev_video_paths = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._remove_listener = None
+
+    def start(self):
+        self.index_file = open(self.index_path, "w", newline="")
+        self.index_writer = csv.writer(self.index_file)
+        self.index_writer.writerow(
+            index_columns + tuple(f"video_{src_id}" for src_id in self.writers)
+        )
+        self.index_file.flush()
+
+        self._publish()
+        self._thread.start()
+        self._remove_listener = self.observer.add_listener(self._on_output)
+        self.log.info(f"Started gated recording. Writing clip index to {self.index_path}")
+
+    def stop(self):
+        """
+        Stop the gate. A clip that's being recorded is stopped immediately.
+        """
+        if self._remove_listener is not None:
+            self._remove_listener()
+            self._remove_listener = None
+
+        with self._lock:
+            if self.recording:
+                self._stop_clip(time.time())
+
+        self._stop_event.set()
+        self._thread.join()
+        self.index_file.close()
+        self.log.info(f"Stopped gated recording after {self.clip_count} clips.")
+
+    def _on_output(self, output, timestamp):
+        value = float(self.signal(output))
+        if math.isnan(value):
+            value = -math.inf
+
+        with self._lock:
+            self._update(value, timestamp)
+
+    def _update(self, value, t):
+        if not self.recording:
+            if value < self.on_threshold:
+                self.above_since = None
+                return
+
+            if self.above_since is None:
+                self.above_since = t
+
+            # a new clip waits until the video paths of the previous one are read (see _run())
+            if t - self.above_since >= self.start_delay and not self._rows_pending:
+                self._start_clip(value)
+            return
+
+        self.peak_signal = max(self.peak_signal, value)
+        if value >= self.off_threshold:
+            self.release_time = None
+        elif self.release_time is None:
+            self.release_time = t
+
+        self._check_stop(t)
+
+    def _check_stop(self, t):
+        if (
+            self.recording
+            and self.release_time is not None
+            and t - self.release_time >= self.post_roll
+            and t - self.trigger_time >= self.min_clip_length
+        ):
+            self._stop_clip(t)
+
+    def _start_clip(self, value):
+        for writer in self.writers.values():
+            if writer.preroll:
+                # pre-roll frames are kept from before the image that triggered the clip
+                writer.start_observing(self.above_since)
+            else:
+                writer.start_observing()
+
+        self.recording = True
+        self.trigger_time = self.above_since
+        self.release_time = None
+        self.peak_signal = value
+        self.above_since = None
+        self._publish_pending = True
+        self.log.info(f"Starting clip {self.clip_count}.")
+
+    def _stop_clip(self, t):
+        for writer in self.writers.values():
+            writer.stop_observing()
+
+        self.recording = False
+        self._finished_clips.append(
+            [
+                self.clip_count,
+                self.trigger_time,
+                self.release_time if self.release_time is not None else t,
+                time.time(),
+                self.peak_signal,
+            ]
+        )
+        self.clip_count += 1
+        self._rows_pending = True
+        self._publish_pending = True
+
+    def _run(self):
+        while True:
+            stopping = self._stop_event.wait(self.check_interval)
+
+            with self._lock:
+                self._check_stop(time.time())
+                rows = self._finished_clips
+                self._finished_clips = []
+                publish = self._publish_pending
+                self._publish_pending = False
+
+            # slow state store operations run on this thread, outside of the lock
+            for row in rows:
+                self._write_index_row(row)
+
+            if len(rows) > 0:
+                with self._lock:
+                    self._rows_pending = len(self._finished_clips) > 0
+
+            if publish or stopping:
+                self._publish()
+
+            if stopping:
+                break
+
+    def _write_index_row(self, row):
+        for src_id in self.writers:
+            path = None
+            if self.state is not None:
+                path = self.state.get(("video", "image_sources", src_id, "video_path"), None)
+
+            if path is not None and path == self._prev_video_paths.get(src_id):
+                # the writer didn't start a new video file for this clip
+                path = None
+            else:
+                self._prev_video_paths[src_id] = path
+
+            row.append(path)
+
+        try:
+            self.index_writer.writerow(row)
+            self.index_file.flush()
+        except Exception:
+            self.log.exception("Error while writing to the clip index:")
+
+    def _publish(self):
+        if self.state is None:
+            return
+
+        try:
+            self.state[("video", "record", "gate")] = {
+                "running": not self._stop_event.is_set(),
+                "recording": self.recording,
+                "clip_count": self.clip_count,
+                "src_ids": list(self.writers.keys()),
+                "index_path": self.index_path,
+            }
+        except Exception:
+            self.log.exception("Exception while publishing gate state:")
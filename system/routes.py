@@ -16,6 +16,7 @@ import experiment
 import video_system
 import undistort
 import image_utils
+import http_streaming
 import rl_logging
 import version
 
@@ -84,19 +85,41 @@ def add_routes(app, restart_hook):
 
         return (width, height, undistort_mapping)
 
-    def encode_image_for_response(img, width, height, undistort_mapping):
+    def make_image_encoder():
+        """
+        Return a function with signature (img, shape) that encodes images using the encoder selected in
+        config.http_streaming.
+        """
+        stream_config = get_config().http_streaming
+        if stream_config.get("encoder", "pillow") == "opencv":
+            return image_utils.CVImageEncoder(
+                stream_config["opencv_encoding"], stream_config["opencv_encode_params"]
+            ).encode
+
+        def encode(img, shape):
+            return image_utils.encode_image(
+                img,
+                encoding=stream_config["encoding"],
+                encode_params=stream_config["encode_params"],
+                shape=shape,
+            )
+
+        return encode
+
+    def encode_image_for_response(img, width, height, undistort_mapping, encode=None):
         if undistort_mapping is not None:
             img = undistort.undistort_image(img, undistort_mapping)
 
-        return image_utils.encode_image(
-            img,
-            encoding=get_config().http_streaming["encoding"],
-            encode_params=get_config().http_streaming["encode_params"],
-            shape=(width, height),
-        )
+        if encode is None:
+            encode = make_image_encoder()
+
+        return encode(img, (width, height))
 
     @app.route("/image_sources/<src_id>/get_image")
     def route_image_sources_get_image(src_id):
+        if not image_utils.is_image_shape(video_system.image_sources[src_id].image_shape):
+            return flask.Response(f"Images of {src_id} can't be encoded", status=400)
+
         img, _ = video_system.image_sources[src_id].get_image(scale_to_8bit=True)
         enc_img = encode_image_for_response(img, *parse_image_request(src_id))
         return flask.Response(enc_img, mimetype="image/jpeg")
@@ -107,6 +130,8 @@ def add_routes(app, restart_hook):
             return flask.Response("Unknown image source id", status=400)
 
         img_src = video_system.image_sources[src_id]
+        if not image_utils.is_image_shape(img_src.image_shape):
+            return flask.Response(f"Images of {src_id} can't be streamed", status=400)
 
         frame_rate = int(
             flask.request.args.get(
@@ -115,28 +140,35 @@ def add_routes(app, restart_hook):
         )
 
         enc_args = parse_image_request(src_id)
+        width, height, undistort_mapping = enc_args
+
+        encode = make_image_encoder()
+
+        def render(img, timestamp):
+            img = overlay.apply_overlays(img, timestamp, src_id)
+            enc_img = encode_image_for_response(img, *enc_args, encode)
+            return b"Content-Type: image\r\n\r\n" + enc_img + b"--frame\r\n"
+
+        # Clients requesting the same stream share a single broadcaster that encodes each frame once
+        stream_key = (
+            id(img_src),
+            width,
+            height,
+            undistort_mapping is not None,
+            frame_rate,
+            tuple(id(o) for o in overlay.overlays.get(src_id, [])),
+            json.dumps(get_config().http_streaming, sort_keys=True),
+        )
 
         def flask_gen():
             log.debug(f"Starting new stream over http: {src_id}")
-            gen = img_src.stream_gen(frame_rate, scale_to_8bit=True)
-
             try:
-                while True:
-                    try:
-                        img, timestamp = next(gen)
-                        img = overlay.apply_overlays(img, timestamp, src_id)
-                        enc_img = encode_image_for_response(img, *enc_args)
-                        yield (
-                            b"Content-Type: image\r\n\r\n"
-                            + bytearray(enc_img)
-                            + b"--frame\r\n"
-                            # + b"\r\n\r\n"
-                        )
-                    except StopIteration:
-                        break
+                yield from http_streaming.stream(
+                    stream_key,
+                    lambda: http_streaming.StreamBroadcaster(img_src, frame_rate, render),
+                )
             finally:
                 log.debug("Stopping http stream")
-                pass
 
         return flask.Response(
             flask_gen(),
@@ -145,6 +177,7 @@ def add_routes(app, restart_hook):
 
     @app.route("/stop_stream/<src_id>")
     def route_stop_stream(src_id):
+        # Only stops streams of ImageSource.stream_gen(). Shared http streams end when their client disconnects.
         if src_id in video_system.image_sources:
             img_src = video_system.image_sources[src_id]
             img_src.stop_streaming()
@@ -156,6 +189,21 @@ def add_routes(app, restart_hook):
         video_system.capture_images([src_id], filename_prefix)
         return flask.Response("ok")
 
+    @app.route("/capture_burst/<src_id>/<int:count>")
+    @app.route("/capture_burst/<src_id>/<int:count>/<filename_prefix>")
+    def route_capture_burst(src_id, count, filename_prefix=""):
+        future = video_system.capture_burst(count, [src_id], filename_prefix)
+        return flask.Response(future.capture_id)
+
+    @app.route("/gated_record/start/<obs_id>")
+    def route_start_gated_record(obs_id):
+        return flask.Response(str(video_system.start_gated_record(obs_id)))
+
+    @app.route("/gated_record/stop")
+    def route_stop_gated_record():
+        video_system.stop_gated_record()
+        return flask.Response("ok")
+
     @app.route("/run_action/<label>")
     def route_run_action(label):
         try:
@@ -393,6 +441,14 @@ def add_routes(app, restart_hook):
             log.exception("Exception while getting image classes params:")
             flask.abort(500, e)
 
+    @app.route("/video/latency")
+    def route_video_latency():
+        try:
+            return flask.jsonify(video_system.get_latency_stats())
+        except Exception as e:
+            log.exception("Exception while getting video latency stats:")
+            flask.abort(500, e)
+
     @app.route("/video/shutdown")
     def route_video_shutdown():
         try:
@@ -404,7 +460,10 @@ def add_routes(app, restart_hook):
 
     @app.route("/video_record/select_source/<src_id>")
     def route_select_source(src_id):
-        video_system.select_source(src_id)
+        try:
+            video_system.select_source(src_id)
+        except ValueError as e:
+            return flask.Response(str(e), status=400)
         return flask.Response("ok")
 
     @app.route("/video_record/unselect_source/<src_id>")
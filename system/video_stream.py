@@ -4,24 +4,663 @@ Author: Tal Eisenberg, 2021
 
 The following classes use shared memory buffers to generate and process image data in an asynchronous manner using multiple os processes.
 
+- SharedArrays: numpy arrays stored in a named shared memory segment that any process can attach to.
+- FrameBuffer: a shared memory ring buffer holding the most recent images of an ImageSource.
+- ObserverOutput: a shared memory buffer holding the latest output of an ImageObserver.
+- LatencyStats: shared memory latency histograms and counters of the stages of an ImageSource or ImageObserver.
 - ImageSource: a multiprocessing.Process that writes image data to a shared memory buffer.
 - ImageObserver: a multiprocessing.Process that can receive a stream of images from ImageSource objects.
+
+The descriptors of the shared memory buffers are published in the state store under
+("video", "image_sources", <src_id>, "shm") and ("video", "image_observers", <obs_id>, "shm"). Processes
+that were not started by the system (e.g. a Jupyter notebook or an external analysis process) can use them
+to access live images without copying:
+
+```python
+frame_buf = FrameBuffer.attach(state[("video", "image_sources", "top", "shm")])
+img, timestamp, seq = frame_buf.read_latest()
+...
+frame_buf.close()
+```
 """
+import os
+import atexit
+import select
+import tempfile
+import glob
+import logging
 import uuid
+import collections
+from types import SimpleNamespace
 import numpy as np
 import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import wait as wait_connections
 import cv2
 import time
+import queue
 import threading
 import rl_logging
 import managed_state
-from image_utils import convert_to_8bit
+from image_utils import Converter8bit, is_image_shape
 
 
 class AcquireException(Exception):
     pass
 
 
+def _open_shared_memory(name, track=True):
+    """
+    Attach to an existing shared memory segment. When `track` is False the segment is not registered
+    with the resource tracker of this process, which would otherwise unlink it when the process exits.
+    """
+    if track:
+        return shared_memory.SharedMemory(name=name)
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedArrays:
+    """
+    A set of numpy arrays stored in a single named shared memory segment (multiprocessing.shared_memory).
+
+    Any process can access the arrays without copying by attaching to the segment using the descriptor returned
+    by shm_descriptor() (see attach()). Pickling the object transfers only the descriptor, so it can be passed to
+    child processes regardless of the process start method.
+
+    The process that created the segment owns it and should call unlink() once it's no longer used. Other processes
+    should call close() when they're done.
+    """
+
+    # Byte alignment of each array in the segment
+    alignment = 64
+
+    def _create(self, fields):
+        """
+        Create a new shared memory segment containing the arrays described by `fields`, a list of (key, shape, dtype)
+        tuples, and make numpy views of them available as attributes named after each key.
+        """
+        self._fields = []
+        size = 0
+        for key, shape, dtype in fields:
+            shape = [int(d) for d in np.atleast_1d(shape)]
+            dtype = np.dtype(dtype)
+            size = -(-size // self.alignment) * self.alignment
+            self._fields.append((key, shape, dtype.str, size))
+            size += int(np.prod(shape)) * dtype.itemsize
+
+        # new segments are zero-filled
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._owner = True
+        self._make_views()
+
+    def _make_views(self):
+        for key, shape, dtype, offset in self._fields:
+            setattr(
+                self,
+                key,
+                np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=offset),
+            )
+
+    def shm_descriptor(self):
+        """
+        Return a json serializable dict describing the shared memory segment and the layout of the arrays it contains.
+        """
+        return {
+            "name": self._shm.name,
+            "fields": [list(f) for f in self._fields],
+            **self._descriptor_attrs(),
+        }
+
+    def _descriptor_attrs(self):
+        """
+        Return additional attributes that are required for recreating the object from its descriptor.
+        """
+        return {}
+
+    @classmethod
+    def attach(cls, descriptor, track=False):
+        """
+        Return a new object attached to the shared memory segment described by `descriptor` (see shm_descriptor()).
+
+        Args:
+        - descriptor: A dict returned by shm_descriptor(), for example from the state store.
+        - track: Whether to register the segment with the resource tracker of this process. Should be False unless this
+                 process shares the resource tracker of the process that owns the segment.
+        """
+        obj = cls.__new__(cls)
+        obj._set_descriptor(descriptor, track)
+        return obj
+
+    def _set_descriptor(self, descriptor, track):
+        for k, v in descriptor.items():
+            if k not in ("name", "fields"):
+                setattr(self, k, tuple(v) if isinstance(v, list) else v)
+
+        self._fields = [tuple(f) for f in descriptor["fields"]]
+        self._shm = _open_shared_memory(descriptor["name"], track)
+        self._owner = False
+        self._make_views()
+
+    def __getstate__(self):
+        return self.shm_descriptor()
+
+    def __setstate__(self, descriptor):
+        # Child processes share the resource tracker of the owner process
+        self._set_descriptor(descriptor, track=True)
+
+    def close(self):
+        """
+        Release the numpy views and close this process' access to the shared memory segment.
+        """
+        for key, _, _, _ in self._fields:
+            if key in self.__dict__:
+                delattr(self, key)
+
+        try:
+            self._shm.close()
+        except BufferError:
+            # Other numpy views of the segment are still referenced. The mapping is released once they're garbage
+            # collected.
+            pass
+
+    def unlink(self):
+        """
+        Close and destroy the shared memory segment. Should only be called by the owner process once all other
+        processes have stopped using it.
+        """
+        self.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class FrameBuffer(SharedArrays):
+    """
+    A ring buffer of images and their timestamps stored in shared memory (see SharedArrays).
+
+    The buffer has a single writer (the ImageSource process) and any number of readers on other processes.
+    Each image written to the buffer is assigned a sequence number. Sequence numbers start at 0 and increase by one
+    with every write. The image with sequence number `seq` is stored in slot `seq % length` and remains available
+    until `length` additional images are written. Readers can use sequence numbers to consume images in order and to
+    detect images that were overwritten before they were read.
+
+    Access is synchronized without locks using a seqlock: each slot has a generation counter which the writer sets to
+    2 * seq + 1 before copying image `seq` into the slot and to 2 * seq + 2 once the copy is complete. A reader
+    holding a view of image `seq` can check at any time whether the slot still holds a complete copy of that image
+    by comparing the counter with 2 * seq + 2 (see is_available()). Readers never block the writer, and the writer
+    never waits for slow readers.
+
+    Each slot can also hold a float64 metadata array of shape meta_shape that is written and read along with the
+    image, such as the per-camera timestamps of a frame set (see read_meta()).
+
+    Readers can optionally register a read cursor (see add_reader()) holding the oldest sequence number they still
+    need. A writer that must not drop images (e.g. a source replaying a recording as fast as possible) can then
+    use can_write() to wait until writing another image won't overwrite an image that an active reader needs.
+    """
+
+    # Max number of attempts read_latest() makes when the latest image is overwritten while being read.
+    max_read_attempts = 10
+
+    # Max number of read cursors (see add_reader())
+    max_readers = 32
+
+    def __init__(self, image_shape, dtype, length, meta_shape=None):
+        """
+        Args:
+        - image_shape: The shape of each image in the buffer.
+        - dtype: The pixel data type. Either "uint8" or "uint16".
+        - length: The number of image slots in the buffer.
+        - meta_shape: The shape of the metadata array of each slot, or None for no metadata.
+        """
+        if dtype not in ("uint8", "uint16"):
+            raise ValueError(
+                f"Unsupported buf_dtype: {dtype}. Only uint8 or uint16 are currently supported."
+            )
+
+        if length < 1:
+            raise ValueError(f"Invalid buffer length: {length}")
+
+        self.image_shape = tuple(image_shape)
+        self.dtype = dtype
+        self.length = length
+        self.meta_shape = None if meta_shape is None else tuple(meta_shape)
+
+        meta_fields = []
+        if self.meta_shape is not None:
+            meta_fields.append(("_meta", (length, *self.meta_shape), "float64"))
+
+        self._create(
+            [
+                # The total number of images written to the buffer.
+                ("_write_count", 1, "int64"),
+                # Seqlock generation counter of each slot (see class docstring). 0 means the slot was never written.
+                ("_gens", length, "int64"),
+                ("_timestamps", length, "float64"),
+                # All image slots with shape (length, *image_shape).
+                ("frames", (length, *self.image_shape), dtype),
+                # The number of registered readers and the read cursor of each one. -1 means inactive.
+                ("_reader_count", 1, "int64"),
+                ("_read_seqs", self.max_readers, "int64"),
+            ]
+            + meta_fields
+        )
+        self._read_seqs[:] = -1
+
+    def _descriptor_attrs(self):
+        return {
+            "image_shape": list(self.image_shape),
+            "dtype": self.dtype,
+            "length": self.length,
+            "meta_shape": None if self.meta_shape is None else list(self.meta_shape),
+        }
+
+    @property
+    def shape(self):
+        return self.frames.shape
+
+    def write(self, img, timestamp, meta=None):
+        """
+        Copy an image and its metadata (when the buffer has a meta_shape) into the next slot of the buffer and return
+        its sequence number. Should only be called from the process that owns the buffer.
+        """
+        seq = int(self._write_count[0])
+        slot = seq % self.length
+
+        self._gens[slot] = 2 * seq + 1
+        np.copyto(self.frames[slot], img)
+        self._timestamps[slot] = timestamp
+        if meta is not None:
+            self._meta[slot] = meta
+        self._gens[slot] = 2 * seq + 2
+        self._write_count[0] = seq + 1
+        return seq
+
+    def last_seq(self):
+        """
+        Return the sequence number of the most recently written image, or -1 if the buffer is empty.
+        """
+        return int(self._write_count[0]) - 1
+
+    def first_seq(self):
+        """
+        Return the sequence number of the oldest image that may still be read from the buffer.
+        """
+        return max(int(self._write_count[0]) - self.length, 0)
+
+    def is_available(self, seq):
+        """
+        Return True if the slot of image `seq` currently holds a complete copy of that image. A reader that
+        used a view returned by read() can call this afterwards to verify that the image was not overwritten
+        while it was in use.
+        """
+        return seq >= 0 and self._gens[seq % self.length] == 2 * seq + 2
+
+    def add_reader(self):
+        """
+        Register a read cursor and return its id. Should only be called from the process that created the buffer,
+        before any other process uses the cursor.
+        """
+        reader_id = int(self._reader_count[0])
+        if reader_id >= self.max_readers:
+            raise ValueError(f"Can't register more than {self.max_readers} readers")
+
+        self._reader_count[0] = reader_id + 1
+        return reader_id
+
+    def set_read_seq(self, reader_id, seq):
+        """
+        Set the read cursor of a reader to the oldest sequence number it still needs, or to -1 when the reader is
+        inactive. Inactive readers are ignored by can_write().
+        """
+        self._read_seqs[reader_id] = seq
+
+    def can_write(self):
+        """
+        Return True if writing the next image won't overwrite an image that an active reader still needs.
+        """
+        read_seqs = self._read_seqs[: int(self._reader_count[0])]
+        read_seqs = read_seqs[read_seqs >= 0]
+        if len(read_seqs) == 0:
+            return True
+
+        return int(self._write_count[0]) - self.length < read_seqs.min()
+
+    def read(self, seq, copy=False):
+        """
+        Return img, timestamp for the image with sequence number `seq`. Return None, None if the image is not available
+        (not written yet, being overwritten or already overwritten).
+
+        Args:
+        - seq: The image sequence number.
+        - copy: When False `img` is a numpy array view of the buffer slot (zero-copy). The view is only valid as long
+                as is_available(seq) returns True. When True `img` is a copy of the image which is verified to be
+                consistent.
+        """
+        if not self.is_available(seq):
+            return None, None
+
+        slot = seq % self.length
+        img = self.frames[slot]
+        if copy:
+            img = img.copy()
+        timestamp = self._timestamps[slot]
+
+        if not self.is_available(seq):
+            return None, None
+
+        return img, timestamp
+
+    def read_meta(self, seq):
+        """
+        Return a copy of the metadata array of the image with sequence number `seq`, or None if the image is not
+        available.
+        """
+        if not self.is_available(seq):
+            return None
+
+        meta = self._meta[seq % self.length].copy()
+        if not self.is_available(seq):
+            return None
+
+        return meta
+
+    def read_many(self, seq, count, copy=False):
+        """
+        Return imgs, timestamps for `count` consecutive images starting with sequence number `seq`, where `imgs` is an
+        array with shape (count, *image_shape) and `timestamps` is an array of `count` timestamps. Return None, None if
+        any of the images is not available.
+
+        When copy is False and the images are stored in consecutive slots (i.e. they don't wrap around the end of the
+        buffer) `imgs` is a view of the buffer (zero-copy), otherwise it's a copy. Since the oldest image is always
+        overwritten first, the whole view is valid as long as is_available(seq) returns True.
+        """
+        if count > self.length:
+            raise ValueError(f"Can't read {count} images from a buffer of length {self.length}")
+
+        last = seq + count - 1
+        if not self.is_available(seq) or not self.is_available(last):
+            return None, None
+
+        slot = seq % self.length
+        if slot + count <= self.length:
+            imgs = self.frames[slot : slot + count]
+            if copy:
+                imgs = imgs.copy()
+            timestamps = self._timestamps[slot : slot + count].copy()
+        else:
+            slots = np.arange(seq, seq + count) % self.length
+            imgs = self.frames[slots]
+            timestamps = self._timestamps[slots]
+
+        if not self.is_available(seq):
+            return None, None
+
+        return imgs, timestamps
+
+    def read_latest(self, copy=False):
+        """
+        Return img, timestamp, seq of the most recently written image (see read()). If the image is overwritten while
+        it's being read, the read is retried with the new latest image. Returns None, None, seq if the buffer is
+        empty or no consistent image could be read.
+        """
+        for _ in range(self.max_read_attempts):
+            seq = self.last_seq()
+            if seq < 0:
+                break
+
+            img, timestamp = self.read(seq, copy)
+            if img is not None:
+                return img, timestamp, seq
+
+        return None, None, self.last_seq()
+
+
+class ObserverOutput(SharedArrays):
+    """
+    The output buffer of an ImageObserver and the timestamp of the image it was computed from, stored in shared
+    memory (see SharedArrays).
+
+    The buffer also keeps a history ring of the last `history_len` outputs and their timestamps, which can be queried
+    from any process using get_last() and get_between(). Like FrameBuffer slots, each history slot has a seqlock
+    generation counter, so that readers can skip entries that were overwritten while they were being read.
+    """
+
+    def __init__(self, shape, dtype, initializer=None, history_len=0):
+        """
+        Args:
+        - shape: The shape of the output array.
+        - dtype: The dtype of the output array.
+        - initializer: An optional sequence of initial output values.
+        - history_len: The number of past outputs stored in the history ring.
+        """
+        shape = tuple(np.atleast_1d(shape))
+        self.history_len = history_len
+
+        self._create(
+            [
+                ("output", shape, dtype),
+                ("timestamp", 1, "float64"),
+                ("_history", (history_len, *shape), dtype),
+                ("_history_timestamps", history_len, "float64"),
+                # Seqlock generation counter of each history slot: 2 * i + 1 while entry i is written to it, and
+                # 2 * i + 2 once it's complete.
+                ("_history_gens", history_len, "int64"),
+                # The total number of outputs recorded so far
+                ("_output_count", 1, "int64"),
+            ]
+        )
+        if initializer is not None:
+            self.output.flat[:] = initializer
+
+    def _descriptor_attrs(self):
+        return {"history_len": self.history_len}
+
+    def output_count(self):
+        """
+        Return the total number of outputs recorded so far.
+        """
+        return int(self._output_count[0])
+
+    def record(self):
+        """
+        Append the current output and timestamp to the history ring. Should only be called from the observer process.
+        """
+        count = int(self._output_count[0])
+        if self.history_len > 0:
+            slot = count % self.history_len
+            self._history_gens[slot] = 2 * count + 1
+            self._history[slot] = self.output
+            self._history_timestamps[slot] = self.timestamp[0]
+            self._history_gens[slot] = 2 * count + 2
+        self._output_count[0] = count + 1
+
+    def _read_history(self, start, end, copy):
+        """
+        Return outputs, timestamps, start for history entries with indices in [start, end), where `start` is increased
+        to skip entries that were overwritten before or while reading.
+        """
+        n = end - start
+        if n <= 0:
+            return self._history[:0], self._history_timestamps[:0], start
+
+        slot = start % self.history_len
+
+        if slot + n <= self.history_len:
+            outputs = self._history[slot : slot + n]
+            timestamps = self._history_timestamps[slot : slot + n]
+            if copy:
+                outputs = outputs.copy()
+                timestamps = timestamps.copy()
+        else:
+            idx = np.arange(start, end) % self.history_len
+            outputs = self._history[idx]
+            timestamps = self._history_timestamps[idx]
+
+        # entries are overwritten oldest first, so any entries that are no longer complete come first
+        indices = np.arange(start, end)
+        invalid = np.flatnonzero(
+            self._history_gens[indices % self.history_len] != 2 * indices + 2
+        )
+        if len(invalid) > 0:
+            trim = int(invalid[-1]) + 1
+            outputs = outputs[trim:]
+            timestamps = timestamps[trim:]
+            start += trim
+
+        return outputs, timestamps, start
+
+    def get_last(self, n, copy=False):
+        """
+        Return outputs, timestamps of the last `n` recorded outputs (or fewer if not enough outputs were recorded),
+        oldest first. `outputs` has shape (n, *output_shape) and `timestamps` has shape (n,).
+
+        When copy is False the arrays are views of the history ring unless the range wraps around its end. Views
+        are valid until history_len more outputs are recorded.
+        """
+        count = int(self._output_count[0])
+        n = max(min(n, count, self.history_len), 0)
+        outputs, timestamps, _ = self._read_history(count - n, count, copy)
+        return outputs, timestamps
+
+    def get_between(self, t0, t1, copy=False):
+        """
+        Return outputs, timestamps (see get_last()) of all recorded outputs with timestamps between t0 and t1 (inclusive),
+        where t0 and t1 are in seconds since epoch.
+        """
+        count = int(self._output_count[0])
+        start = count - min(count, self.history_len)
+        _, timestamps, start = self._read_history(start, count, copy=False)
+
+        i0 = int(np.searchsorted(timestamps, t0, side="left"))
+        i1 = int(np.searchsorted(timestamps, t1, side="right"))
+        outputs, timestamps, _ = self._read_history(start + i0, start + i1, copy)
+        return outputs, timestamps
+
+
+class LatencyStats(SharedArrays):
+    """
+    Latency histograms of the stages of an image pipeline and event counters (e.g. dropped frames), stored in shared
+    memory (see SharedArrays) so that any process can read them while the pipeline is running.
+
+    Each stage has a histogram with logarithmic bins between 1us and 10s (16 bins per decade, plus underflow and
+    overflow bins), along with the number of samples, their sum and their maximum. Each stage and counter should be
+    updated by a single thread.
+    """
+
+    bin_edges = np.logspace(-6, 1, 7 * 16 + 1)
+
+    def __init__(self, stage_names, counter_names=()):
+        """
+        Args:
+        - stage_names: A sequence of stage names. Latencies are recorded using record(stage_name, seconds).
+        - counter_names: A sequence of counter names (see set_counter() and add_count()).
+        """
+        self.stage_names = tuple(stage_names)
+        self.counter_names = tuple(counter_names)
+
+        n_stages = len(self.stage_names)
+        self._create(
+            [
+                ("_hist", (n_stages, len(self.bin_edges) + 1), "int64"),
+                ("_count", n_stages, "int64"),
+                ("_sum", n_stages, "float64"),
+                ("_max", n_stages, "float64"),
+                ("_counters", len(self.counter_names), "int64"),
+            ]
+        )
+
+    def _descriptor_attrs(self):
+        return {"stage_names": self.stage_names, "counter_names": self.counter_names}
+
+    def record(self, stage, value):
+        """
+        Record a single latency of `stage` in seconds.
+        """
+        i = self.stage_names.index(stage)
+        self._hist[i, np.searchsorted(self.bin_edges, value)] += 1
+        self._count[i] += 1
+        self._sum[i] += value
+        if value > self._max[i]:
+            self._max[i] = value
+
+    def record_many(self, stage, values):
+        """
+        Record a sequence of latencies of `stage` in seconds.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+
+        i = self.stage_names.index(stage)
+        self._hist[i] += np.bincount(
+            np.searchsorted(self.bin_edges, values), minlength=self._hist.shape[1]
+        )
+        self._count[i] += values.size
+        self._sum[i] += values.sum()
+        self._max[i] = max(self._max[i], values.max())
+
+    def set_counter(self, counter, value):
+        self._counters[self.counter_names.index(counter)] = value
+
+    def add_count(self, counter, n=1):
+        self._counters[self.counter_names.index(counter)] += n
+
+    def reset(self):
+        """
+        Clear all histograms and counters.
+        """
+        self._hist[:] = 0
+        self._count[:] = 0
+        self._sum[:] = 0
+        self._max[:] = 0
+        self._counters[:] = 0
+
+    def percentile(self, stage, q):
+        """
+        Return an estimate of the q-th percentile (0-100) of `stage` latencies in seconds, or None if no latencies
+        were recorded. The estimate is the upper edge of the histogram bin containing the percentile, which is at most
+        ~15% above the true value.
+        """
+        i = self.stage_names.index(stage)
+        hist = self._hist[i].copy()
+        total = hist.sum()
+        if total == 0:
+            return None
+
+        b = int(np.searchsorted(np.cumsum(hist), q / 100 * total))
+        upper = self.bin_edges[b] if b < len(self.bin_edges) else np.inf
+        return float(min(upper, self._max[i]))
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """
+        Return a json serializable dict with the sample count, mean, max and percentile latencies (in milliseconds)
+        of each stage, and the value of each counter.
+        """
+        stages = {}
+        for i, stage in enumerate(self.stage_names):
+            count = int(self._count[i])
+            stats = {"count": count}
+            if count > 0:
+                stats["mean_ms"] = float(self._sum[i]) / count * 1000
+                stats["max_ms"] = float(self._max[i]) * 1000
+                for q in percentiles:
+                    stats[f"p{q}_ms"] = self.percentile(stage, q) * 1000
+            stages[stage] = stats
+
+        return {
+            "stages": stages,
+            "counters": {
+                name: int(v) for name, v in zip(self.counter_names, self._counters)
+            },
+        }
+
+
 class ConfigurableProcess(mp.Process):
     """
     a Configurable multiprocessing.Process
@@ -43,12 +682,23 @@ class ConfigurableProcess(mp.Process):
 
     Using configuration parameters in a subclass:
     The actual values of the parameters can be accessed using the `get_config(key)` method, where `key` is the parameter name.
+
+    Latency statistics:
+    Subclasses that define the class fields `latency_stages` and `latency_counters` get a LatencyStats object at
+    self.stats. A summary of the stats is published to the state store under `stats_state_key` every
+    `stats_publish_interval` seconds while the publisher is running (see _start_stats_publisher()). Before
+    publishing, each counter is set to the value of the process attribute with the same name, if it exists.
     """
 
     default_params = {
         "class": None,
     }
 
+    latency_stages = ()
+    latency_counters = ()
+    stats_state_key = "latency"
+    stats_publish_interval = 1
+
     def __init__(
         self,
         id: str,
@@ -65,6 +715,11 @@ class ConfigurableProcess(mp.Process):
         self.state_store_address = state_store_address
         self.state_store_authkey = state_store_authkey
 
+        if len(self.latency_stages) > 0:
+            self.stats = LatencyStats(self.latency_stages, self.latency_counters)
+        else:
+            self.stats = None
+
     def get_config(self, key):
         """
         Return a config value for the supplied `key`. If it doesn't exist, return the default value for `key`.
@@ -88,13 +743,52 @@ class ConfigurableProcess(mp.Process):
         self.log = self.logging_configurer.configure_child(mp.current_process().name)
         self.log.debug("Running...")
 
+    def _start_stats_publisher(self):
+        """
+        Start a thread that periodically publishes the latency stats summary to the state store.
+        Should be called from the child process.
+        """
+        if self.stats is None:
+            return
+
+        self._stats_stop_event = threading.Event()
+
+        def publish_loop():
+            while not self._stats_stop_event.wait(self.stats_publish_interval):
+                self._publish_stats()
+
+        self._stats_thread = threading.Thread(target=publish_loop, daemon=True)
+        self._stats_thread.start()
+
+    def _stop_stats_publisher(self):
+        """
+        Stop the stats publisher thread and publish the final stats.
+        """
+        if self.stats is None:
+            return
+
+        self._stats_stop_event.set()
+        self._stats_thread.join()
+        self._publish_stats()
+
+    def _publish_stats(self):
+        try:
+            for name in self.stats.counter_names:
+                if hasattr(self, name):
+                    self.stats.set_counter(name, getattr(self, name))
+
+            self.state[self.stats_state_key] = self.stats.summary()
+        except Exception:
+            self.log.exception("Exception while publishing latency stats:")
+
 
 class ImageSource(ConfigurableProcess):
     """
     ImageSource - a multiprocessing.Process that writes image data to a shared memory buffer.
 
     ImageSource parameters (in addition to the "class" param):
-    - buf_len: The number of images stored in the buffer.
+    - buf_len: The number of images stored in the buffer. Observers that fall behind the source by less than buf_len images
+               will process every image; otherwise the oldest images are skipped and counted as dropped.
     - buf_dtype: The data type of each image pixel channel. Currently "uint8" or "uint16" are supported, for unsigned 8-bit
                  integer or unsigned 16-bit integer respectively.
     - image_shape: a tuple with 2 element denoting the shape of each image in the buffer.
@@ -103,11 +797,18 @@ class ImageSource(ConfigurableProcess):
     - 8bit_scaling: Should be used in case buf_dtype is "uint16". Videos and images can currently only be encoded in 8 bits per pixel
                     channel. This configures the way 16 bit pixel values are scaled to 8 bits. It can be either:
                     - "auto" (str): Scale pixel intensities linearly so that the image minimum becomes 0 and the maximum becomes 255.
+                                    The minimum and maximum are estimated from a subsample of the image every 30 images.
                     - "full_range" (str): Linear scaling which maps 0 to 0 and 65535 to 255.
                     - [a, b] (any two-element sequence): Linear scaling which maps a to 0 and b to 255.
     - video_frame_rate: The number of frames per second. Used for setting the speed of recorded videos.
     See documentation of the ConfigurableProcess class for more information on setting default params and runtime parameter access
 
+    Latency stages (see LatencyStats, published under the "latency" key of the image source state):
+    - capture_to_write: From the image timestamp until the image is written to the frame buffer.
+    - http_encode: Time spent applying overlays and encoding an image for an HTTP stream.
+    - frame_to_http: From the image timestamp until the image is encoded for an HTTP stream.
+    The http_dropped_frames counter counts encoded frames skipped by slow HTTP stream clients.
+
     To make your own ImageSource subclass override any of the following methods:
     - _acquire_image(self)
     - _on_start(self)
@@ -116,9 +817,12 @@ class ImageSource(ConfigurableProcess):
     See the documentation of each method for more information.
     """
 
+    latency_stages = ("capture_to_write", "http_encode", "frame_to_http")
+    latency_counters = ("http_dropped_frames",)
+
     default_params = {
         **ConfigurableProcess.default_params,
-        "buf_len": 1,
+        "buf_len": 8,
         "buf_dtype": "uint8",
         "image_shape": None,
         "encoding_config": None,
@@ -142,28 +846,11 @@ class ImageSource(ConfigurableProcess):
             state_store_authkey,
         )
 
-        self.image_shape = self.get_config("image_shape")
         self.buf_len = self.get_config("buf_len")
         self.buf_dtype = self.get_config("buf_dtype")
         self.scaling_8bit = self.get_config("8bit_scaling")
+        self.converter_8bit = Converter8bit(self.scaling_8bit)
 
-        if self.buf_dtype == "uint8":
-            self.buf_type_code = "B"
-        elif self.buf_dtype == "uint16":
-            self.buf_type_code = "H"
-        else:
-            raise ValueError(
-                f"Unsupported buf_dtype: {self.buf_dtype}. Only uint8 or uint16 are currently supported."
-            )
-
-        # currently supports only a single image buffer
-        self.buf_shape = self.image_shape
-        self.buf = mp.Array(self.buf_type_code, int(np.prod(self.buf_shape)))
-        self.buf_np = np.frombuffer(self.buf.get_obj(), dtype=self.buf_dtype).reshape(
-            self.buf_shape
-        )
-
-        self.timestamp = mp.Value("d")
         self.end_event = mp.Event()  # do we really need two events? v--
         self.stop_event = mp.Event()
 
@@ -172,8 +859,19 @@ class ImageSource(ConfigurableProcess):
         self.stop_streaming_events = []
         self.add_observer_event(self.stream_obs_event)
         self.name = f"{type(self).__name__}:{self.id}"
+
+        # Subclasses can set frame_meta_shape in _init() to store a metadata array with every image (see
+        # FrameBuffer). The metadata of each acquired image should then be assigned to self.frame_meta.
+        self.frame_meta_shape = None
+        self.frame_meta = None
         self._init()
 
+        # _init() may set the image_shape param, e.g. according to a video file.
+        self.image_shape = self.get_config("image_shape")
+        self.frame_buf = FrameBuffer(
+            self.image_shape, self.buf_dtype, self.buf_len, self.frame_meta_shape
+        )
+
     def _init(self):
         pass
 
@@ -221,6 +919,9 @@ class ImageSource(ConfigurableProcess):
         return img
 
     def stream_gen(self, frame_rate=15, scale_to_8bit=False):
+        if not is_image_shape(self.image_shape):
+            raise ValueError(f"Images with shape {tuple(self.image_shape)} can't be streamed")
+
         self.stop_streaming()
 
         stop_this_stream_event = mp.Event()
@@ -257,6 +958,7 @@ class ImageSource(ConfigurableProcess):
             return
 
         self.state["acquiring"] = True
+        self._start_stats_publisher()
 
         try:
             while True:
@@ -280,16 +982,7 @@ class ImageSource(ConfigurableProcess):
                 if img is None:
                     continue
 
-                with self.buf.get_lock():
-                    self.timestamp.value = timestamp
-
-                    self.buf_np = np.frombuffer(
-                        self.buf.get_obj(), dtype=self.buf_dtype
-                    ).reshape(self.buf_shape)
-                    np.copyto(self.buf_np, img)
-
-                    for obs in self.observer_events:
-                        obs.set()
+                self._write_image(img, timestamp)
 
             if "acquiring" in self.state:
                 self.state["acquiring"] = False
@@ -298,23 +991,56 @@ class ImageSource(ConfigurableProcess):
             self.log.exception("Exception while acquiring images:")
         finally:
             self._on_stop()
+            self._stop_stats_publisher()
 
         for obs in self.observer_events:
             obs.set()
         self.end_event.set()
 
-    def get_image(self, scale_to_8bit=False):
+    def _write_image(self, img, timestamp):
+        """
+        Write an image to the next slot of the frame buffer and notify observers.
+        """
+        self.frame_buf.write(img, timestamp, self.frame_meta)
+
+        for obs in self.observer_events:
+            obs.set()
+
+        self.stats.record("capture_to_write", time.time() - timestamp)
+
+    def get_image(self, scale_to_8bit=False, copy=False):
         """
         Return img, timestamp
-        - img: The current data in the image buffer (assuming a single image buffer)
-        - timestamp: The timestamp of the current image buffer data in seconds since epoch.
+        - img: The most recent complete image in the frame buffer.
+        - timestamp: The timestamp of the image in seconds since epoch.
+
+        Args:
+        - scale_to_8bit: When True and buf_dtype is "uint16" the image is converted to 8 bits according to the
+                         8bit_scaling param (see image_utils.Converter8bit)
+        - copy: When False, and the image is not converted to 8 bits, `img` is a view of the frame buffer. The view
+                is guaranteed to be consistent when returned and remains valid until buf_len - 1 more images are
+                acquired. Use copy=True when the image is needed for longer.
         """
-        if scale_to_8bit and self.buf_dtype == "uint16":
-            img = convert_to_8bit(self.buf_np, self.scaling_8bit)
-        else:
-            img = self.buf_np
+        frame_buf = self.frame_buf
+
+        for _ in range(frame_buf.max_read_attempts):
+            img, timestamp, seq = frame_buf.read_latest(copy)
+            if img is None:
+                break
+
+            if scale_to_8bit and self.buf_dtype == "uint16":
+                img = self.converter_8bit.convert(img)
+                if not frame_buf.is_available(seq):
+                    continue  # overwritten during conversion
 
-        return img, self.timestamp.value
+            return img, timestamp
+
+        # empty buffer or the writer kept overwriting the image while reading
+        seq = max(frame_buf.last_seq(), 0)
+        img = frame_buf.frames[seq % frame_buf.length]
+        if scale_to_8bit and self.buf_dtype == "uint16":
+            img = self.converter_8bit.convert(img)
+        return img, frame_buf._timestamps[seq % frame_buf.length]
 
     def shutdown(self):
         self.stop_event.set()
@@ -344,47 +1070,259 @@ class ImageSource(ConfigurableProcess):
         pass
 
 
+class _ListenerDispatcher:
+    """
+    Calls the observer listeners of the current process.
+
+    Each dispatcher owns a named pipe (FIFO) and registers its path with the observers it listens to. Observers write
+    a byte to every registered pipe after each output update, waking the dispatcher thread which then wakes the worker
+    thread of each listener whose observer output changed. Each listener runs on its own worker thread, so a slow or
+    blocking listener doesn't delay the others. Listeners that are slower than the observer are called with the latest
+    output only, the updates they missed are counted in `coalesced`.
+
+    The FIFO is removed by shutdown() (or when the process exits). FIFOs left behind by processes that crashed are
+    removed when a new dispatcher is created.
+    """
+
+    _instance = None
+    fifo_prefix = "reptilearn_listeners_"
+
+    @classmethod
+    def get(cls):
+        """
+        Return the dispatcher of the current process, creating it if necessary.
+        """
+        if cls._instance is None or cls._instance.pid != os.getpid():
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Stop the dispatcher of the current process, if there is one, and remove its FIFO. Its listeners are not called
+        anymore.
+        """
+        if cls._instance is not None and cls._instance.pid == os.getpid():
+            cls._instance._shutdown()
+            cls._instance = None
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.log = logging.getLogger("ListenerDispatcher")
+        self._remove_stale_fifos()
+
+        self.fifo_path = os.path.join(
+            tempfile.gettempdir(), f"{self.fifo_prefix}{self.pid}_{uuid.uuid4().hex}"
+        )
+        os.mkfifo(self.fifo_path)
+        self._read_fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        # Keeping a write end open prevents end-of-file on the read end when observers close theirs
+        self._wake_fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+        atexit.register(self._cleanup)
+
+        self._lock = threading.Lock()
+        self._listeners = {}
+        self._thread = None
+        self._stopped = False
+
+    def _remove_stale_fifos(self):
+        for path in glob.glob(os.path.join(tempfile.gettempdir(), self.fifo_prefix + "*")):
+            try:
+                pid = int(os.path.basename(path)[len(self.fifo_prefix) :].split("_")[0])
+                os.kill(pid, 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                pass  # the process exists but belongs to another user
+
+    def add_listener(self, fn, output_buf, reg_queue, observer_name):
+        """
+        Add a listener function for an observer and start its worker thread. Return the listener id.
+        """
+        listener = SimpleNamespace(
+            fn=fn,
+            output_buf=output_buf,
+            reg_queue=reg_queue,
+            observer_name=observer_name,
+            last_count=output_buf.output_count(),
+            coalesced=0,
+            wake_event=threading.Event(),
+            removed=False,
+        )
+        listener.thread = threading.Thread(
+            target=self._run_listener, args=(listener,), daemon=True
+        )
+
+        with self._lock:
+            if not any(
+                ls.observer_name == observer_name for ls in self._listeners.values()
+            ):
+                reg_queue.put(("add", self.fifo_path))
+
+            listener_id = uuid.uuid4()
+            self._listeners[listener_id] = listener
+            listener.thread.start()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        return listener_id
+
+    def remove_listener(self, listener_id):
+        """
+        Remove a listener. Unless called from the listener itself, returns once the listener is no longer running.
+        """
+        with self._lock:
+            listener = self._listeners.pop(listener_id, None)
+            if listener is None:
+                return
+
+            if not any(
+                ls.observer_name == listener.observer_name
+                for ls in self._listeners.values()
+            ):
+                listener.reg_queue.put(("remove", self.fifo_path))
+
+        self._stop_listener(listener)
+
+        if listener.coalesced > 0:
+            self.log.debug(
+                f"Listener of {listener.observer_name} skipped {listener.coalesced} updates."
+            )
+
+    def _stop_listener(self, listener):
+        listener.removed = True
+        listener.wake_event.set()
+        if listener.thread is not threading.current_thread():
+            listener.thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            select.select([self._read_fd], [], [])
+            try:
+                while os.read(self._read_fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            except OSError:
+                break  # the pipe was closed by shutdown()
+
+            with self._lock:
+                listeners = list(self._listeners.values())
+
+            for listener in listeners:
+                if listener.output_buf.output_count() != listener.last_count:
+                    listener.wake_event.set()
+
+    def _run_listener(self, listener):
+        while True:
+            listener.wake_event.wait()
+            listener.wake_event.clear()
+            if listener.removed:
+                break
+
+            count = listener.output_buf.output_count()
+            if count == listener.last_count:
+                continue
+
+            listener.coalesced += max(count - listener.last_count - 1, 0)
+            listener.last_count = count
+            try:
+                listener.fn(
+                    listener.output_buf.output, listener.output_buf.timestamp[0]
+                )
+            except Exception:
+                self.log.exception(f"Exception in listener of {listener.observer_name}:")
+
+    def _shutdown(self):
+        with self._lock:
+            listeners = list(self._listeners.values())
+            self._listeners = {}
+            self._stopped = True
+
+        for listener in listeners:
+            self._stop_listener(listener)
+
+        # wakes the dispatcher thread, which then exits
+        try:
+            os.write(self._wake_fd, b"\0")
+        except OSError:
+            pass
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        for fd in (self._read_fd, self._wake_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+        self._cleanup()
+
+    def _cleanup(self):
+        try:
+            os.unlink(self.fifo_path)
+        except OSError:
+            pass
+
+
+def shutdown_listeners():
+    """
+    Stop all observer listeners of the current process and remove its listener pipe (see _ListenerDispatcher).
+    """
+    _ListenerDispatcher.shutdown()
+
+
 class _ImageObserverInterface:
     def __init__(self, other) -> None:
         self.output_buf = other.output_buf
         self.output_shape = other.output_shape
         self.output_dtype = other.output_dtype
-        self.output_timestamp = other.output_timestamp
+        self._listener_reg_queue = other._listener_reg_queue
         self._proc_name = other.name
 
-    def add_listener(self, fn, state: managed_state.Cursor):
+    def get_last_outputs(self, n, copy=False):
+        """
+        Return outputs, timestamps of the last `n` observer outputs, oldest first (see ObserverOutput.get_last()).
+        """
+        return self.output_buf.get_last(n, copy)
+
+    def get_outputs_between(self, t0, t1, copy=False):
+        """
+        Return outputs, timestamps of all observer outputs with timestamps between t0 and t1 in seconds since epoch
+        (see ObserverOutput.get_between()).
+        """
+        return self.output_buf.get_between(t0, t1, copy)
+
+    def add_listener(self, fn, state: managed_state.Cursor = None):
         """Add a listener function that's called whenever the observer output changes.
 
+        Each listener is called from its own thread (see _ListenerDispatcher), so a slow listener doesn't delay other
+        listeners. When a listener is slower than the observer it's called with the latest output, skipping older ones.
+
         Args:
         - fn: A function with signature (output, timestamp).
             - output: a reference to the observer's output buffer (on main process)
             - timestamp: The timestamp of the current output data as seconds since epoch
+        - state: Unused, kept for backwards compatibility.
 
         Return:
         A remove_listener() function to remove this listener
-
-        NOTE: This method should only be called from the main process
         """
-        listener_uuid = uuid.uuid4()
-        kill_event = threading.Event()
-        update_event = state.get_event(self._proc_name, listener_uuid)
-        output = np.frombuffer(
-            self.output_buf.get_obj(), dtype=self.output_dtype
-        ).reshape(self.output_shape)
-
-        def listener():
-            while True:
-                if update_event.wait(1):
-                    fn(output, self.output_timestamp.value)
-                    update_event.clear()
-
-                if kill_event.is_set():
-                    break
-
-        threading.Thread(target=listener, args=()).start()
+        dispatcher = _ListenerDispatcher.get()
+        listener_id = dispatcher.add_listener(
+            fn, self.output_buf, self._listener_reg_queue, self._proc_name
+        )
 
         def remove_listener():
-            state.remove_event(self._proc_name, listener_uuid)
+            dispatcher.remove_listener(listener_id)
 
         return remove_listener
 
@@ -395,6 +1333,17 @@ class ImageObserver(ConfigurableProcess):
 
     Observer parameters (in addition to the "class" param):
     - src_id: The id of an ImageSource (a key of video_system.image_sources) that will be observed by this observer.
+    - batch_size: The number of images delivered to _on_images_update() at once. When it's 1 (the default) images are
+                  delivered one at a time to _on_image_update(). Can't be larger than the image source buf_len.
+    - batch_max_latency: The max time in seconds to wait for a batch to fill up before delivering a partial batch, or
+                         None to always wait for a full batch.
+    - workers: The number of worker processes (default 1). When larger than 1 the observer runs in pooled mode: each
+               worker is a copy of the observer that calls _setup() once and processes every workers-th image
+               (or batch), while the observer process dispatches images round-robin and writes the worker outputs
+               to the output buffer, and notifies listeners, in image order. Since each worker sees only part of the
+               images, observers that keep state between images should not use pooled mode.
+    - output_history_len: The number of past outputs kept in shared memory (see get_last_outputs() and
+                          get_outputs_between()).
     See documentation of the ConfigurableProcess class for more information on setting default params and runtime parameter access
 
     The observer can be controlled from the main process by using the following methods:
@@ -406,7 +1355,9 @@ class ImageObserver(ConfigurableProcess):
     To make your own observer override any of the following methods:
     - _on_start(self)
     - _on_image_update(self, img, timestamp)
+    - _on_images_update(self, imgs, timestamps) (when using batches)
     - _on_stop(self)
+    - _on_command(self, cmd)
     - _setup(self)
     - _release(self)
 
@@ -416,17 +1367,46 @@ class ImageObserver(ConfigurableProcess):
     The ImageObserver stores its output data in a shared output buffer (self.output, a numpy.array). This buffer can be accessed efficiently by other processes such
     as the main experiment process, or data logger processes.
 
-    To update the buffer, call the method _update_output(new_output).
+    To update the buffer, call the method _update_output(new_output), or _update_outputs(new_outputs, timestamps)
+    to write the outputs of a batch of images one at a time.
+
+    Every output update is also recorded in a history ring of the last output_history_len outputs. The main process
+    can query it using get_last_outputs(n) or get_outputs_between(t0, t1) instead of listening to every update, for
+    example to find where the animal was in the last 2 seconds:
+
+    ```python
+    bboxes, timestamps = obs.get_outputs_between(time.time() - 2, time.time())
+    ```
 
     The buffer size and various options are determined according to the values returned by self.get_buffer_opts() (see method documentation for details).
     This method is called once while the observer is initializing.
+
+    Latency stages (see LatencyStats, published under the "latency" key of the observer state and reset whenever
+    observing starts):
+    - frame_to_start: From the image timestamp until the observer starts processing the image.
+    - process: The processing time of each image (the batch processing time divided by the batch size).
+    - frame_to_output: From the image timestamp until the output of the image is written.
+    The dropped_frames and torn_frames counters are published as well.
     """
 
+    latency_stages = ("frame_to_start", "process", "frame_to_output")
+    latency_counters = ("dropped_frames", "torn_frames")
+
     default_params = {
         **ConfigurableProcess.default_params,
         "src_id": None,
+        "batch_size": 1,
+        "batch_max_latency": 0.1,
+        "workers": 1,
+        "output_history_len": 256,
     }
 
+    # Max number of images (or batches) dispatched to each worker in pooled mode before its results are received.
+    max_worker_backlog = 2
+
+    # Outputs of the image being processed by a worker process (pooled mode only)
+    _worker_outputs = None
+
     def __init__(
         self,
         id: str,
@@ -447,24 +1427,35 @@ class ImageObserver(ConfigurableProcess):
         self.update_event = mp.Event()
         image_source.add_observer_event(self.update_event)
         self._img_src_end_event = image_source.end_event
-        self._img_src_buf = image_source.buf
-        self._img_src_buf_shape = image_source.buf_shape
+        self._img_src_frames = image_source.frame_buf
+        self._reader_id = self._img_src_frames.add_reader()
         self._img_src_buf_dtype = image_source.buf_dtype
-        self._img_src_timestamp = image_source.timestamp
+        self._img_src_scaling_8bit = image_source.scaling_8bit
         self._img_src_config = image_source.config
         self.image_shape = image_source.image_shape
         self._running_state_key = running_state_key
 
-        atype, asize, shape, dtype = self._get_buffer_opts()
-        self.output_buf = mp.Array(atype, asize)
+        self.workers = self.get_config("workers")
+        self.batch_size = self.get_config("batch_size")
+        if self.batch_size > image_source.buf_len:
+            raise ValueError(
+                f"batch_size ({self.batch_size}) can't be larger than the image source buf_len ({image_source.buf_len})"
+            )
+
+        _, asize, shape, dtype = self._get_buffer_opts()
+        self.output_buf = ObserverOutput(
+            shape,
+            dtype,
+            None if isinstance(asize, int) else asize,
+            self.get_config("output_history_len"),
+        )
         self.output_shape = shape
         self.output_dtype = dtype
-        self.output = np.frombuffer(self.output_buf.get_obj(), dtype=dtype).reshape(
-            self.output_shape
-        )
-        self.output_timestamp = mp.Value("d")  # a double
 
         self.parent_pipe, self.child_pipe = mp.Pipe()
+        # Listener dispatchers send ("add" | "remove", fifo_path) messages (see _ListenerDispatcher)
+        self._listener_reg_queue = mp.Queue()
+        self._listener_fds = {}
 
         self.name = f"{id}:{self.get_config('src_id')}"
 
@@ -473,6 +1464,13 @@ class ImageObserver(ConfigurableProcess):
     def _init(self):
         pass
 
+    @property
+    def output(self):
+        """
+        The observer output buffer (a numpy.array in shared memory).
+        """
+        return self.output_buf.output
+
     def get_interface(self):
         """
         Should be called from the main process. The returned object can then be accessed from any process
@@ -480,7 +1478,7 @@ class ImageObserver(ConfigurableProcess):
 
         return _ImageObserverInterface(self)
 
-    def add_listener(self, listener, state):
+    def add_listener(self, listener, state=None):
         """
         Should be called from the main process. To add a listener from another process, pass the object returned by
         get_interface() to the process and call its add_listener() method.
@@ -494,7 +1492,20 @@ class ImageObserver(ConfigurableProcess):
         - numpy.array: a reference to the observer output buffer.
         - the timestamp of the current output data in seconds since epoch.
         """
-        return self.output, self.output_timestamp.value
+        return self.output_buf.output, self.output_buf.timestamp[0]
+
+    def get_last_outputs(self, n, copy=False):
+        """
+        Return outputs, timestamps of the last `n` outputs, oldest first (see ObserverOutput.get_last()).
+        """
+        return self.output_buf.get_last(n, copy)
+
+    def get_outputs_between(self, t0, t1, copy=False):
+        """
+        Return outputs, timestamps of all outputs with timestamps between t0 and t1 in seconds since epoch
+        (see ObserverOutput.get_between()).
+        """
+        return self.output_buf.get_between(t0, t1, copy)
 
     def start_observing(self):
         """
@@ -522,17 +1533,17 @@ class ImageObserver(ConfigurableProcess):
 
     def run(self):
         # This code runs on the observer process
-        super().run()
+        if self.workers > 1:
+            # Workers receive a copy of this object, so they're started before connecting to the state store
+            self._start_workers()
 
-        self.output = np.frombuffer(
-            self.output_buf.get_obj(), dtype=self.output_dtype
-        ).reshape(self.output_shape)
+        super().run()
+        self._start_stats_publisher()
 
-        self.output_update_events = self.state.get_events(self.name)
-        on_update_events_changed = self.state.add_events_changed_event(self.name)
         self.state[self._running_state_key] = False
 
-        self._setup()
+        if self.workers == 1:
+            self._setup()
         cmd = None
 
         while True:
@@ -544,22 +1555,35 @@ class ImageObserver(ConfigurableProcess):
             if self._img_src_end_event.is_set():
                 break
 
-            if on_update_events_changed.is_set():
-                on_update_events_changed.clear()
-                self.output_update_events = self.state.get_events(self.name)
+            self._update_listener_fds()
 
             if cmd == "shutdown":
-                self._release()
+                if self.workers == 1:
+                    self._release()
                 self.log.info("Shutting down")
                 break
 
             if cmd == "start":
                 self.avg_proc_time = 0
                 self.frame_count = 0
+                self.dropped_frames = 0
+                self.torn_frames = 0
+                self._next_seq = None
+                self._cur_seq = None
+                self._batch_start_time = None
+                self.stats.reset()
+                self._img_src_frames.set_read_seq(
+                    self._reader_id, max(self._img_src_frames.last_seq(), 0)
+                )
 
                 if self.state is not None:
                     self.state[self._running_state_key] = True
-                self._on_start()
+
+                if self.workers == 1:
+                    self._on_start()
+                else:
+                    self._send_to_workers("start")
+
                 self.update_event.clear()
 
                 try:
@@ -572,44 +1596,359 @@ class ImageObserver(ConfigurableProcess):
                             cmd = self.child_pipe.recv()
                             if cmd == "stop":
                                 break
+                            self._on_command(cmd)
 
-                        if on_update_events_changed.is_set():
-                            on_update_events_changed.clear()
-                            self.output_update_events = self.state.get_events(
-                                self.name
-                            )
+                        self._update_listener_fds()
 
-                        if self.update_event.wait(1):
+                        if self.update_event.wait(self._update_wait_timeout()):
                             self.update_event.clear()
 
-                            t0 = time.time()
-                            img = np.frombuffer(
-                                self._img_src_buf.get_obj(),
-                                dtype=self._img_src_buf_dtype,
-                            ).reshape(self._img_src_buf_shape)
-                            timestamp = self._img_src_timestamp.value
-
-                            self.output_timestamp.value = timestamp
-                            self._on_image_update(img, timestamp)
-                            dt = time.time() - t0
-                            self.frame_count += 1
-                            if self.frame_count == 1:
-                                self.avg_proc_time = dt
-                            else:
-                                self.avg_proc_time = (
-                                    self.avg_proc_time * (self.frame_count - 1) + dt
-                                ) / self.frame_count
+                        if self.workers == 1:
+                            self._process_new_images()
+                        else:
+                            self._collect_worker_results()
+                            self._dispatch_new_images()
                 except Exception:
                     self.log.exception("Exception while observing:")
                 finally:
                     try:
-                        if self.state is not None:
-                            self.state[self._running_state_key] = False
-                        self._on_stop()
+                        if self.workers > 1:
+                            self._collect_worker_results(wait=True)
+                        if self.dropped_frames > 0:
+                            self.log.warning(
+                                f"Dropped {self.dropped_frames} frames out of {self.frame_count + self.dropped_frames}."
+                            )
+                        if self.torn_frames > 0:
+                            self.log.warning(
+                                f"{self.torn_frames} frames were overwritten while being processed."
+                            )
+                        self._img_src_frames.set_read_seq(self._reader_id, -1)
+                        try:
+                            if self.workers == 1:
+                                self._on_stop()
+                            else:
+                                self._send_to_workers("stop")
+                        finally:
+                            # published after _on_stop() so that it includes any stats updated while stopping
+                            if self.state is not None:
+                                self.state[self._running_state_key] = False
+                                self._publish_stats()
                         self.log.debug("Stopped observing")
                     except Exception:
                         self.log.exception("Exception while stopping observer:")
 
+        if self.workers > 1:
+            self._stop_workers()
+
+        self._stop_stats_publisher()
+
+        for fd in self._listener_fds.values():
+            os.close(fd)
+
+    def _update_listener_fds(self):
+        """
+        Open or close listener dispatcher pipes according to messages in the registration queue.
+        """
+        while not self._listener_reg_queue.empty():
+            try:
+                op, path = self._listener_reg_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if op == "add" and path not in self._listener_fds:
+                try:
+                    self._listener_fds[path] = os.open(
+                        path, os.O_WRONLY | os.O_NONBLOCK
+                    )
+                except OSError:
+                    self.log.warning(f"Could not open listener pipe {path}")
+            elif op == "remove" and path in self._listener_fds:
+                os.close(self._listener_fds.pop(path))
+
+    def _next_images(self):
+        """
+        Return (seq, count) of the next images that should be processed or None if there are none. Returns a full
+        batch of batch_size images unless batch_max_latency passed since the batch started filling up. Images that
+        were overwritten before they could be processed are counted in self.dropped_frames.
+        """
+        frames = self._img_src_frames
+        last_seq = frames.last_seq()
+        if last_seq < 0:
+            return None
+
+        if self._next_seq is None:
+            # start from the most recent image when observing starts
+            self._next_seq = last_seq
+
+        if self._next_seq > last_seq:
+            return None
+
+        first_seq = frames.first_seq()
+        if self._next_seq < first_seq:
+            self.dropped_frames += first_seq - self._next_seq
+            self._next_seq = first_seq
+
+        seq = self._next_seq
+        count = min(last_seq - seq + 1, self.batch_size)
+        if count < self.batch_size and not self._is_batch_due():
+            return None
+
+        self._batch_start_time = None
+        self._next_seq = seq + count
+        return seq, count
+
+    def _process_new_images(self):
+        """
+        Process all images that were written to the image source buffer since the last processed image, in order,
+        either one at a time or in batches of batch_size images. Returns early when a command is received from the
+        main process, so that an observer that can't keep up with its image source can still be stopped.
+        """
+        while not self.child_pipe.poll():
+            next_images = self._next_images()
+            if next_images is None:
+                break
+
+            seq, count = next_images
+            timestamps = self._frame_timestamps(seq, count)
+            t0 = time.time()
+            self.stats.record_many("frame_to_start", t0 - timestamps)
+
+            processed, torn = self._process_images(seq, count)
+            if not processed:
+                self.dropped_frames += count
+                continue
+
+            if torn:
+                self.torn_frames += count
+
+            t1 = time.time()
+            self._update_proc_stats(count, t1 - t0)
+            self.stats.record_many("frame_to_output", t1 - timestamps)
+            self._img_src_frames.set_read_seq(self._reader_id, self._next_seq)
+
+    def _process_images(self, seq, count):
+        """
+        Call _on_image_update() or _on_images_update() with `count` images starting at sequence number `seq`.
+
+        Return processed, torn:
+        - processed: False if the images were no longer available in the image source buffer.
+        - torn: True if the images were overwritten while being processed.
+        """
+        frames = self._img_src_frames
+
+        if self.batch_size == 1:
+            img, timestamp = frames.read(seq)
+            if img is None:
+                return False, False
+
+            self._cur_seq = seq
+            self.output_buf.timestamp[0] = timestamp
+            self._on_image_update(img, timestamp)
+        else:
+            imgs, timestamps = frames.read_many(seq, count)
+            if imgs is None:
+                return False, False
+
+            self._cur_seq = seq
+            self._on_images_update(imgs, timestamps)
+
+        return True, not frames.is_available(seq)
+
+    def _frame_timestamps(self, seq, count):
+        """
+        Return a copy of the timestamps of `count` images starting at sequence number `seq`.
+        """
+        frames = self._img_src_frames
+        return frames._timestamps[np.arange(seq, seq + count) % frames.length]
+
+    def _frame_meta(self, seq=None):
+        """
+        Return a copy of the metadata of the image with sequence number `seq` (see FrameBuffer.read_meta()), or of the
+        first image currently being processed when seq is None. Return None if the image was overwritten.
+        """
+        return self._img_src_frames.read_meta(self._cur_seq if seq is None else seq)
+
+    def _update_proc_stats(self, count, dt):
+        self.stats.record_many("process", np.full(count, dt / count))
+        self.frame_count += count
+        if self.frame_count == count:
+            self.avg_proc_time = dt / count
+        else:
+            self.avg_proc_time = (
+                self.avg_proc_time * (self.frame_count - count) + dt
+            ) / self.frame_count
+
+    def _start_workers(self):
+        """
+        Start the worker processes of pooled mode (see the `workers` parameter).
+        """
+        conns = []
+        procs = []
+        for i in range(self.workers):
+            conn, worker_conn = mp.Pipe()
+            proc = mp.Process(
+                target=self._worker_main,
+                args=(worker_conn,),
+                name=f"{self.name}:worker{i}",
+                daemon=True,
+            )
+            proc.start()
+            conns.append(conn)
+            procs.append(proc)
+
+        self._worker_conns = conns
+        self._worker_procs = procs
+        self._next_worker = 0
+        self._in_flight = collections.deque()
+        self._worker_results = {}
+
+    def _stop_workers(self):
+        self._send_to_workers(None)
+        for proc in self._worker_procs:
+            proc.join()
+
+    def _send_to_workers(self, msg):
+        for conn in self._worker_conns:
+            try:
+                conn.send(msg)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def _worker_main(self, conn):
+        # This code runs on a worker process, using a copy of the observer.
+        super().run()
+
+        # Outputs are sent to the observer process instead of being written to the shared output buffer.
+        shared_output = self.output_buf
+        self.output_buf = SimpleNamespace(
+            output=shared_output.output.copy(), timestamp=np.zeros(1)
+        )
+        shared_output.close()
+        self._worker_outputs = []
+
+        try:
+            self._setup()
+
+            while True:
+                msg = conn.recv()
+                if msg is None:
+                    break
+                elif msg == "start":
+                    self._on_start()
+                elif msg == "stop":
+                    self._on_stop()
+                else:
+                    seq, count = msg
+                    self._worker_outputs = []
+                    t0 = time.time()
+                    processed, torn = self._process_images(seq, count)
+                    conn.send(
+                        (seq, count, processed, torn, time.time() - t0, self._worker_outputs)
+                    )
+                    self.update_event.set()  # wake up the observer process
+        except (EOFError, KeyboardInterrupt):
+            pass
+        except Exception:
+            self.log.exception("Exception in observer worker:")
+        finally:
+            self._release()
+
+    def _dispatch_new_images(self):
+        """
+        Send new images to the workers, round-robin, as long as they have less than max_worker_backlog images pending.
+        """
+        while len(self._in_flight) < self.workers * self.max_worker_backlog:
+            next_images = self._next_images()
+            if next_images is None:
+                break
+
+            seq, count = next_images
+            timestamps = self._frame_timestamps(seq, count)
+            self.stats.record_many("frame_to_start", time.time() - timestamps)
+
+            self._worker_conns[self._next_worker].send((seq, count))
+            self._next_worker = (self._next_worker + 1) % self.workers
+            self._in_flight.append((seq, timestamps))
+
+    def _collect_worker_results(self, wait=False):
+        """
+        Receive worker results and write their outputs to the output buffer in image order.
+        When `wait` is True, block until the results of all dispatched images are received.
+        """
+        while True:
+            for conn in self._worker_conns:
+                while conn.poll():
+                    seq, *result = conn.recv()
+                    self._worker_results[seq] = result
+
+            while self._in_flight and self._in_flight[0][0] in self._worker_results:
+                seq, timestamps = self._in_flight.popleft()
+                count, processed, torn, dt, outputs = self._worker_results.pop(seq)
+                if not processed:
+                    self.dropped_frames += count
+                    continue
+
+                if torn:
+                    self.torn_frames += count
+
+                self._update_proc_stats(count, dt)
+                for timestamp, output in outputs:
+                    self.output_buf.timestamp[0] = timestamp
+                    self._update_output(output)
+                self.stats.record_many("frame_to_output", time.time() - timestamps)
+
+            read_seq = self._in_flight[0][0] if self._in_flight else self._next_seq
+            if read_seq is not None:
+                self._img_src_frames.set_read_seq(self._reader_id, read_seq)
+
+            if not wait or not self._in_flight:
+                break
+
+            if not all(proc.is_alive() for proc in self._worker_procs):
+                self.log.error("An observer worker process terminated unexpectedly.")
+                self.dropped_frames += len(self._in_flight)
+                self._in_flight.clear()
+                self._worker_results.clear()
+                break
+
+            wait_connections(self._worker_conns, timeout=1)
+
+    def _is_batch_due(self):
+        """
+        Return True if a partial batch should be processed since batch_max_latency has passed since it started filling up.
+        """
+        if self._batch_start_time is None:
+            self._batch_start_time = time.time()
+
+        max_latency = self.get_config("batch_max_latency")
+        return (
+            max_latency is not None
+            and time.time() - self._batch_start_time >= max_latency
+        )
+
+    def _update_wait_timeout(self):
+        """
+        Return how long to wait for new images before processing a partial batch.
+        """
+        max_latency = self.get_config("batch_max_latency")
+        if self._batch_start_time is None or max_latency is None:
+            return 1
+
+        return max(self._batch_start_time + max_latency - time.time(), 0)
+
+    def _is_image_valid(self, seq=None):
+        """
+        Return True if the image with sequence number `seq` was not overwritten in the image source buffer since it
+        was read. When `seq` is None, check the image (or batch of images) that is currently being processed.
+
+        The img argument of _on_image_update() is a view of the image source buffer. Observers that keep a
+        reference to it after _on_image_update() returns, or that want to avoid outputting results computed from a
+        partially overwritten image, can use this method to validate the image.
+        """
+        if seq is None:
+            seq = self._cur_seq
+        return seq is not None and self._img_src_frames.is_available(seq)
+
     def _update_output(self, output):
         """
         Update observer's output with the supplied value, and notify any listeners.
@@ -617,6 +1956,19 @@ class ImageObserver(ConfigurableProcess):
         self.output[:] = output
         self._notify_listeners()
 
+    def _update_outputs(self, outputs, timestamps):
+        """
+        Update observer's output with each of the supplied outputs in order, and notify listeners after each update.
+        Used for writing back the outputs of a batch of images (see _on_images_update).
+
+        Args:
+        - outputs: A sequence of outputs, one for each image in the batch.
+        - timestamps: The timestamps of the images in the batch.
+        """
+        for output, timestamp in zip(outputs, timestamps):
+            self.output_buf.timestamp[0] = timestamp
+            self._update_output(output)
+
     def _notify_listeners(self):
         """
         Notify listeners that the output buffer was updated.
@@ -625,8 +1977,23 @@ class ImageObserver(ConfigurableProcess):
 
         NOTE: _update_output takes care of notifying listeners and doesn't require using this method.
         """
-        for evt in self.output_update_events.values():
-            evt.set()
+        if self._worker_outputs is not None:
+            # pooled mode worker process: the observer process writes the output and notifies listeners
+            self._worker_outputs.append(
+                (self.output_buf.timestamp[0], self.output.copy())
+            )
+            return
+
+        self.output_buf.record()
+        for path, fd in list(self._listener_fds.items()):
+            try:
+                os.write(fd, b"\0")
+            except BlockingIOError:
+                pass  # the pipe is full, the dispatcher will wake up anyway
+            except OSError:
+                # the listening process is gone
+                os.close(fd)
+                del self._listener_fds[path]
 
     def _on_start(self):
         """
@@ -636,20 +2003,48 @@ class ImageObserver(ConfigurableProcess):
 
     def _on_image_update(self, img, timestamp):
         """
-        Called after a new image was written to the image source buffer.
+        Called for each new image written to the image source buffer. Images are delivered in the order they were
+        acquired. When the observer falls behind by more than the image source buf_len, the oldest images are skipped.
 
         Args:
-        - img: A numpy.array containing the new image data
+        - img: A numpy.array view of the image source buffer containing the new image data. The view is overwritten
+               after buf_len more images are acquired (see _is_image_valid()).
         - timestamp: The image timestamp in seconds since epoch
         """
         pass
 
+    def _on_images_update(self, imgs, timestamps):
+        """
+        Called with a batch of consecutive images when batch_size is larger than 1. A batch has batch_size images,
+        except when batch_max_latency passed before the batch was filled. By default, calls _on_image_update()
+        for each image.
+
+        Args:
+        - imgs: A numpy.array with shape (N, *image_shape) containing the images in acquisition order. It's a view
+                of the image source buffer unless the batch wraps around the end of the buffer (see
+                _is_image_valid()).
+        - timestamps: A numpy.array of N image timestamps in seconds since epoch
+        """
+        first_seq = self._cur_seq
+        for i, (img, timestamp) in enumerate(zip(imgs, timestamps)):
+            self._cur_seq = first_seq + i
+            self.output_buf.timestamp[0] = timestamp
+            self._on_image_update(img, timestamp)
+        self._cur_seq = first_seq
+
     def _on_stop(self):
         """
         Called when the stop_observing() method is called.
         """
         pass
 
+    def _on_command(self, cmd):
+        """
+        Called with any command other than "stop" that was sent to the observer process pipe while observing.
+        Subclasses can use it to support additional commands (see video_write.VideoWriter).
+        """
+        pass
+
     def _setup(self):
         """
         Called when the observer process is started.
@@ -667,10 +2062,9 @@ class ImageObserver(ConfigurableProcess):
         Return the output buffer options for this observer.
 
         This method should return a tuple (atype, asize, shape, dtype) where:
-        - atype (str): The typecode of the multiprocessing.Array used to store the observer output.
-                       See: https://docs.python.org/3/library/array.html#module-array
-        - asize: int or sequence. size_or_initializer argument of multiprocessing.Array.
-                 See: https://docs.python.org/3/library/multiprocessing.html#multiprocessing.Array
+        - atype (str): The array typecode matching dtype (see https://docs.python.org/3/library/array.html#module-array).
+                       Not used since the output buffer is stored in an ObserverOutput.
+        - asize: int or sequence. The number of elements in the output buffer, or a sequence of initial output values.
         - shape: The shape of the numpy array that is used to represent the output buffer.
         - dtype: The dtype of the output buffer numpy array.
         """
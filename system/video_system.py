@@ -7,15 +7,20 @@ Create ImageSource and ImageObserver objects based on video configurations.
 Manage video recording and image capture.
 """
 from threading import Timer
+from datetime import datetime
 from pathlib import Path
 import json
+import time
 
 from configure import get_config
 from dynamic_loading import instantiate_class, load_modules, find_subclasses, reload_module
 from rl_logging import get_main_logger
 import video_write
+import http_streaming
+import image_capture
+import recording_gate
 from arena import has_trigger, start_trigger, stop_trigger
-from video_stream import ImageSource, ImageObserver
+from video_stream import ImageSource, ImageObserver, shutdown_listeners
 import overlays.timestamp
 import overlay
 import managed_state
@@ -45,11 +50,13 @@ _state = None
 _log = None
 _rec_state = None
 _do_restore_trigger = False
+_gate = None
 
 
 def _load_source(id, config):
     """
     Instantiate an ImageSource class according to the supplied config. Add the ImageSource to the global `image_sources` dict using `id` as key.
+    The descriptor of the source frame buffer is published in the state store (see video_stream.SharedArrays).
     """
     image_sources[id] = instantiate_class(
         config["class"],
@@ -60,12 +67,17 @@ def _load_source(id, config):
         get_config().state_store_authkey,
     )
 
+    _state[("video", "image_sources", id)] = {
+        "shm": image_sources[id].frame_buf.shm_descriptor()
+    }
+
     overlay.overlays[id] = [overlays.timestamp.TimestampVisualizer({})]
 
 
 def _load_observer(id, config):
     """
     Instantiate an ImageObserver class according to the supplied config. Add the ImageObserver to the global `image_observers` dict using `id` as key.
+    The descriptor of the observer output buffer is published in the state store (see video_stream.SharedArrays).
     """
     image_observers[id] = instantiate_class(
         config["class"],
@@ -77,17 +89,31 @@ def _load_observer(id, config):
         get_config().state_store_authkey,
     )
 
+    _state[("video", "image_observers", id)] = {
+        "shm": image_observers[id].output_buf.shm_descriptor()
+    }
+
 
 def _load_video_writers():
     """
     Instantiate a video_write.VideoWriter for each of the currently loaded `ImageSource`s.
-    Each writer is responsible for recording videos from a single ImageSource.
+    Each writer is responsible for recording videos from a single ImageSource. Sources whose images can't be encoded
+    as video frames (e.g. stacked frame sets), are not recorded unless they use the raw writer backend.
     """
     global video_writers
     video_writers = {}
 
     for src_id in image_sources.keys():
         img_src = image_sources[src_id]
+        backend = img_src.config.get(
+            "writer_backend", get_config().video_record["writer_backend"]
+        )
+
+        if backend != "raw" and not video_write.can_encode(img_src.image_shape):
+            _log.warning(
+                f"ImageSource {src_id} can't be recorded: images with shape {tuple(img_src.image_shape)} can't be encoded as video frames."
+            )
+            continue
 
         frame_rate = img_src.get_config("video_frame_rate")
         if not frame_rate:
@@ -101,7 +127,15 @@ def _load_video_writers():
                 img_src.get_config("encoding_config")
             ],
             frame_rate=frame_rate,
-            queue_max_size=get_config().video_record["max_write_queue_size"],
+            pool_size=get_config().video_record["write_pool_size"],
+            pool_policy=get_config().video_record["write_pool_policy"],
+            backend=backend,
+            raw_chunk_size=get_config().video_record["raw_chunk_size"],
+            raw_sync_size=get_config().video_record["raw_sync_size"],
+            raw_transcode=get_config().video_record["raw_transcode"],
+            timestamps_csv=get_config().video_record["timestamps_csv"],
+            preroll=img_src.config.get("preroll", get_config().video_record["preroll"]),
+            preroll_max_memory=get_config().video_record["preroll_max_memory"],
             media_dir=get_config().media_dir,
             file_ext=get_config().video_record["file_ext"],
             image_source=image_sources[src_id],
@@ -124,6 +158,7 @@ def _load_video_config(config: dict):
         _state["video"] = {
             "image_sources": {},
             "image_observers": {},
+            "captures": {},
         }
 
     _rec_state.set_self(
@@ -131,6 +166,12 @@ def _load_video_config(config: dict):
             "selected_sources": [],
             "is_recording": False,
             "filename_prefix": "",
+            "segments": {
+                "duration": get_config().video_record["segment_duration"],
+                "frames": get_config().video_record["segment_frames"],
+                "size": get_config().video_record["segment_size"],
+            },
+            "source_segments": {},
         }
     )
 
@@ -162,7 +203,7 @@ def _load_video_config(config: dict):
 def _update_acquire_callback(src_id):
     """
     Add a state store callback to automatically select and unselect an image source with id `src_id` when
-    it starts or stops acquiring images.
+    it starts or stops acquiring images. Sources that can't be recorded are not selected.
 
     Args:
     - src_id: The id of an existing `ImageSource`.
@@ -172,7 +213,8 @@ def _update_acquire_callback(src_id):
         nonlocal src_id
 
         if new_val is True and not old_val:
-            select_source(src_id)
+            if src_id in video_writers:
+                select_source(src_id)
         elif not new_val and old_val is True:
             unselect_source(src_id)
 
@@ -213,20 +255,31 @@ def update_video_config(config: dict, save=True):
     _load_video_config(video_config)
     _load_video_writers()
 
-    if has_trigger() and _rec_state.get("ttl_trigger", False):
-        start_trigger()
-    else:
-        stop_trigger()
+    if has_trigger():
+        if _rec_state.get("ttl_trigger", False):
+            start_trigger()
+        else:
+            stop_trigger()
 
     start_processes()
 
 
+def _check_recordable(src_ids):
+    """
+    Raise a ValueError if any of the ImageSources in src_ids doesn't have a video writer (see _load_video_writers()).
+    """
+    for src_id in src_ids:
+        if src_id not in video_writers:
+            raise ValueError(f"ImageSource {src_id} can't be recorded")
+
+
 def set_selected_sources(src_ids):
     """
     Sets which ImageSources will be recorded from when the next recording starts. Updates the state store.
 
     - src_ids: A list of ImageSource id strings.
     """
+    _check_recordable(src_ids)
     _rec_state["selected_sources"] = src_ids
 
 
@@ -237,6 +290,7 @@ def select_source(src_id: str):
     if src_id in _rec_state["selected_sources"]:
         return
 
+    _check_recordable([src_id])
     _rec_state.append("selected_sources", src_id)
 
 
@@ -248,12 +302,65 @@ def unselect_source(src_id: str):
         _rec_state.remove("selected_sources", src_id)
 
 
+def set_record_segments(duration=None, frames=None, size=None, src_ids=None):
+    """
+    Set when recordings are split into a new video file (see video_write.VideoWriter). A new segment file starts when
+    the current one reaches any of the limits. Takes effect on the next recording. Updates the state store.
+
+    Args:
+    - duration: The max segment duration in seconds, or None.
+    - frames: The max number of frames in each segment, or None.
+    - size: The max segment file size in bytes, or None.
+    - src_ids: A list of image source ids. When not None, the limits apply only to recordings of these sources and
+               override the limits set for all sources until clear_record_segments() is called.
+    """
+    segments = {"duration": duration, "frames": frames, "size": size}
+    if src_ids is None:
+        _rec_state["segments"] = segments
+    else:
+        for src_id in src_ids:
+            _rec_state[("source_segments", src_id)] = segments
+
+
+def clear_record_segments(src_ids):
+    """
+    Remove the segment limits set for specific image sources (see set_record_segments()). Recordings of these
+    sources are split according to the limits set for all sources again.
+
+    Args:
+    - src_ids: A list of image source ids.
+    """
+    for src_id in src_ids:
+        if _rec_state.exists(("source_segments", src_id)):
+            _rec_state.delete(("source_segments", src_id))
+
+
+def get_record_segments(src_id=None):
+    """
+    Return the current segment limits (see set_record_segments()) as a dict with duration, frames and size keys.
+
+    Args:
+    - src_id: When not None, return the limits used for recordings of this image source.
+    """
+    if src_id is not None and _rec_state.exists(("source_segments", src_id)):
+        return _rec_state[("source_segments", src_id)]
+
+    return _rec_state.get("segments", None) or {
+        "duration": None,
+        "frames": None,
+        "size": None,
+    }
+
+
 def start_record(src_ids=None):
     """
     Start recording video from each of the ImageSources in the src_ids list or from currently selected image sources.
     When a camera trigger is used, if the trigger is already on, it is first stopped, then, after 0.5 seconds, recording starts, and
     after an additional 0.5 seconds the trigger is started again.
 
+    Video writers that keep pre-roll frames (see video_write.VideoWriter) start recording immediately, and their
+    recordings begin preroll seconds before this function was called.
+
     Args:
     - src_ids: a list of ImageSource ids to record from or None to use the list of currently selected sources.
     """
@@ -268,10 +375,18 @@ def start_record(src_ids=None):
     if len(src_ids) == 0:
         return
 
+    _check_recordable(src_ids)
+
+    request_time = time.time()
+    preroll_ids = [src_id for src_id in src_ids if video_writers[src_id].preroll]
+    for src_id in preroll_ids:
+        video_writers[src_id].start_observing(request_time)
+
     def standby():
         _rec_state["is_recording"] = True
         for src_id in src_ids:
-            video_writers[src_id].start_observing()
+            if src_id not in preroll_ids:
+                video_writers[src_id].start_observing()
 
     if has_trigger():
         _do_restore_trigger = True
@@ -315,12 +430,79 @@ def stop_record(src_ids=None):
     Timer(0.5, stop).start()
 
 
+def start_gated_record(obs_id, src_ids=None, **params):
+    """
+    Start recording clips from each of the ImageSources in src_ids only while the output of an image observer
+    indicates activity, e.g. motion (see recording_gate.py). Clips include pre-roll frames when the video writers keep
+    them (see the video_record preroll config). The clips are listed in a clip index csv file, which is stored in the
+    current session directory if one exists, or in the media directory otherwise.
+
+    Return the clip index file path.
+
+    Args:
+    - obs_id: The id of the ImageObserver providing the signal. It's started if it's not already observing.
+    - src_ids: A list of ImageSource ids or None to use the list of currently selected sources.
+    - params: RecordingGate parameters (signal, on_threshold, off_threshold, start_delay, post_roll,
+              min_clip_length). Missing parameters are taken from the video_record gate config.
+    """
+    global _gate
+
+    if _gate is not None:
+        raise Exception("Gated recording is already running")
+
+    if src_ids is None:
+        src_ids = _rec_state["selected_sources"]
+
+    if len(src_ids) == 0:
+        raise ValueError("No image sources were selected for gated recording")
+
+    _check_recordable(src_ids)
+
+    obs = image_observers[obs_id]
+    if not _state.get(("video", "image_observers", obs_id, "observing"), False):
+        obs.start_observing()
+
+    no_preroll = [src_id for src_id in src_ids if not video_writers[src_id].preroll]
+    if len(no_preroll) > 0:
+        _log.warning(
+            f"Clips will not include frames from before the signal onset. Pre-roll is disabled for: {', '.join(no_preroll)}"
+        )
+
+    write_dir = _state.get(("session", "data_dir"), get_config().media_dir)
+    index_path = video_write.get_write_path(
+        "clips", write_dir, "csv", _rec_state["filename_prefix"], datetime.now()
+    )
+
+    _gate = recording_gate.RecordingGate(
+        obs,
+        {src_id: video_writers[src_id] for src_id in src_ids},
+        index_path,
+        state=_state,
+        **{**get_config().video_record["gate"], **params},
+    )
+    _gate.start()
+    return index_path
+
+
+def stop_gated_record():
+    """
+    Stop gated recording. A clip that's being recorded is stopped immediately.
+    """
+    global _gate
+
+    if _gate is None:
+        return
+
+    _gate.stop()
+    _gate = None
+
+
 def capture_images(src_ids=None, filename_prefix=""):
     """
     Save the latest image data of ImageSources to files. Images are stored
     in the current session directory if one exists, or in the media directory otherwise.
-    An images with type `uint8` will be saved to jpeg files.
-    Any other array type will be saved to pickle files.
+    Images with type `uint8` will be saved to jpeg files, and images with type `uint16` to 16 bit png files.
+    Any other array type will be saved to pickle files (see video_write.save_image()).
 
     Args:
     - src_ids: A list of ImageSource ids as they appear in the keys of the `video_system.image_sources`.
@@ -338,6 +520,60 @@ def capture_images(src_ids=None, filename_prefix=""):
         _log.info(f"Saved image from image_source '{src.id}' in {p}")
 
 
+def capture_burst(count, src_ids=None, filename_prefix="", write_dir=None, format=None, every=1):
+    """
+    Start capturing `count` consecutive images from each ImageSource without blocking, and save each image to a
+    separate file (see image_capture.py). Images are stored in write_dir if supplied, otherwise in the current session
+    directory if one exists, or in the media directory. The capture progress is published to the state store under
+    ("video", "captures", <capture id>).
+
+    Return a concurrent.futures.Future that resolves to a dict of results for each source id (see
+    image_capture.capture()).
+
+    Args:
+    - count: The number of images to capture from each source.
+    - src_ids: A list of ImageSource ids. The currently selected sources are used when None.
+    - filename_prefix: str. A prefix for the filenames of the created files.
+    - write_dir: The directory where images are written.
+    - format: The image file format (see image_capture.formats), or None to use the configured default.
+    - every: Capture every nth image.
+    """
+    if src_ids is None:
+        src_ids = _rec_state["selected_sources"]
+
+    if write_dir is None:
+        write_dir = _state.get(("session", "data_dir"), get_config().media_dir)
+
+    future = image_capture.capture(
+        [image_sources[src_id] for src_id in src_ids],
+        count,
+        write_dir,
+        filename_prefix,
+        format,
+        every,
+        state=_state.get_cursor(("video", "captures")),
+    )
+    _log.info(f"Capturing {count} images from image sources: {', '.join(src_ids)}")
+    return future
+
+
+def get_latency_stats():
+    """
+    Return a dict with the current latency stats summary (see video_stream.LatencyStats.summary()) of every image
+    source, image observer and video writer, keyed by their ids.
+
+    Unlike the summaries published to the state store, these are read directly from shared memory. Counters are
+    updated when the summaries are published.
+    """
+    return {
+        "image_sources": {id: src.stats.summary() for id, src in image_sources.items()},
+        "image_observers": {
+            id: obs.stats.summary() for id, obs in image_observers.items()
+        },
+        "video_writers": {id: w.stats.summary() for id, w in video_writers.items()},
+    }
+
+
 def set_filename_prefix(prefix):
     """
     Set the filename prefix for any video or image files that will be saved in the future.
@@ -380,13 +616,14 @@ def find_image_classes(warn=False):
             image_class_params[name] = cls.default_params
 
 
-def init(state: managed_state.Cursor):
+def init(state: managed_state.Cursor, config: dict = None):
     """
     Initialize the video system. Find all ImageSource and ImageObserver classes. Read the
     video config file, and setup the video system according to the configuration.
 
     Args:
     - state: A Cursor to the root of the main process state store.
+    - config: A video configuration dict to use instead of the video config file (the file is not read or modified).
     """
     global _log, _state, video_config, _rec_state
     _log = get_main_logger()
@@ -394,7 +631,9 @@ def init(state: managed_state.Cursor):
     _rec_state = state.get_cursor(("video", "record"))
 
     config_path = get_config().video_config_path
-    if not config_path.exists():
+    if config is not None:
+        video_config = config
+    elif not config_path.exists():
         video_config = {
             "image_sources": {},
             "image_observers": {},
@@ -417,10 +656,11 @@ def init(state: managed_state.Cursor):
     _load_video_config(video_config)
     _load_video_writers()
 
-    if has_trigger() and get_config().video_record["start_trigger_on_startup"]:
-        start_trigger()
-    else:
-        stop_trigger()
+    if has_trigger():
+        if get_config().video_record["start_trigger_on_startup"]:
+            start_trigger()
+        else:
+            stop_trigger()
 
 
 def start_processes():
@@ -449,6 +689,10 @@ def shutdown_video():
     Shutdown all ImageSource and ImageObserver processes. Blocks until
     all processes terminate.
     """
+    http_streaming.stop_all()
+    image_capture.stop_all()
+    stop_gated_record()
+
     for w in video_writers.values():
         try:
             w.stop_observing()
@@ -469,6 +713,8 @@ def shutdown_video():
     for obs in image_observers.values():
         obs.join()
 
+    shutdown_listeners()
+
     if has_trigger():
         start_trigger(update_state=False)
 
@@ -484,6 +730,14 @@ def shutdown_video():
     for img_src in image_sources.values():
         img_src.join()
 
+    for proc in [*video_writers.values(), *image_observers.values()]:
+        proc.output_buf.unlink()
+        proc.stats.unlink()
+
+    for img_src in image_sources.values():
+        img_src.frame_buf.unlink()
+        img_src.stats.unlink()
+
     if "video" in _state:
         _state.delete("video")
 
@@ -506,3 +760,4 @@ def shutdown():
     Shutdown video system.
     """
     shutdown_video()
+    image_capture.shutdown()
@@ -4,15 +4,22 @@ Writing image data to video files and images.
 Author: Tal Eisenberg, 2021
 """
 from pathlib import Path
+import os
+import sys
 import time
 from datetime import datetime
 from video_stream import ImageObserver, ImageSource
 import imageio
+import imageio_ffmpeg
+import numpy as np
+import subprocess
+import collections
 import pickle
-import queue
 import threading
 import json
-from image_utils import convert_to_8bit
+from image_utils import Converter8bit
+import frame_timestamps
+import raw_video
 
 
 def get_write_path(
@@ -43,6 +50,7 @@ def save_image(image, src_id, write_dir, filename_prefix, timestamp):
     """
     Save an image to file.
     An `image` with type `uint8` will be saved to a jpeg file.
+    An `image` with type `uint16` will be saved to a 16 bit png file, keeping its full bit depth.
     Any other array type will be saved to a pickle file.
 
     Args:
@@ -54,10 +62,10 @@ def save_image(image, src_id, write_dir, filename_prefix, timestamp):
 
     """
     dt = datetime.fromtimestamp(timestamp)
-    ext = "jpg" if image.dtype == "uint8" else "pickle"
+    ext = {"uint8": "jpg", "uint16": "png"}.get(image.dtype.name, "pickle")
     path = get_write_path(src_id, write_dir, ext, filename_prefix, dt)
 
-    if image.dtype == "uint8":
+    if ext != "pickle":
         imageio.imwrite(str(path), image)
     else:
         with open(path, "wb") as f:
@@ -66,6 +74,333 @@ def save_image(image, src_id, write_dir, filename_prefix, timestamp):
     return path
 
 
+class FramePool:
+    """
+    A fixed number of preallocated frame buffers that are handed from a producer thread to a consumer thread in FIFO
+    order. The producer acquires a free frame, fills it and submits it. The consumer gets the oldest submitted frame
+    and releases it once it's done with it.
+
+    When there are no free frames, acquire() follows one of these policies:
+    - "block": Wait until the consumer releases a frame.
+    - "drop_newest": Return None, i.e. the new frame is dropped.
+    - "drop_oldest": Reuse the oldest submitted frame that the consumer didn't get yet, dropping it.
+    Dropped frames are counted in `dropped`.
+    """
+
+    policies = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, size, shape, dtype, policy="block"):
+        """
+        Args:
+        - size: The number of frames in the pool. Must be at least 2.
+        - shape: The shape of each frame.
+        - dtype: The dtype of each frame.
+        - policy: The policy when there are no free frames (see above).
+        """
+        if policy not in self.policies:
+            raise ValueError(f"Invalid frame pool policy: {policy}")
+        if size < 2:
+            raise ValueError(f"Invalid frame pool size: {size}")
+
+        self.size = size
+        self.policy = policy
+        self.frames = np.zeros((size, *shape), dtype)
+
+        self._cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        """
+        Make all frames free and reset the drop count. Should not be called while the pool is in use.
+        """
+        self._free = collections.deque(range(self.size))
+        self._ready = collections.deque()
+        self._closed = False
+        self.dropped = 0
+
+    def ready_count(self):
+        """
+        Return the number of submitted frames waiting for the consumer.
+        """
+        return len(self._ready)
+
+    def acquire(self):
+        """
+        Return the index of a free frame, or None if the frame should be dropped (see class docstring).
+        """
+        with self._cond:
+            while len(self._free) == 0:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return None
+
+                if self.policy == "drop_oldest" and len(self._ready) > 0:
+                    self.dropped += 1
+                    idx, _ = self._ready.popleft()
+                    return idx
+
+                self._cond.wait()
+
+            return self._free.popleft()
+
+    def submit(self, idx, info=None):
+        """
+        Pass the frame with index `idx` to the consumer along with `info`.
+        """
+        with self._cond:
+            self._ready.append((idx, info))
+            self._cond.notify_all()
+
+    def get(self):
+        """
+        Wait for the oldest submitted frame and return (idx, info), or None once the pool is closed and there are no
+        more submitted frames.
+        """
+        with self._cond:
+            while len(self._ready) == 0:
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+            return self._ready.popleft()
+
+    def release(self, idx):
+        """
+        Return a frame to the pool once the consumer is done with it.
+        """
+        with self._cond:
+            self._free.append(idx)
+            self._cond.notify_all()
+
+    def trim(self, predicate):
+        """
+        Drop submitted frames, starting from the oldest, as long as predicate(info) returns True for the oldest
+        frame. Return the number of frames that were dropped. These are not counted in `dropped`.
+        """
+        count = 0
+        with self._cond:
+            while len(self._ready) > 0 and predicate(self._ready[0][1]):
+                idx, _ = self._ready.popleft()
+                self._free.append(idx)
+                count += 1
+
+            self._cond.notify_all()
+
+        return count
+
+    def close(self):
+        """
+        Make get() return None once all submitted frames are consumed.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FFmpegPipeWriter:
+    """
+    Write raw frames to a video file by streaming them to the stdin of an ffmpeg process, writing each frame in a
+    single call without converting it first. BGR frames are passed as is (pix_fmt_in "bgr24").
+
+    Accepts the same encoding parameters as imageio.get_writer() with the FFMPEG format (codec, quality, bitrate,
+    pixelformat, macro_block_size, ffmpeg_log_level, input_params and output_params), and builds the same ffmpeg
+    command.
+    """
+
+    # Size of the stdin pipe buffer in bytes (Linux only)
+    pipe_size = 1 << 20
+
+    def __init__(
+        self,
+        path,
+        size,
+        pix_fmt_in,
+        fps,
+        codec=None,
+        quality=5,
+        bitrate=None,
+        pixelformat="yuv420p",
+        macro_block_size=16,
+        ffmpeg_log_level="warning",
+        input_params=None,
+        output_params=None,
+    ):
+        """
+        Args:
+        - path: The video file path.
+        - size: The (width, height) of each frame.
+        - pix_fmt_in: The ffmpeg pixel format of the frames, e.g. "gray", "bgr24" or "rgb24".
+        - fps: The video frame rate.
+        - See imageio.get_writer() for the rest.
+        """
+        if codec is None:
+            codec = "libx264"
+
+        cmd = [
+            imageio_ffmpeg.get_ffmpeg_exe(),
+            "-y",
+            "-f", "rawvideo",
+            "-vcodec", "rawvideo",
+            "-s", f"{size[0]}x{size[1]}",
+            "-pix_fmt", pix_fmt_in,
+            "-r", f"{fps:.02f}",
+            *(input_params or []),
+            "-i", "-",
+            "-an",
+            "-vcodec", codec,
+            "-pix_fmt", pixelformat or "yuv420p",
+        ]
+
+        if bitrate is not None:
+            cmd += ["-b:v", str(bitrate)]
+        elif quality is not None:
+            quality = 1 - quality / 10.0
+            if codec == "libx264":
+                cmd += ["-crf", str(int(quality * 51))]
+            else:
+                cmd += ["-qscale:v", str(int(quality * 30) + 1)]
+
+        mbs = macro_block_size or 1
+        if size[0] % mbs > 0 or size[1] % mbs > 0:
+            out_w = size[0] + (-size[0] % mbs)
+            out_h = size[1] + (-size[1] % mbs)
+            cmd += ["-vf", f"scale={out_w}:{out_h}"]
+
+        cmd += ["-v", ffmpeg_log_level or "warning", *(output_params or []), str(path)]
+
+        self.cmd = cmd
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+
+        try:
+            import fcntl
+
+            fcntl.fcntl(self.proc.stdin.fileno(), fcntl.F_SETPIPE_SZ, self.pipe_size)
+        except (ImportError, AttributeError, OSError):
+            pass
+
+    def append_data(self, img):
+        """
+        Write a frame. img must be a C-contiguous array with the size and pixel format given to the constructor.
+        """
+        self.proc.stdin.write(img.data)
+
+    def close(self):
+        """
+        Close the pipe and wait for ffmpeg to finish writing the video file.
+        """
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+        if self.proc.wait() != 0:
+            raise OSError(
+                f"ffmpeg exited with code {self.proc.returncode}. Command: {' '.join(self.cmd)}"
+            )
+
+    def abort(self):
+        """
+        Terminate ffmpeg without finishing the video file.
+        """
+        self.proc.kill()
+        self.proc.wait()
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+
+def can_encode(image_shape):
+    """
+    Return True if frames with shape `image_shape` can be encoded by open_encoder(), i.e. they're grayscale
+    (height, width) or BGR (height, width, 3) images.
+    """
+    return len(image_shape) == 2 or (len(image_shape) == 3 and image_shape[2] == 3)
+
+
+def open_encoder(vid_path, image_shape, frame_rate, encoding_params, backend="ffmpeg_pipe"):
+    """
+    Start encoding a video file, and return a writer with append_data(img) and close() methods. This is the encoder
+    used by VideoWriter for each video file.
+
+    Args:
+    - vid_path: The video file path.
+    - image_shape: The shape of each frame. Frames are uint8, either grayscale (height, width) or BGR
+                   (height, width, 3).
+    - frame_rate: The video frame rate.
+    - encoding_params: Encoding parameters as in the video_record encoding_configs (see imageio.get_writer()).
+    - backend: "ffmpeg_pipe" or "imageio". The imageio writer expects RGB frames, so BGR frames should be converted
+               by the caller (see prepare_encoder_frame()).
+    """
+    if not can_encode(image_shape):
+        raise ValueError(f"Unsupported image shape: {image_shape}")
+
+    if backend == "ffmpeg_pipe":
+        pix_fmt_in = "gray" if len(image_shape) == 2 else "bgr24"
+
+        return FFmpegPipeWriter(
+            vid_path,
+            (image_shape[1], image_shape[0]),
+            pix_fmt_in,
+            frame_rate,
+            **encoding_params,
+        )
+    elif backend == "imageio":
+        return imageio.get_writer(
+            str(vid_path),
+            format="FFMPEG",
+            mode="I",
+            fps=frame_rate,
+            **encoding_params,
+        )
+    else:
+        raise ValueError(f"Invalid video encoder backend: {backend}")
+
+
+def prepare_encoder_frame(img, backend="ffmpeg_pipe"):
+    """
+    Return a frame that can be passed to the append_data() method of a writer returned by open_encoder().
+    """
+    if backend == "imageio" and img.ndim == 3 and img.shape[2] == 3:
+        return img[..., ::-1]
+
+    return img
+
+
+class VideoSegment:
+    """
+    A single video file written by a VideoWriter, along with its timestamps (see frame_timestamps) and metadata files.
+    """
+
+    def __init__(self, index, vid_path, ts_path, metadata_path, writer, ts_writer):
+        self.index = index
+        self.vid_path = vid_path
+        self.ts_path = ts_path
+        self.metadata_path = metadata_path
+        self.writer = writer
+        self.ts_writer = ts_writer
+        self.write_failed = False
+        self.frame_count = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def add_frame(self, timestamp):
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+        self.frame_count += 1
+
+    def manifest_entry(self):
+        return {
+            "index": self.index,
+            "video": self.vid_path.name,
+            "timestamps": self.ts_path.name,
+            "frame_count": self.frame_count,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+        }
+
+
 class VideoWriter(ImageObserver):
     """
     VideoWriter - a video_stream.ImageObserver that writes image data to video files.
@@ -74,14 +409,79 @@ class VideoWriter(ImageObserver):
     single ImageSource and writes its buffer contents whenever the buffer is updated.
     Use `ImageObserver.start_observing()` and `ImageObserver.stop_observing()` to start or stop
     writing the image stream.
+
+    Each image is copied (and converted to 8 bits if necessary) into a preallocated FramePool, and written to the
+    video file by a separate thread. When the pool is full, because the encoder can't keep up, the pool policy
+    determines whether the writer waits, or drops the newest or oldest frame. The timestamps of written frames are
+    stored in a binary file next to the video (see frame_timestamps), and optionally in a csv file as well.
+
+    In addition to the ImageObserver latency stages, the writer measures (published under the "write_latency" key of
+    the image source state):
+    - write_queue: The time each image waits in the frame pool.
+    - encode: The time it takes to encode and write each image.
+    - frame_to_encoded: From the image timestamp until the image is written to the video file.
+    The following counters are published as well:
+    - dropped_writes: Frames dropped according to the pool policy.
+    - torn_writes: Frames that were overwritten in the image source buffer while being copied.
+    - missed_frames_count: Frame intervals that were longer than expected according to frame_rate.
+    - max_queued_items: The max number of frames waiting in the pool.
+    The path of the current (or last) video file is published under the "video_path" key of the image source state
+    when writing starts.
+
+    Long recordings can be split into consecutive segment files according to the "segments" key of the video record
+    state, or the image source's entry under its "source_segments" key (see video_system.set_record_segments()). A
+    new segment starts when the current one reaches its duration (in frame timestamp time), number of frames or file
+    size (in bytes, as flushed by the encoder and checked about once a second, so segments may end up somewhat
+    larger). The next segment is opened in the background while the current one is written, and the
+    writer switches to it between two frames, so no frames are lost when splitting. Each segment has its own
+    timestamps and metadata files, named after the segment video file (<stem>_<index>.<ext>), and the segments of a
+    recording are listed in order in <stem>_segments.json along with their frame counts and first and last timestamps.
+
+    Raw recording: With the "raw" backend, frames are not encoded or converted to 8 bits. They're copied as is into
+    preallocated, memory-mapped raw chunk files (see raw_video.RawChunkWriter) of up to raw_chunk_size bytes each,
+    which are written to disk in blocks of raw_sync_size bytes. This keeps the full bit depth of 16 bit sources at
+    little CPU cost. Chunks are written as segments (see above), so a new chunk starts whenever the current one is
+    full. When raw_transcode is "ffv1" or "hdf5", each closed chunk is converted to a lossless compressed file by a
+    low priority background process (see raw_video.transcode()), which deletes the chunk when it's done.
+
+    Pre-roll: When preroll is larger than 0 the writer keeps observing its image source while it's not recording, and
+    keeps the most recent preroll seconds of (8 bit) frames in memory, in a frame pool that drops its oldest frames
+    when it's full. The pool size is limited by preroll_max_memory. When recording starts, the frames in the pool are
+    written to the file before any new frame, so the recording begins with the frames whose timestamps are up to
+    preroll seconds before recording was requested (see start_observing()). In this
+    mode start_observing() and stop_observing() start and stop recording, while the observer process keeps running
+    (the "prerolling" state key is True while it does).
     """
 
+    latency_stages = (
+        *ImageObserver.latency_stages,
+        "write_queue",
+        "encode",
+        "frame_to_encoded",
+    )
+    latency_counters = (
+        *ImageObserver.latency_counters,
+        "dropped_writes",
+        "torn_writes",
+        "missed_frames_count",
+        "max_queued_items",
+    )
+    stats_state_key = "write_latency"
+
     def __init__(
         self,
         config: dict,
         encoding_params,
         frame_rate,
-        queue_max_size,
+        pool_size,
+        pool_policy,
+        backend,
+        raw_chunk_size,
+        raw_sync_size,
+        raw_transcode,
+        timestamps_csv,
+        preroll,
+        preroll_max_memory,
         media_dir,
         file_ext,
         image_source: ImageSource,
@@ -96,7 +496,17 @@ class VideoWriter(ImageObserver):
             - encoding_params: A dictionary of video encoding parameters. These are passed to the function imageio.get_writer
                                See available options here: https://imageio.readthedocs.io/en/stable/format_ffmpeg.html
             - frame_rate: Used for setting the video rate and measuring potential missing frames
-            - queue_max_size: The max size of the writing queue. If <=0 the queue is inifinite (the default)
+            - pool_size: The number of frames in the frame pool (see FramePool)
+            - pool_policy: What to do when the frame pool is full: "block", "drop_newest" or "drop_oldest"
+            - backend: "ffmpeg_pipe" to stream frames to ffmpeg directly (see FFmpegPipeWriter), "imageio", or "raw" to
+                       write frames to raw chunk files (see above)
+            - raw_chunk_size: The max size of each raw chunk file in bytes ("raw" backend only)
+            - raw_sync_size: The number of bytes written to disk at once ("raw" backend only)
+            - raw_transcode: None, "ffv1" or "hdf5" (see above, "raw" backend only)
+            - timestamps_csv: Whether to write a timestamps csv file in addition to the binary timestamps file
+            - preroll: The number of seconds of frames to keep in memory and write when recording starts, or 0 to disable
+                       pre-roll (see above)
+            - preroll_max_memory: The max size of the pre-roll frame pool in bytes
             - media_dir: The writer writes to the session directory when there's an open session. Otherwise it will use this directory.
             - file_ext: Video filename suffix after the dot
             - image_source: The observed ImageSource
@@ -105,11 +515,35 @@ class VideoWriter(ImageObserver):
         """
         self.img_src_id = image_source.id
         self.scaling_8bit = image_source.scaling_8bit
+        self.converter_8bit = Converter8bit(self.scaling_8bit)
         self.encoding_params = encoding_params
         self.media_dir = media_dir
         self.frame_rate = frame_rate
         self.file_ext = file_ext
-        self.queue_max_size = queue_max_size
+        self.pool_size = pool_size
+        self.pool_policy = pool_policy
+        self.backend = backend
+        self.raw_chunk_size = raw_chunk_size
+        self.raw_sync_size = raw_sync_size
+        self.raw_transcode = raw_transcode
+        self.timestamps_csv = timestamps_csv
+        self.preroll = preroll
+        self.preroll_max_memory = preroll_max_memory
+
+        if pool_policy not in FramePool.policies:
+            raise ValueError(f"Invalid write pool policy: {pool_policy}")
+        if backend not in ("ffmpeg_pipe", "imageio", "raw"):
+            raise ValueError(f"Invalid video writer backend: {backend}")
+        if raw_transcode not in (None, "ffv1", "hdf5"):
+            raise ValueError(f"Invalid raw transcode format: {raw_transcode}")
+
+        if backend == "raw":
+            self.file_ext = raw_video.file_ext
+
+        # with pre-roll the observer keeps running between recordings, and the writing state is updated by the writer
+        self._writing_state_key = running_state_key
+        if preroll:
+            running_state_key = "prerolling"
 
         super().__init__(
             type(self).__name__,
@@ -121,97 +555,439 @@ class VideoWriter(ImageObserver):
             running_state_key,
         )
 
-    def _init(self):
-        super()._init()
+    def start(self):
+        super().start()
+        if self.preroll:
+            super().start_observing()
 
-        if len(self.image_shape) == 3 and self.image_shape[2] == 3:
-            self.convert_bgr = True
+    def start_observing(self, request_time=None):
+        """
+        Start writing video. With pre-roll, the recording starts with the frames kept in memory.
+
+        Args:
+        - request_time: With pre-roll, the recording starts with the frames whose timestamps are at most preroll
+                        seconds older than this time (in seconds since epoch). Defaults to the current time.
+
+        NOTE: Can only be called from the main process
+        """
+        if self.preroll:
+            if request_time is None:
+                request_time = time.time()
+            self.parent_pipe.send(("record", request_time))
+        else:
+            super().start_observing()
+
+    def stop_observing(self):
+        """
+        Stop writing video. With pre-roll, the writer goes back to keeping recent frames in memory.
+
+        NOTE: Can only be called from the main process
+        """
+        if self.preroll:
+            self.parent_pipe.send("stop_record")
         else:
-            self.convert_bgr = False
+            super().stop_observing()
+
+    def shutdown(self):
+        if self.preroll:
+            super().stop_observing()
+        super().shutdown()
+
+    def _init(self):
+        super()._init()
 
         self.prev_timestamp = None  # for missing frames alert
-        self.q = None
+        self.pool = None
+        self.write_thread = None
+        self.finish_threads = []
+
+        # raw chunks store frames as they are. otherwise frames are converted to 8 bits
+        self.frame_dtype = self._img_src_buf_dtype if self.backend == "raw" else "uint8"
+        frame_size = int(np.prod(self.image_shape)) * np.dtype(self.frame_dtype).itemsize
+
+        if self.backend == "raw":
+            self.raw_chunk_frames = max(self.raw_chunk_size // frame_size, 1)
+            self.raw_sync_frames = max(self.raw_sync_size // frame_size, 1)
+
+        if self.preroll:
+            # in addition to the pre-roll frames, the pool has room for pool_size new frames while recording starts
+            preroll_frames = int(np.ceil(self.preroll * self.frame_rate))
+            max_size = self.preroll_max_memory // frame_size
+            self.preroll_pool_size = max(
+                min(preroll_frames + self.pool_size, max_size), self.pool_size + 1
+            )
+            self.preroll_limited = max_size < preroll_frames + self.pool_size
+            if self.preroll_limited:
+                self.preroll = (
+                    self.preroll_pool_size - self.pool_size
+                ) / self.frame_rate
 
     def _on_start(self):
-        if not self.state["acquiring"]:
-            self.log.error("Can't write video. Image source is not acquiring.")
+        self.write_thread = None
+        if not self.preroll:
+            self._start_recording()
             return
 
-        write_dir = self.state.root().get(("session", "data_dir"), self.media_dir)
-        filename_prefix = self.state.root().get(
-            ("video", "record", "filename_prefix"), ""
+        if self.pool is None:
+            self.pool = FramePool(
+                self.preroll_pool_size, self.image_shape, self.frame_dtype, "drop_oldest"
+            )
+        else:
+            self.pool.reset()
+            self.pool.policy = "drop_oldest"
+
+        self.state[self._writing_state_key] = False
+        if self.preroll_limited:
+            self.log.warning(
+                f"Pre-roll is limited by preroll_max_memory to {self.preroll:.2f}s."
+            )
+        else:
+            self.log.info(f"Keeping {self.preroll:.2f}s of pre-roll frames in memory.")
+
+    def _on_command(self, cmd):
+        if isinstance(cmd, tuple) and cmd[0] == "record":
+            self._start_recording(request_time=cmd[1])
+        elif cmd == "stop_record":
+            self._stop_recording()
+
+    def _start_recording(self, request_time=None):
+        if self.write_thread is not None:
+            return
+
+        if self.preroll:
+            # keep only frames from the preroll seconds before recording was requested, and write them before any new
+            # frame. the video file is opened by the write thread, so that new frames keep arriving in the pool in the
+            # meantime.
+            cutoff = request_time - self.preroll
+            self.pool.trim(lambda info: info[1] < cutoff)
+            self.pool.policy = self.pool_policy
+            self.pool.dropped = 0
+        else:
+            if not self.state["acquiring"]:
+                self.log.error("Can't write video. Image source is not acquiring.")
+                return
+
+            self._open_recording()
+
+            if self.pool is None:
+                self.pool = FramePool(
+                    self.pool_size, self.image_shape, self.frame_dtype, self.pool_policy
+                )
+            else:
+                self.pool.reset()
+
+        self.max_queued_items = 0
+        self.dropped_writes = 0
+
+        self.missed_frames_count = 0
+        self.missed_frame_events = 0
+        self.torn_writes = 0
+        self.prev_timestamp = None
+        self.avg_frame_time = float("nan")
+        self.frame_count = 0
+
+        self.write_thread = threading.Thread(target=self.write_queue)
+        self.write_thread.start()
+
+    def _open_recording(self):
+        """
+        Read the recording settings from the state store, and open the first segment of a new recording.
+        """
+        root = self.state.root()
+        write_dir = root.get(("session", "data_dir"), self.media_dir)
+        filename_prefix = root.get(("video", "record", "filename_prefix"), "")
+        segments = (
+            root.get(("video", "record", "source_segments", self.img_src_id), None)
+            or root.get(("video", "record", "segments"), None)
+            or {}
+        )
+        self.segment_duration = segments.get("duration")
+        self.segment_frames = segments.get("frames")
+        self.segment_size = segments.get("size")
+        self.segmented = self.backend == "raw" or any(
+            (self.segment_duration, self.segment_frames, self.segment_size)
         )
+        self.size_check_frames = max(int(self.frame_rate), 1)
+
         timestamp = datetime.now()
-        vid_path: Path = get_write_path(
+        self.vid_path: Path = get_write_path(
             self.img_src_id,
             write_dir,
             self.file_ext,
             filename_prefix,
             timestamp,
         )
-        ts_path = vid_path.parent / (vid_path.stem + ".csv")
+        self.manifest = []
+        self.manifest_path = self.vid_path.parent / (
+            self.vid_path.stem + "_segments.json"
+        )
+
+        self.next_segment = None
+        self.next_segment_thread = None
+        self.close_threads = []
+
+        self.segment = self._open_segment(0)
+        self.log.info(f"Starting to write video to: {self.segment.vid_path}")
+
+        if self.segmented:
+            self._prepare_next_segment()
+
+    def _open_segment(self, index):
+        """
+        Create the video writer, timestamps file and metadata file of a segment, and return a VideoSegment.
+        When segmentation is disabled there's only one segment, and its files are named without a segment index.
+        """
+        if self.segmented:
+            vid_path = self.vid_path.parent / (
+                f"{self.vid_path.stem}_{index:03d}{self.vid_path.suffix}"
+            )
+        else:
+            vid_path = self.vid_path
+
+        ts_path = frame_timestamps.timestamps_path(vid_path)
+        csv_path = vid_path.parent / (vid_path.stem + ".csv")
         metadata_path = vid_path.parent / (vid_path.stem + ".json")
 
-        self.log.info(f"Starting to write video to: {vid_path}")
-        self.writer = imageio.get_writer(
-            str(vid_path),
-            format="FFMPEG",
-            mode="I",
-            fps=self.frame_rate,
-            **self.encoding_params,
+        if self.backend == "raw":
+            writer = raw_video.RawChunkWriter(
+                vid_path,
+                self.image_shape,
+                self.frame_dtype,
+                self.raw_chunk_frames,
+                self.raw_sync_frames,
+            )
+        else:
+            writer = open_encoder(
+                vid_path,
+                self.image_shape,
+                self.frame_rate,
+                self.encoding_params,
+                self.backend,
+            )
+
+        ts_writer = frame_timestamps.TimestampsWriter(
+            ts_path, csv_path=csv_path if self.timestamps_csv else None
         )
 
-        self.ts_file = open(str(ts_path), "w")
-        self.ts_file.write("timestamp\n")
+        metadata = {
+            "image_source_config": self._img_src_config,
+            "encoding_params": self.encoding_params,
+        }
+        if self.segmented:
+            metadata["segment"] = index
 
         with open(str(metadata_path), "w") as f:
-            json.dump(
-                {
-                    "image_source_config": self._img_src_config,
-                    "encoding_params": self.encoding_params,
-                },
-                f,
-            )
+            json.dump(metadata, f)
 
-        self.q = queue.Queue(self.queue_max_size)
-        self.max_queued_items = 0
+        return VideoSegment(index, vid_path, ts_path, metadata_path, writer, ts_writer)
 
-        self.missed_frames_count = 0
-        self.missed_frame_events = 0
-        self.prev_timestamp = None
-        self.avg_frame_time = float("nan")
-        self.frame_count = 0
+    def _prepare_next_segment(self):
+        """
+        Open the segment following the current one on a separate thread, so that it's ready when the current segment
+        is done.
+        """
+        index = self.segment.index + 1
 
-        self.write_thread = threading.Thread(target=self.write_queue)
-        self.write_thread.start()
+        def open_next():
+            try:
+                self.next_segment = self._open_segment(index)
+            except Exception:
+                self.log.exception(f"Error while opening video segment {index}:")
+
+        self.next_segment = None
+        self.next_segment_thread = threading.Thread(target=open_next)
+        self.next_segment_thread.start()
+
+    def _is_segment_done(self, timestamp):
+        """
+        Return True when the current segment reached any of the segment limits, and the next frame (with the
+        supplied timestamp) should be written to a new segment.
+        """
+        seg = self.segment
+        if seg.frame_count == 0:
+            return False
+
+        if self.backend == "raw" and seg.writer.is_full():
+            return True
+
+        if self.segment_frames and seg.frame_count >= self.segment_frames:
+            return True
+
+        if (
+            self.segment_duration
+            and timestamp - seg.first_timestamp >= self.segment_duration
+        ):
+            return True
+
+        # the file size is checked about once a second, since stat() is too costly to call on every frame
+        if self.segment_size and seg.frame_count % self.size_check_frames == 0:
+            try:
+                return seg.vid_path.stat().st_size >= self.segment_size
+            except FileNotFoundError:
+                return False
+
+        return False
+
+    def _switch_segment(self):
+        """
+        Switch to the pre-opened next segment, and close the current one on a separate thread. When the next segment
+        couldn't be opened, the current segment is kept and another attempt is made.
+        """
+        self.next_segment_thread.join()
+        if self.next_segment is None:
+            self._prepare_next_segment()
+            return
+
+        prev_segment = self.segment
+        self.segment = self.next_segment
+        self.log.info(f"Switching to video segment: {self.segment.vid_path}")
+
+        close_thread = threading.Thread(
+            target=self._close_segment, args=(prev_segment,)
+        )
+        close_thread.start()
+        self.close_threads.append(close_thread)
+
+        self.manifest.append(prev_segment.manifest_entry())
+        self._write_manifest()
+        self._prepare_next_segment()
+
+    def _close_segment(self, seg):
+        try:
+            seg.writer.close()
+            if self.backend == "raw" and self.raw_transcode is not None:
+                self._start_transcode(seg.vid_path)
+        except Exception:
+            self.log.exception(f"Error while closing video file {seg.vid_path}:")
+        finally:
+            seg.ts_writer.close()
+
+    def _start_transcode(self, path):
+        """
+        Start a low priority process that transcodes a closed raw chunk and deletes it (see raw_video.transcode()).
+        """
+        cmd = [
+            sys.executable,
+            raw_video.__file__,
+            str(path),
+            "--format",
+            self.raw_transcode,
+            "--delete",
+        ]
+        if os.name == "posix":
+            cmd = ["nice", "-n", "19", *cmd]
+
+        subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+
+    def _discard_segment(self, seg):
+        """
+        Close and delete the files of a segment that wasn't written to.
+        """
+        if isinstance(seg.writer, FFmpegPipeWriter):
+            seg.writer.abort()
+        else:
+            seg.writer.close()
+
+        seg.ts_writer.close()
+        csv_path = seg.vid_path.parent / (seg.vid_path.stem + ".csv")
+        for path in (seg.vid_path, seg.ts_path, csv_path, seg.metadata_path):
+            path.unlink(missing_ok=True)
+
+    def _write_manifest(self, manifest=None, manifest_path=None):
+        if manifest is None:
+            manifest = self.manifest
+        if manifest_path is None:
+            manifest_path = self.manifest_path
+
+        try:
+            with open(str(manifest_path), "w") as f:
+                json.dump(
+                    {
+                        "image_source": self.img_src_id,
+                        "frame_rate": self.frame_rate,
+                        "segments": manifest,
+                    },
+                    f,
+                    indent=2,
+                )
+        except Exception:
+            self.log.exception("Error while writing video segments manifest:")
 
     def write_queue(self):
         self.write_count = 0
         self.avg_write_time = float("nan")
+        prev_seq = None
+
+        if self.preroll:
+            self.segment = None
+            for finish_thread in self.finish_threads:
+                finish_thread.join()
+            self.finish_threads = []
+
+            try:
+                self._open_recording()
+                self.log.info(f"Writing {self.pool.ready_count()} pre-roll frames.")
+                self.state.update(
+                    (), {self._writing_state_key: True, "video_path": self.vid_path}
+                )
+            except Exception:
+                self.log.exception("Error while starting to write video:")
+        else:
+            self.state["video_path"] = self.vid_path
 
         while True:
-            if self.q.qsize() > self.max_queued_items:
-                self.max_queued_items = self.q.qsize()
+            queued = self.pool.ready_count()
+            if queued > self.max_queued_items:
+                self.max_queued_items = queued
 
-            item = self.q.get()
+            item = self.pool.get()
             if item is None:
                 break
 
             t0 = time.time()
-            img, timestamp = item
+            idx, (seq, timestamp, enqueue_time) = item
+            self.stats.record("write_queue", t0 - enqueue_time)
 
-            if self.convert_bgr:
-                img = img[..., ::-1]
+            if self.segment is None:
+                # the recording couldn't be opened. keep consuming frames so that the image observer doesn't block.
+                self.pool.release(idx)
+                continue
 
-            self.ts_file.write(str(timestamp) + "\n")
+            if self.segmented and self._is_segment_done(timestamp):
+                self._switch_segment()
+
+            img = self.pool.frames[idx]
+            if self.backend != "raw":
+                img = prepare_encoder_frame(img, self.backend)
+
+            seg = self.segment
+            dropped_before = 0 if prev_seq is None else seq - prev_seq - 1
+            seg.ts_writer.append(seq, timestamp, enqueue_time, dropped_before)
+            seg.add_frame(timestamp)
+            prev_seq = seq
             try:
-                self.writer.append_data(img)
+                if seg.write_failed:
+                    pass
+                elif self.backend == "raw":
+                    seg.writer.append_data(img, timestamp)
+                else:
+                    seg.writer.append_data(img)
             except StopIteration:
                 break
+            except OSError:
+                # the ffmpeg process terminated. keep consuming frames so that the image observer doesn't block.
+                self.log.exception("Error while writing image to video file:")
+                seg.write_failed = True
             except Exception:
                 self.log.exception("Error while writing image to video file:")
+            finally:
+                self.pool.release(idx)
+
+            t1 = time.time()
+            dt = t1 - t0
+            self.stats.record("encode", dt)
+            self.stats.record("frame_to_encoded", t1 - timestamp)
 
-            dt = time.time() - t0
             self.write_count += 1
             if self.write_count == 1:
                 self.avg_write_time = dt
@@ -220,9 +996,14 @@ class VideoWriter(ImageObserver):
                     self.avg_write_time * (self.write_count - 1) + dt
                 ) / self.write_count
 
-            self.q.task_done()
-
     def _on_image_update(self, img, timestamp):
+        if self.write_thread is None:
+            if self.preroll and self.pool is not None:
+                # not recording. keep the frame in the pre-roll pool
+                self._submit_frame(img, timestamp)
+
+            return
+
         if self.prev_timestamp is not None:
             delta = timestamp - self.prev_timestamp
 
@@ -241,15 +1022,42 @@ class VideoWriter(ImageObserver):
 
         self.prev_timestamp = timestamp
 
-        if self._img_src_buf_dtype == "uint16":
-            img = convert_to_8bit(img, self.scaling_8bit)
+        self._submit_frame(img, timestamp)
+        self.dropped_writes = self.pool.dropped
 
-        self.q.put((img, timestamp))
+    def _submit_frame(self, img, timestamp):
+        """
+        Copy an image into a frame of the pool, converting it to 8 bits if necessary, and submit it for writing.
+        """
+        idx = self.pool.acquire()
+        if idx is None:
+            return
+
+        frame = self.pool.frames[idx]
+        if self._img_src_buf_dtype == "uint16" and self.frame_dtype == "uint8":
+            self.converter_8bit.convert(img, out=frame)
+        else:
+            np.copyto(frame, img)
+
+        if not self._is_image_valid():
+            # the image was overwritten by the image source while it was copied
+            self.torn_writes += 1
+
+        self.pool.submit(idx, (self._cur_seq, timestamp, time.time()))
 
     def _on_stop(self):
-        if self.write_thread is not None:
-            self.q.put_nowait(None)
-            self.write_thread.join()
+        self._stop_recording()
+        for finish_thread in self.finish_threads:
+            finish_thread.join()
+        self.finish_threads = []
+
+    def _stop_recording(self):
+        if self.write_thread is None:
+            return
+
+        self.pool.close()
+        self.write_thread.join()
+        self.dropped_writes = self.pool.dropped
 
         if self.missed_frames_count > 0:
             s_missed_frames = (
@@ -259,6 +1067,18 @@ class VideoWriter(ImageObserver):
         else:
             s_missed_frames = "."
 
+        if self.dropped_writes > 0:
+            s_missed_frames += (
+                f" {self.dropped_writes} frames were dropped since the encoder couldn't keep up"
+                + f" (policy: {self.pool_policy}, consider increasing write_pool_size)."
+            )
+
+        if self.torn_writes > 0:
+            s_missed_frames += (
+                f" {self.torn_writes} frames were overwritten in the image source buffer while being copied"
+                + " (consider increasing buf_len)."
+            )
+
         avg_frame_rate = 1 / self.avg_frame_time if self.avg_frame_time != 0 else "NaN"
         self.log.info(
             (
@@ -271,5 +1091,53 @@ class VideoWriter(ImageObserver):
         )
 
         self.prev_timestamp = None
-        self.writer.close()
-        self.ts_file.close()
+        self.write_thread = None
+        if self.preroll:
+            self.pool.reset()
+            self.pool.policy = "drop_oldest"
+
+        next_segment = None
+        if self.segment is not None and self.segmented:
+            self.next_segment_thread.join()
+            next_segment = self.next_segment
+
+        finish_args = (
+            self.segment,
+            next_segment,
+            list(self.close_threads) if self.segment is not None and self.segmented else [],
+            list(self.manifest) if self.segment is not None else [],
+            self.manifest_path if self.segment is not None else None,
+        )
+        if self.preroll:
+            # finish the video files on a separate thread, so that pre-roll frames keep arriving while the encoder
+            # flushes. the next recording waits for it before opening new files (see write_queue()).
+            finish_thread = threading.Thread(target=self._finish_recording, args=finish_args)
+            finish_thread.start()
+            self.finish_threads.append(finish_thread)
+        else:
+            self._finish_recording(*finish_args)
+
+    def _finish_recording(self, segment, next_segment, close_threads, manifest, manifest_path):
+        """
+        Close the last segment of a recording, discard the pre-opened next segment, and write the final manifest.
+        """
+        if self.preroll:
+            self.state[self._writing_state_key] = False
+
+        if segment is None:
+            return
+
+        self._close_segment(segment)
+
+        if self.segmented:
+            if next_segment is not None:
+                self._discard_segment(next_segment)
+
+            for close_thread in close_threads:
+                close_thread.join()
+
+            manifest.append(segment.manifest_entry())
+            self._write_manifest(manifest, manifest_path)
+            self.log.info(
+                f"Wrote {len(manifest)} video segments. Manifest: {manifest_path}"
+            )